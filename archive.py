@@ -0,0 +1,69 @@
+import io
+import gzip
+import tarfile
+from typing import IO, Iterator, Tuple
+
+SOURCE_EXTENSIONS = ('.tex', '.bib', '.bbl')
+GZIP_MAGIC = b'\x1f\x8b'
+
+# The e-print endpoint returns either a tarball, a gzipped tarball or a single
+# gzipped .tex file. Members are read straight out of the downloaded bytes so
+# nothing is written to a work directory and archives can be parsed in parallel.
+class SourceArchive:
+    data: bytes
+    file_type: str
+
+    # Only the first header is read to tell the formats apart, the members are
+    # decompressed as they are streamed out
+    def __init__(self, data: bytes):
+        self.data = data
+        self.file_type = 'unknown'
+
+        if self._is_tar():
+            self.file_type = 'tar.gz' if data[:2] == GZIP_MAGIC else 'tar'
+        elif data[:2] == GZIP_MAGIC:
+            try:
+                with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+                    f.read(1)
+            except (OSError, EOFError):
+                return
+            self.file_type = 'gzip'
+
+    def _is_tar(self) -> bool:
+        try:
+            with tarfile.open(fileobj=io.BytesIO(self.data), mode='r|*') as tar:
+                tar.next()
+            return True
+        except (tarfile.TarError, EOFError, OSError):
+            return False
+
+    def is_valid(self) -> bool:
+        return self.file_type != 'unknown'
+
+    # Streams are only readable until the next member is asked for
+    def members(self, extensions: Tuple[str, ...] = SOURCE_EXTENSIONS) -> Iterator[Tuple[str, int, IO[bytes]]]:
+        if self.file_type == 'gzip':
+            # Single file sources are always the main .tex document, the gzip
+            # trailer holds the uncompressed size
+            if '.tex' in extensions:
+                with gzip.GzipFile(fileobj=io.BytesIO(self.data)) as f:
+                    yield 'main.tex', int.from_bytes(self.data[-4:], 'little'), f
+            return
+        if self.file_type not in ('tar', 'tar.gz'):
+            return
+        with tarfile.open(fileobj=io.BytesIO(self.data), mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if not member.name.lower().endswith(extensions):
+                    continue
+                stream = tar.extractfile(member)
+                if stream is None:
+                    continue
+                yield member.name, member.size, stream
+
+    def read_files(self, extensions: Tuple[str, ...]) -> dict:
+        files = {}
+        for name, _, stream in self.members(extensions):
+            files[name] = stream.read()
+        return files
@@ -1,111 +1,169 @@
 import os
 import re
-import json
+import io
+import time
 import magic
-import shutil
-import tarfile
-import gzip
-from typing import List
+import threading
+from contextlib import contextmanager
+from typing import IO, Callable, Dict, List, Set
+from xml.etree import ElementTree
 
 from bs4 import BeautifulSoup
-import requests
 import bibtexparser
 
+from fetch import get_client
+from archive import SourceArchive
+from bib import iter_bib_entries
+from bbl import get_references_from_bbl
+from latex import extract_citations
+from graph import get_graph
+from storage import get_storage
+from search import get_search_index
+from resolver import get_resolver
+from related import notify_references
+from metrics import metrics, timed
+
+# Overridable so ingestion can be pointed at a local stand-in server
+ARXIV_URL = os.environ.get('ARXIV_URL', 'https://arxiv.org')
+ARXIV_API_URL = os.environ.get('ARXIV_API_URL', 'https://export.arxiv.org/api/query')
+METADATA_BATCH_SIZE = 100
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+# .bib files are streamed, this only guards against runaway archives unless forced
+MAX_BIB_SIZE_MB = 512
+BIB_PARSE_BATCH_SIZE = 500
+
+# Lets a background job follow the output of every Logger created on its thread
+log_listeners = threading.local()
+
+def set_log_listener(listener: Callable[[str], None] | None):
+    log_listeners.listener = listener
+
 class Logger:
     log_s: str
+    timings: Dict[str, float]
+    bytes: Dict[str, int]
+    entries: Dict[str, int]
 
-    def __init__(self):
+    def __init__(self, echo: bool = True):
         self.log_s = ''
+        self.echo = echo
+        self.timings = {}
+        self.bytes = {}
+        self.entries = {}
+        self.listener = getattr(log_listeners, 'listener', None)
     
     def log(self, output: str):
-        print(output)
+        if self.echo:
+            print(output)
         self.log_s += output + '\n'
+        if self.listener is not None:
+            self.listener(output)
+
+    # Adds the time spent in the block to the named stage
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0) + duration
+            metrics.observe(name, duration)
+
+    def add_bytes(self, name: str, count: int):
+        self.bytes[name] = self.bytes.get(name, 0) + count
+        metrics.add_bytes(name, count)
+
+    def add_entries(self, name: str, count: int):
+        self.entries[name] = self.entries.get(name, 0) + count
+        metrics.add_entries(name, count)
+
+    # Per-paper stage report, stored in the paper record next to the log
+    def stage_report(self) -> dict:
+        return {
+            "seconds": self.timings,
+            "bytes": self.bytes,
+            "entries": self.entries
+        }
 
 def get_source_file_name(paper_id: str):
     return 'source/' + paper_id.replace('.', '')
 
-def download_arxiv(logger: Logger, paper_id: str):
+def download_arxiv(logger: Logger, paper_id: str) -> bytes | None:
     source_file_name = get_source_file_name(paper_id)
-    url = f'https://arxiv.org/e-print/{paper_id}'
-    response = requests.get(url)
+    url = f'{ARXIV_URL}/e-print/{paper_id}'
+    if not os.path.exists('source'):
+        os.mkdir('source')
+    with logger.stage('download'):
+        response = get_client().get(url, stream_to=source_file_name)
     if response.status_code == 404:
         logger.log(f'Error reading source: recieved 404 for {url}')
         return None
     if response.status_code != 200:
-        raise Exception(f'Error downloading source code for paper {paper_id}\n{response.content.decode()}')
+        raise Exception(f'Error downloading source code for paper {paper_id}\n{response.text}')
     logger.log('Found paper source code, parsing file')
-    if not os.path.exists('source'):
-        os.mkdir('source')
-    with open(source_file_name, 'wb') as f:
-        f.write(response.content)
-    return True
+    with open(source_file_name, 'rb') as f:
+        data = f.read()
+    logger.add_bytes('download', len(data))
+    return data
 
-def unzip(paper_id: str):
-    source_file_name = get_source_file_name(paper_id)
-    with gzip.open(source_file_name) as f:
-        gzip_file = f.read()
-        gzip.decompress(gzip_file)
-        os.remove(source_file_name)
-        with open(source_file_name, 'wb') as f:
-            f.write(source_file_name)
-
-def get_file_type(file_name: str):
-    return magic.from_file(file_name)
-
-def get_files_recursive(folder: str, files: List[str] = [], extension: str = '.tex') -> List[str]:
-    files_copy = []
-    for file in files:
-        files_copy.append(file)
-    for file in os.listdir(folder):
-        if os.path.isdir(folder + '/' + file):
-            for new_file in get_files_recursive(f'{folder}/{file}', [], extension):
-                files_copy.append(new_file)
-        if extension in file:
-            files_copy.append(f'{folder}/{file}')
-    return files_copy
-
-def extract_citations_from_latex(logger: Logger) -> List[str]:
-    citation_pattern = re.compile(r'\\cite.?\{(.*?)\}')
-    citation_keys = set()
-    latex_file_paths = get_files_recursive('tmp')
-    logger.log(f'Found {len(latex_file_paths)} .tex files')
-    for latex_file_path in latex_file_paths:
-        with open(latex_file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-            matches = citation_pattern.findall(content)
-            for match in matches:
-                # Split in case of multiple citations within a single \cite{}
-                keys: List[str] = match.split(',')
-                for key in keys:
-                    citation_keys.add(key.strip())
+def get_file_type(data: bytes):
+    return magic.from_buffer(data)
+
+def extract_citations_from_latex(logger: Logger, archive: SourceArchive) -> Set[str]:
+    latex_files = archive.read_files(('.tex',))
+    logger.log(f'Found {len(latex_files)} .tex files')
+    logger.add_bytes('citations', sum(len(contents) for contents in latex_files.values()))
+    citation_keys, scanned_files = extract_citations(latex_files)
+    logger.add_entries('citations', len(citation_keys))
+    logger.log(f'Scanned {len(scanned_files)} .tex files reachable from the main document')
     return citation_keys
 
-def get_references_for_file(logger: Logger, file_name: str, found_citations: List[str]) -> List[str] | str:
+def get_references_for_file(
+    logger: Logger,
+    file_name: str,
+    file_size: int,
+    stream: IO[bytes],
+    found_citations: Set[str],
+    found_ids: Set[str] | None = None,
+    force: bool = False
+) -> List[str] | str:
     references = []
-    file_size_in_mb = os.stat(file_name).st_size / (1024 * 1024)
-    logger.log(f'.bib file: {file_size_in_mb:.2f}MB')
-    if file_size_in_mb > 10:
+    if found_ids is None:
+        found_ids = set()
+    file_size_in_mb = file_size / (1024 * 1024)
+    logger.log(f'.bib file {file_name}: {file_size_in_mb:.2f}MB')
+    if file_size_in_mb > MAX_BIB_SIZE_MB and not force:
         return f'Large .bib file found size {file_size_in_mb:.2f}MB'
-    with open(file_name, 'r', encoding='utf-8') as f:
+
+    # Only the cited entries are parsed, @string macros are kept so they can be expanded
+    strings = []
+    entries = []
+    total_entries = 0
+    with stream as f:
+        logger.log('Scanning .bib file for cited entries')
+        for entry_type, key, text in iter_bib_entries(f, found_citations):
+            if key is None:
+                strings.append(text)
+                continue
+            total_entries += 1
+            if key in found_ids:
+                continue
+            found_ids.add(key)
+            entries.append(text)
+    logger.log(f'Found {total_entries} cited entries in .bib file')
+
+    prefix = '\n'.join(strings)
+    index = len(found_ids) - len(entries) + 1
+    for i in range(0, len(entries), BIB_PARSE_BATCH_SIZE):
+        batch = entries[i:i + BIB_PARSE_BATCH_SIZE]
         try:
-            logger.log('Loading file into memory')
-            file_contents = f.read()
-            logger.log('Paring .bib file')
-            library = bibtexparser.bparser.parse(file_contents)
-            logger.log('.bib file parsed')
+            library = bibtexparser.bparser.parse(prefix + '\n' + '\n'.join(batch))
         except Exception as e:
             return f'Error parsing .bib file: {e}'
-        logger.log(f'Found {len(library.entries)} entries in .bib file')
-        found_ids = []
-        index = 1
         for entry in library.entries:
-            if entry["ID"] not in found_citations:
-                continue
-            if entry["ID"] in found_ids:
-                continue
             entry["index"] = index
             index += 1
-            found_ids.append(entry["ID"])
             if 'journal' in entry:
                 journal: str = entry["journal"]
                 match = re.findall(r'arxiv:\d{4}.\d{5}', journal.lower())
@@ -123,96 +181,188 @@ def get_references_for_file(logger: Logger, file_name: str, found_citations: Lis
     logger.log(f'Done parsing .bib file, found {len(references)} references')
     return references
 
-def get_references(paper_id: str) -> List[str] | str:
+def get_references_for_bbl_file(logger: Logger, file_name: str, stream: IO[bytes], found_citations: Set[str], found_ids: Set[str]) -> List[dict]:
+    with stream as f:
+        contents = f.read().decode('utf-8', errors='ignore')
+    references = get_references_from_bbl(contents, found_citations, found_ids)
+    logger.log(f'.bbl file {file_name}: found {len(references)} references')
+    return references
+
+# Parse stages of get_references, no network or storage access so it can run in worker processes
+def parse_source(logger: Logger, source_data: bytes, force: bool = False) -> List[dict] | str:
+    with logger.stage('archive'):
+        archive = SourceArchive(source_data)
+    logger.add_bytes('archive', len(source_data))
+    if not archive.is_valid():
+        file_type = get_file_type(source_data)
+        err = f'Downloaded archive is not the correct type (file type: {file_type})'
+        logger.log(err)
+        return err # Bail if not tarfile or gzip
+    logger.log(f'Reading source archive ({archive.file_type})')
+
+    logger.log('Extracting citations .tex files')
+    with logger.stage('citations'):
+        citations = extract_citations_from_latex(logger, archive)
+    logger.log(f'Found {len(citations)} citations')
+    references = []
+    found_ids = set()
+    found_bib_file = False
+    # A compiled .bbl holds exactly the cited entries, so it is preferred over the .bib files
+    with logger.stage('bbl'):
+        for bbl_file, bbl_size, bbl_stream in archive.members(('.bbl',)):
+            found_bib_file = True
+            logger.add_bytes('bbl', bbl_size)
+            for reference in get_references_for_bbl_file(logger, bbl_file, bbl_stream, citations, found_ids):
+                references.append(reference)
+    logger.add_entries('bbl', len(references))
+    if len(references) == 0:
+        with logger.stage('bib'):
+            for bib_file, bib_size, bib_stream in archive.members(('.bib',)):
+                found_bib_file = True
+                logger.add_bytes('bib', bib_size)
+                references_data = get_references_for_file(logger, bib_file, bib_size, bib_stream, citations, found_ids, force)
+                if type(references_data) == type(''):
+                    logger.log(references_data)
+                    continue
+                for reference in references_data:
+                    references.append(reference)
+                logger.add_entries('bib', len(references_data))
+    if not found_bib_file:
+        err = 'Could not find .bib or .bbl file in source'
+        logger.log(err)
+        return err
+
+    logger.log(f'Found {len(references)} of {len(citations)} citations')
+    return references
+
+def get_references(paper_id: str, force: bool = False, logger: Logger | None = None) -> List[str] | str:
     paper_id = paper_id
     cleaned_id = paper_id.replace('.', '')
     source_file_name = f'source/{cleaned_id}'
-    references_file_name = f'references/{cleaned_id}.json'
-    logger = Logger()
+    if logger is None:
+        logger = Logger()
 
     if not os.path.exists('source'):
         os.mkdir('source')
 
-    if not os.path.exists('references'):
-        os.mkdir('references')
+    cached_references = get_storage().get_references(paper_id)
+    if cached_references is not None:
+        return cached_references, logger.log_s
 
-    if os.path.exists(references_file_name):
-        with open(references_file_name, 'r') as f:
-            return json.load(f), logger.log_s
-    
-    if not os.path.exists(source_file_name):
+    if os.path.exists(source_file_name):
+        with logger.stage('read'):
+            with open(source_file_name, 'rb') as f:
+                source_data = f.read()
+        logger.add_bytes('read', len(source_data))
+    else:
         logger.log('Attempting to download source')
-        res = download_arxiv(logger, paper_id)
-        if res is None:
+        source_data = download_arxiv(logger, paper_id)
+        if source_data is None:
             err = 'Could not download arxiv archive'
             logger.log(err)
             return err, logger.log_s # Bail if not downloaded
-    
-    if os.path.exists('tmp'):
-        shutil.rmtree('tmp')
-    os.mkdir('tmp')
-
-    try:
-        if not tarfile.is_tarfile(source_file_name): # Assuming it's a gzip file
-            unzip(paper_id) # Unzip to tar file
-        
-        if not tarfile.is_tarfile(source_file_name):
-            logger.log('Error reading source: unzipped data is not a tarball')
-            os.rmdir('tmp')
-            file_type = get_file_type(source_file_name)
-            err = f'Downloaded archive is not the correct type (file type: {file_type})'
-            logger.log(err)
-            return err, logger.log_s # Bail if not tarfile
-        
-        with tarfile.open(source_file_name) as tar:
-            tar.extractall(path='tmp', filter='data')
-        
-        logger.log('Extracting citations .tex files')
-        citations = extract_citations_from_latex(logger)
-        logger.log(f'Found {len(citations)} citations')
-        references = []
-        bib_files = get_files_recursive('tmp', [], '.bib')
-        if len(bib_files) == 0:
-            err = 'Could not find .bib file in source'
-            logger.log(err)
-            return err, logger.log_s
-        logger.log('Found .bib file, loading file into memory')
-        for bib_file in bib_files:
-            references_data = get_references_for_file(logger, bib_file, citations)
-            if type(references_data) == type(''):
-                continue
-            for reference in references_data:
-                references.append(reference)
 
-        logger.log(f'Found {len(references)} of {len(citations)} citations')
-        
-        reference_file_data = []
-        for reference in references:
-            reference_file_data.append(reference)
-        with open(references_file_name, 'w') as f:
-            json.dump(reference_file_data, f, indent=4)
-    finally:
-        shutil.rmtree('tmp')
+    references = parse_source(logger, source_data, force)
+    if type(references) == type(''):
+        return references, logger.log_s
+
+    with logger.stage('resolve'):
+        resolved = get_resolver().resolve_references(references, paper_id)
+    logger.log(f'Resolved {resolved} more arxiv ids from reference titles')
+    with logger.stage('store'):
+        get_storage().save_references(paper_id, references)
+    with logger.stage('index'):
+        get_search_index().index_references({ paper_id: references })
+    graph = get_graph()
+    graph.set_references(paper_id, [reference.get("arxiv_id") for reference in references])
+    graph.save_if_due()
+    notify_references(paper_id, references)
     return references, logger.log_s
 
-def get_metadata(paper_id: str):
-    clean_id = paper_id.replace('.', '')
-    if os.path.exists(f'papers/{clean_id}.json'):
-        with open(f'papers/{clean_id}.json', 'r') as f:
-            return json.load(f)
-    abs_url = f'https://arxiv.org/abs/{paper_id}'
-    response = requests.get(abs_url)
+def strip_version(paper_id: str) -> str:
+    return re.sub(r'v\d+$', '', paper_id)
+
+def parse_atom_feed(data: bytes) -> Dict[str, object]:
+    entries = {}
+    for _, elem in ElementTree.iterparse(io.BytesIO(data)):
+        if elem.tag != f'{ATOM_NS}entry':
+            continue
+        entry_id = elem.findtext(f'{ATOM_NS}id', '')
+        # Unknown ids come back as an entry pointing at the api error page
+        if '/abs/' in entry_id:
+            paper_id = strip_version(entry_id.split('/abs/', 1)[1])
+            entries[paper_id] = {
+                "id": paper_id,
+                "title": ' '.join(elem.findtext(f'{ATOM_NS}title', '').split()),
+                "abstract": ' '.join(elem.findtext(f'{ATOM_NS}summary', '').split())
+            }
+        elem.clear()
+    return entries
+
+def get_metadata_batch(paper_ids: List[str]) -> Dict[str, object]:
+    results = get_storage().get_papers(paper_ids)
+    missing = []
+    for paper_id in paper_ids:
+        if paper_id not in results and paper_id not in missing:
+            missing.append(paper_id)
+
+    for i in range(0, len(missing), METADATA_BATCH_SIZE):
+        batch = missing[i:i + METADATA_BATCH_SIZE]
+        # A request serves many papers, so it is only recorded in the process wide metrics
+        with timed('metadata_batch'):
+            response = get_client().get(ARXIV_API_URL, params={
+                'id_list': ','.join(batch),
+                'max_results': len(batch)
+            })
+        if response.status_code != 200:
+            continue
+        metrics.add_bytes('metadata_batch', len(response.content))
+        try:
+            entries = parse_atom_feed(response.content)
+        except ElementTree.ParseError:
+            continue
+        metrics.add_entries('metadata_batch', len(entries))
+        found = {}
+        for paper_id in batch:
+            entry = entries.get(strip_version(paper_id))
+            if entry is None:
+                continue
+            found[paper_id] = {
+                "id": paper_id,
+                "title": entry["title"],
+                "abstract": entry["abstract"]
+            }
+        get_storage().save_papers(found)
+        get_search_index().index_papers(found)
+        resolver = get_resolver()
+        resolver.add_titles({ paper_id: paper["title"] for paper_id, paper in found.items() })
+        resolver.save_if_due()
+        results.update(found)
+    return results
+
+def get_metadata_from_abs(paper_id: str):
+    abs_url = f'{ARXIV_URL}/abs/{paper_id}'
+    with timed('metadata_abs'):
+        response = get_client().get(abs_url)
     soup = BeautifulSoup(response.text, 'html.parser')
     abstract_elem = soup.find('blockquote', {'class': 'abstract'})
     abstract = abstract_elem.text if abstract_elem is not None else ""
 
-    if not os.path.exists('papers'):
-        os.mkdir('papers')
     obj = {
         "id": paper_id,
         "title": soup.title.string,
         "abstract": abstract
     }
-    with open(f'papers/{clean_id}.json', 'w') as f:
-        json.dump(obj, f)
-    return obj
\ No newline at end of file
+    get_storage().save_paper(paper_id, obj)
+    get_search_index().index_papers({ paper_id: obj })
+    resolver = get_resolver()
+    resolver.add_titles({ paper_id: obj["title"] })
+    resolver.save_if_due()
+    return obj
+
+def get_metadata(paper_id: str):
+    metadata = get_metadata_batch([paper_id])
+    if paper_id in metadata:
+        return metadata[paper_id]
+    # Fall back to the abs page if the export api does not know the paper
+    return get_metadata_from_abs(paper_id)
@@ -0,0 +1,129 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+
+from graph import get_graph
+from storage import get_storage
+from search import get_search_index
+from resolver import get_resolver
+from related import notify_references
+from lib import normalize_arxiv_id
+from metrics import metrics
+from arxiv import Logger, parse_source
+
+BATCH_SIZE = 200
+
+def get_cached_sources(source_folder: str = 'source') -> Dict[str, str]:
+    sources = {}
+    if not os.path.exists(source_folder):
+        return sources
+    for file in os.listdir(source_folder):
+        # Skip downloads that never finished
+        if file.endswith('.part'):
+            continue
+        sources[normalize_arxiv_id(file)] = os.path.join(source_folder, file)
+    return sources
+
+# Runs in a worker process: only reads the cached archive and parses it
+def parse_cached_source(arxiv_id: str, file_name: str, force: bool) -> dict:
+    logger = Logger(echo=False)
+    try:
+        with logger.stage('read'):
+            with open(file_name, 'rb') as f:
+                source_data = f.read()
+        references = parse_source(logger, source_data, force)
+    except Exception as e:
+        references = f'Error parsing source: {e}'
+    return {
+        "arxiv_id": arxiv_id,
+        "references": references,
+        "log": logger.log_s,
+        "timings": logger.stage_report()
+    }
+
+class Backfill:
+    def __init__(self, workers: int | None = None, batch_size: int = BATCH_SIZE, force: bool = False):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.force = force
+        self.pending: List[dict] = []
+        self.stage_totals: Dict[str, float] = {}
+        self.failures: Dict[str, str] = {}
+        self.parsed = 0
+        self.references = 0
+
+    # Stores a batch of results in one transaction and updates the paper records and graph
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        storage = get_storage()
+        graph = get_graph()
+        ok = [result for result in self.pending if type(result["references"]) != type('')]
+        references = { result["arxiv_id"]: result["references"] for result in ok }
+        resolver = get_resolver()
+        for arxiv_id, refs in references.items():
+            resolver.resolve_references(refs, arxiv_id)
+        storage.save_references_batch(references)
+        get_search_index().index_references(references)
+
+        # A failed re-parse leaves the paper and its stored references as they were,
+        # the failure is only reported
+        papers = storage.get_papers([result["arxiv_id"] for result in ok])
+        for result in ok:
+            paper = papers.get(result["arxiv_id"])
+            if paper is None:
+                continue
+            paper["log"] = result["log"]
+            paper["timings"] = result["timings"]
+            paper["references_error"] = None
+        storage.save_papers(papers)
+
+        for result in ok:
+            graph.set_references(result["arxiv_id"], [reference.get("arxiv_id") for reference in result["references"]])
+            notify_references(result["arxiv_id"], result["references"])
+        graph.save_if_due()
+        self.pending = []
+
+    def add_result(self, result: dict):
+        # Worker processes have their own metrics, record the stages again in this one
+        timings = result["timings"]
+        for stage, duration in timings["seconds"].items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0) + duration
+            metrics.observe(stage, duration)
+        for stage, count in timings["bytes"].items():
+            metrics.add_bytes(stage, count)
+        for stage, count in timings["entries"].items():
+            metrics.add_entries(stage, count)
+        if type(result["references"]) == type(''):
+            self.failures[result["arxiv_id"]] = result["references"]
+        else:
+            self.parsed += 1
+            self.references += len(result["references"])
+        self.pending.append(result)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def run(self, sources: Dict[str, str]):
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for arxiv_id, file_name in sources.items():
+                futures[executor.submit(parse_cached_source, arxiv_id, file_name, self.force)] = arxiv_id
+            for i, future in enumerate(as_completed(futures)):
+                try:
+                    self.add_result(future.result())
+                except Exception as e:
+                    self.failures[futures[future]] = f'Worker failed: {e}'
+                if (i + 1) % 500 == 0:
+                    print(f'[backfill] {i + 1}/{len(futures)} archives parsed')
+        self.flush()
+        get_graph().save()
+        self.elapsed = time.time() - start
+
+    def report(self, total: int):
+        print(f'[backfill] parsed {self.parsed}/{total} archives, {self.references} references, {len(self.failures)} failures in {self.elapsed:.1f}s')
+        for stage, duration in sorted(self.stage_totals.items(), key=lambda item: -item[1]):
+            print(f'  {stage:<10} {duration:8.2f}s total  {duration / max(total, 1) * 1000:8.2f}ms per archive')
+        for arxiv_id, error in sorted(self.failures.items()):
+            print(f'  FAILED {arxiv_id}: {error}')
@@ -0,0 +1,113 @@
+import re
+from typing import List, Set
+
+# thebibliography / natbib output
+BIBITEM = re.compile(r'\\bibitem\s*(?:\[(?:[^\[\]{}]|\{[^{}]*\})*\])?\s*\{([^}]*)\}')
+BIBLIOGRAPHY_END = re.compile(r'\\end\s*\{thebibliography\}')
+NEWBLOCK = re.compile(r'\\newblock\b')
+
+# biblatex output
+ENTRY = re.compile(r'\\entry\{([^}]*)\}\{([^}]*)\}(.*?)\\endentry', re.S)
+FIELD = re.compile(r'\\field\{([a-z]+)\}\{(.*)\}\s*$', re.M)
+VERB_URL = re.compile(r'\\verb\{url\}\s*\\verb\s+(\S+)')
+NAME_AUTHOR = re.compile(r'\\name\{author\}(.*?)(?=\\name\{|\\list\{|\\strng\{|\\field\{|\\verb\{|\\endentry|$)', re.S)
+FAMILY = re.compile(r'\bfamily=\{([^}]*)\}')
+GIVEN = re.compile(r'\bgiven=\{([^}]*)\}')
+
+ARXIV_ID = re.compile(r'(?:arxiv[^0-9\n]{0,24}|abs/|pdf/)(\d{4}\.\d{4,5})(?:v\d+)?', re.I)
+URL = re.compile(r'\\(?:url|href)\s*\{([^}]*)\}')
+LATEX_COMMAND = re.compile(r'\\[a-zA-Z]+\*?\s*')
+LATEX_ESCAPE = re.compile(r'\\([&%$#_{}])')
+WHITESPACE = re.compile(r'\s+')
+
+def clean_latex(text: str) -> str:
+    text = LATEX_ESCAPE.sub(r'\1', text)
+    text = LATEX_COMMAND.sub('', text)
+    text = text.replace('~', ' ').replace('{', '').replace('}', '')
+    return WHITESPACE.sub(' ', text).strip(' .,')
+
+def find_arxiv_id(text: str) -> str | None:
+    match = ARXIV_ID.search(text)
+    if match is None:
+        return None
+    return match.group(1)
+
+def parse_bibitem(key: str, body: str) -> dict:
+    entry = {
+        "ID": key,
+        "ENTRYTYPE": 'bibitem'
+    }
+    blocks = NEWBLOCK.split(body)
+    author = clean_latex(blocks[0])
+    if author != '':
+        entry["author"] = author
+    if len(blocks) > 1:
+        title = clean_latex(blocks[1])
+        if title != '':
+            entry["title"] = title
+    url = URL.search(body)
+    if url is not None:
+        entry["url"] = url.group(1)
+    arxiv_id = find_arxiv_id(body)
+    if arxiv_id is not None:
+        entry["arxiv_id"] = arxiv_id
+    return entry
+
+def parse_biblatex_entry(key: str, entry_type: str, body: str) -> dict:
+    entry = {
+        "ID": key,
+        "ENTRYTYPE": entry_type
+    }
+    fields = dict(FIELD.findall(body))
+    if 'title' in fields:
+        entry["title"] = clean_latex(fields['title'])
+    names = NAME_AUTHOR.search(body)
+    if names is not None:
+        families = FAMILY.findall(names.group(1))
+        givens = GIVEN.findall(names.group(1))
+        authors = []
+        for i, family in enumerate(families):
+            given = givens[i] if i < len(givens) else ''
+            authors.append(clean_latex(f'{family}, {given}' if given != '' else family))
+        if len(authors) > 0:
+            entry["author"] = ' and '.join(authors)
+    url = VERB_URL.search(body)
+    if url is not None:
+        entry["url"] = url.group(1)
+    if fields.get('eprinttype', 'arxiv').lower() == 'arxiv' and 'eprint' in fields:
+        arxiv_id = find_arxiv_id('arxiv:' + fields['eprint'])
+    else:
+        arxiv_id = find_arxiv_id(body)
+    if arxiv_id is not None:
+        entry["arxiv_id"] = arxiv_id
+    return entry
+
+# Returns reference dicts in the same shape as the .bib parser so they can be
+# passed straight to Reference. If found_citations is empty every entry is kept.
+def get_references_from_bbl(contents: str, found_citations: Set[str], found_ids: Set[str] | None = None) -> List[dict]:
+    if found_ids is None:
+        found_ids = set()
+    entries = []
+
+    for match in ENTRY.finditer(contents):
+        entries.append(parse_biblatex_entry(match.group(1), match.group(2), match.group(3)))
+
+    if len(entries) == 0:
+        end = BIBLIOGRAPHY_END.search(contents)
+        if end is not None:
+            contents = contents[:end.start()]
+        items = list(BIBITEM.finditer(contents))
+        for i, match in enumerate(items):
+            body_end = items[i + 1].start() if i + 1 < len(items) else len(contents)
+            entries.append(parse_bibitem(match.group(1).strip(), contents[match.end():body_end]))
+
+    references = []
+    for entry in entries:
+        if len(found_citations) > 0 and entry["ID"] not in found_citations:
+            continue
+        if entry["ID"] in found_ids:
+            continue
+        found_ids.add(entry["ID"])
+        entry["index"] = len(found_ids)
+        references.append(entry)
+    return references
@@ -0,0 +1,148 @@
+import io
+import os
+import gzip
+import json
+import random
+import tarfile
+from typing import Dict, List
+
+# Synthetic e-print sources shaped like the ones arxiv.org serves. Everything is
+# derived from the seed so a corpus can be regenerated byte for byte.
+WORDS = (
+    'attention', 'graph', 'neural', 'network', 'learning', 'sparse', 'model', 'transformer',
+    'optimal', 'bound', 'stochastic', 'gradient', 'quantum', 'lattice', 'field', 'theory',
+    'efficient', 'scalable', 'robust', 'inference', 'estimation', 'kernel', 'random', 'matrix'
+)
+KINDS = ('tar', 'bbl', 'gzip')
+
+def paper_id(index: int) -> str:
+    return f'2401.{90000 + index:05d}'
+
+def make_title(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 9))).capitalize()
+
+def make_sentence(rng: random.Random, keys: List[str]) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    if len(keys) > 0 and rng.random() < 0.5:
+        cited = ','.join(rng.sample(keys, min(len(keys), rng.randint(1, 3))))
+        words.append(rng.choice(('\\cite', '\\citep', '\\citet', '\\parencite')) + '{' + cited + '}')
+    return ' '.join(words) + '.'
+
+def make_bib_entry(rng: random.Random, key: str, cited_id: str | None) -> str:
+    fields = [
+        f'  title = {{{make_title(rng)}}}',
+        f'  author = {{{rng.choice(WORDS).capitalize()}, A. and {rng.choice(WORDS).capitalize()}, B.}}',
+        f'  year = {{{rng.randint(1990, 2024)}}}'
+    ]
+    if cited_id is not None:
+        fields.append(f'  eprint = {{{cited_id}}}')
+        fields.append('  archivePrefix = {arXiv}')
+    else:
+        fields.append(f'  journal = {{Journal of {rng.choice(WORDS).capitalize()}}}')
+    return f'@article{{{key},\n' + ',\n'.join(fields) + '\n}\n'
+
+def make_bbl_item(rng: random.Random, key: str, cited_id: str | None) -> str:
+    item = f'\\bibitem[{rng.choice(WORDS).capitalize()}(2020)]{{{key}}}\n'
+    item += f'{rng.choice(WORDS).capitalize()}, A.\n\\newblock {make_title(rng)}.\n'
+    if cited_id is not None:
+        item += f'\\newblock arXiv:{cited_id}, 2020.\n'
+    return item + '\n'
+
+# Keys of a paper's bibliography, cited_ids maps some of them to other papers of the corpus
+def make_keys(rng: random.Random, entries: int, corpus_size: int) -> Dict[str, str | None]:
+    keys = {}
+    for i in range(entries):
+        cited_id = paper_id(rng.randrange(corpus_size)) if rng.random() < 0.3 else None
+        keys[f'ref{i}'] = cited_id
+    return keys
+
+# A main file that pulls in nested sections through \input, depth levels deep
+def make_tex_files(rng: random.Random, tex_files: int, depth: int, keys: List[str]) -> Dict[str, str]:
+    files = {}
+    names = [f'sections/s{i}.tex' for i in range(tex_files - 1)]
+    children: Dict[str, List[str]] = { 'main.tex': [] }
+    for i, name in enumerate(names):
+        # Every file hangs below one of the files at the previous level
+        parent = 'main.tex' if i < max(1, len(names) // (depth + 1)) else rng.choice(names[:i])
+        children.setdefault(parent, []).append(name)
+        children.setdefault(name, [])
+    # Spread the citations over the tree so every key is cited somewhere
+    cited = list(keys)
+    rng.shuffle(cited)
+    per_file = max(1, len(cited) // tex_files + 1)
+    for i, name in enumerate(['main.tex'] + names):
+        body = []
+        own = cited[i * per_file:(i + 1) * per_file]
+        if len(own) > 0:
+            body.append('\\cite{' + ','.join(own) + '}')
+        for _ in range(rng.randint(5, 20)):
+            body.append(make_sentence(rng, keys))
+        body.append('% \\cite{commented_out} must not be picked up')
+        for child in children[name]:
+            body.append(f'\\input{{{child[:-4]}}}')
+        if name == 'main.tex':
+            body = ['\\documentclass{article}', '\\begin{document}'] + body + ['\\bibliography{refs}', '\\end{document}']
+        files[name] = '\n'.join(body) + '\n'
+    return files
+
+def tar_bytes(files: Dict[str, str], compress: bool = True) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz' if compress else 'w') as tar:
+        for name, contents in files.items():
+            data = contents.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+# kind is 'tar' (.tex tree and .bib), 'bbl' (.tex tree and compiled .bbl only) or
+# 'gzip' (a single gzipped .tex file without a bibliography)
+def make_source(rng: random.Random, kind: str, entries: int, tex_files: int, depth: int, corpus_size: int) -> bytes:
+    keys = make_keys(rng, entries, corpus_size)
+    if kind == 'gzip':
+        files = make_tex_files(rng, 1, 0, list(keys))
+        return gzip.compress(files['main.tex'].encode('utf-8'))
+    files = make_tex_files(rng, tex_files, depth, list(keys))
+    if kind == 'tar':
+        files['refs.bib'] = ''.join(make_bib_entry(rng, key, cited_id) for key, cited_id in keys.items())
+    else:
+        files['main.bbl'] = '\\begin{thebibliography}{99}\n' + ''.join(make_bbl_item(rng, key, cited_id) for key, cited_id in keys.items()) + '\\end{thebibliography}\n'
+    return tar_bytes(files)
+
+def make_bib(entries: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    return ''.join(make_bib_entry(rng, f'ref{i}', paper_id(i) if i % 3 == 0 else None) for i in range(entries)).encode('utf-8')
+
+# Writes <folder>/source/<clean id> archives and <folder>/corpus.json with the metadata
+def generate_corpus(
+    folder: str,
+    papers: int = 50,
+    entries: int = 100,
+    tex_files: int = 20,
+    depth: int = 3,
+    seed: int = 0
+) -> Dict[str, dict]:
+    rng = random.Random(seed)
+    source_folder = os.path.join(folder, 'source')
+    os.makedirs(source_folder, exist_ok=True)
+    manifest = {}
+    for i in range(papers):
+        arxiv_id = paper_id(i)
+        kind = KINDS[i % len(KINDS)]
+        data = make_source(rng, kind, entries, tex_files, depth, papers)
+        with open(os.path.join(source_folder, arxiv_id.replace('.', '')), 'wb') as f:
+            f.write(data)
+        manifest[arxiv_id] = {
+            "id": arxiv_id,
+            "title": make_title(rng),
+            "abstract": ' '.join(make_sentence(rng, []) for _ in range(5)),
+            "kind": kind,
+            "size": len(data)
+        }
+    with open(os.path.join(folder, 'corpus.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_manifest(folder: str) -> Dict[str, dict]:
+    with open(os.path.join(folder, 'corpus.json'), 'r') as f:
+        return json.load(f)
@@ -0,0 +1,220 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import argparse
+import statistics
+import threading
+from contextlib import redirect_stdout
+from typing import Callable, List
+
+from bench.corpus import generate_corpus, make_bib, make_source
+from bench.stub_server import StubArxivServer
+
+BASELINE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+# A benchmark regresses when its median is this much slower than the baseline
+THRESHOLD = 1.25
+
+def summarize(samples: List[float], **extra) -> dict:
+    samples = sorted(samples)
+    summary = {
+        "runs": len(samples),
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "mean": statistics.mean(samples)
+    }
+    summary.update(extra)
+    return summary
+
+def measure(fn: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+# Ingestion prints every log line, keep the benchmark output readable
+def quiet(fn: Callable[[], object]) -> Callable[[], object]:
+    def run():
+        with redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+def bench_extract_citations(results: dict, repeat: int, tex_files: int):
+    from archive import SourceArchive
+    from arxiv import Logger, extract_citations_from_latex
+    data = make_source(random.Random(1), 'tar', 200, tex_files, 4, 100)
+    samples = measure(lambda: extract_citations_from_latex(Logger(echo=False), SourceArchive(data)), repeat)
+    results[f'extract_citations_{tex_files}_files'] = summarize(samples, bytes=len(data))
+
+def bench_bib(results: dict, repeat: int, sizes: List[int]):
+    from arxiv import Logger, get_references_for_file
+    for entries in sizes:
+        data = make_bib(entries)
+        # Cite every other entry so the streaming filter has work to skip
+        citations = { f'ref{i}' for i in range(0, entries, 2) }
+        samples = measure(lambda: get_references_for_file(Logger(echo=False), 'refs.bib', len(data), io.BytesIO(data), citations, set(), True), max(1, repeat if entries <= 10000 else 1))
+        results[f'get_references_for_file_{entries}'] = summarize(samples, bytes=len(data), entries=entries)
+
+def bench_get_references(results: dict, papers: List[str], server: StubArxivServer):
+    from arxiv import get_references
+    from storage import get_storage
+    samples = []
+    for arxiv_id in papers:
+        start = time.perf_counter()
+        quiet(lambda: get_references(arxiv_id))()
+        samples.append(time.perf_counter() - start)
+    results['get_references_cold'] = summarize(samples, requests=server.requests)
+
+    # Sources are now cached on disk, only drop the stored references
+    for arxiv_id in papers:
+        get_storage().delete_paper(arxiv_id)
+    samples = []
+    for arxiv_id in papers:
+        start = time.perf_counter()
+        quiet(lambda: get_references(arxiv_id))()
+        samples.append(time.perf_counter() - start)
+    results['get_references_cached_source'] = summarize(samples)
+
+def bench_project(results: dict, repeat: int, papers: List[str]):
+    from paper import Paper
+    from project import Project
+    from storage import get_storage
+    for arxiv_id in papers:
+        quiet(lambda: Paper(arxiv_id))()
+    get_storage().save_project({ "name": "bench", "papers": papers })
+    samples = measure(quiet(lambda: Project('bench').to_obj()), repeat)
+    results['project_load'] = summarize(samples, papers=len(papers))
+    samples = measure(quiet(lambda: Project('bench').to_obj(0, 20)), repeat)
+    results['project_load_page'] = summarize(samples, papers=len(papers))
+
+def bench_endpoints(results: dict, papers: List[str], concurrency: int, requests: int):
+    from server import app
+    endpoints = {
+        'paper_get': lambda rng: f'/api/paper/get?id={rng.choice(papers)}',
+        'project_get': lambda rng: '/api/project/get?id=bench&offset=0&limit=20',
+        'project_list': lambda rng: '/api/project/list',
+        'graph_cited_by': lambda rng: f'/api/graph/cited-by?id={rng.choice(papers)}'
+    }
+    for name, make_url in endpoints.items():
+        samples = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(seed: int):
+            client = app.test_client()
+            rng = random.Random(seed)
+            own = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = client.get(make_url(rng))
+                own.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+            with lock:
+                samples.extend(own)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+        with redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        results[f'api_{name}'] = summarize(samples, concurrency=concurrency, requests_per_second=len(samples) / elapsed, errors=len(errors))
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, summary in sorted(results.items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f'  {name:<40} {summary["median"] * 1000:10.2f}ms  (new)')
+            continue
+        ratio = summary["median"] / base["median"] if base["median"] > 0 else 1
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'  {name:<40} {summary["median"] * 1000:10.2f}ms  {ratio:6.2f}x baseline{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and the API against a synthetic corpus')
+    parser.add_argument('--quick', action='store_true', help='Small corpus and .bib sizes, for a fast check')
+    parser.add_argument('--papers', type=int, default=None, help='Papers in the generated corpus')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per micro benchmark')
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads hitting each endpoint')
+    parser.add_argument('--requests', type=int, default=50, help='Requests sent by each thread')
+    parser.add_argument('--save', default=None, metavar='NAME', help=f'Write the results to {BASELINE_FOLDER}/NAME.json')
+    parser.add_argument('--baseline', default=None, metavar='FILE', help='Compare against a saved baseline and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='Slowdown ratio counted as a regression')
+    args = parser.parse_args()
+
+    papers = args.papers if args.papers is not None else (15 if args.quick else 60)
+    bib_sizes = [100, 1000] if args.quick else [100, 1000, 10000, 100000]
+
+    root = tempfile.mkdtemp(prefix='arxiv-bench-')
+    corpus_folder = os.path.join(root, 'corpus')
+    work_folder = os.path.join(root, 'work')
+    os.makedirs(work_folder)
+    manifest = generate_corpus(corpus_folder, papers=papers, entries=100 if args.quick else 300)
+    server = StubArxivServer(corpus_folder).start()
+
+    # Configuration is read when the modules are imported, so set it up first
+    os.environ['ARXIV_URL'] = server.url
+    os.environ['ARXIV_API_URL'] = server.api_url
+    os.environ['ARXIV_STORAGE'] = 'sqlite'
+    os.environ['ARXIV_DB'] = os.path.join(work_folder, 'arxiv.db')
+    os.environ['ARXIV_GRAPH'] = os.path.join(work_folder, 'graph.snapshot')
+    os.environ['ARXIV_SEARCH_DB'] = os.path.join(work_folder, 'search.db')
+    os.chdir(work_folder)
+    from fetch import configure
+    configure(rate=10000, burst=10000, retries=0)
+
+    results = {}
+    paper_ids = list(manifest)
+    print(f'[bench] corpus of {papers} papers in {root}')
+    bench_extract_citations(results, args.repeat, 50 if args.quick else 400)
+    bench_bib(results, args.repeat, bib_sizes)
+    bench_get_references(results, paper_ids, server)
+    bench_project(results, args.repeat, paper_ids)
+    bench_endpoints(results, paper_ids, args.concurrency, args.requests)
+    server.stop()
+
+    report = {
+        "meta": {
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+            "papers": papers
+        },
+        "results": results
+    }
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    else:
+        for name, summary in sorted(results.items()):
+            print(f'  {name:<40} {summary["median"] * 1000:10.2f}ms median  {summary["p95"] * 1000:10.2f}ms p95')
+    if args.save is not None:
+        os.makedirs(BASELINE_FOLDER, exist_ok=True)
+        file_name = os.path.join(BASELINE_FOLDER, f'{args.save}.json')
+        with open(file_name, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'[bench] saved results to {file_name}')
+    if len(regressions) > 0:
+        print(f'[bench] {len(regressions)} benchmarks regressed by more than {args.threshold:.2f}x')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
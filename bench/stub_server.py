@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from lib import normalize_title
+from bench.corpus import load_manifest
+
+# Stand-in for the arxiv.org e-print and abs pages, the export api and a Google
+# Scholar result page, serving a generated corpus. Point ingestion at it with
+# ARXIV_URL and ARXIV_API_URL, and Scholar lookups with SCHOLAR_URL=<url>/scholar?q=
+class StubArxivServer:
+    def __init__(self, folder: str, port: int = 0, latency: float = 0):
+        self.folder = folder
+        self.manifest = load_manifest(folder)
+        self.latency = latency
+        self.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.url}/api/query'
+
+    def start(self) -> 'StubArxivServer':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def atom_feed(self, ids) -> bytes:
+        entries = []
+        for arxiv_id in ids:
+            paper = self.manifest.get(arxiv_id)
+            if paper is None:
+                entries.append('<entry><id>http://arxiv.org/api/errors#incorrect_id_format</id><title>Error</title></entry>')
+                continue
+            entries.append(
+                f'<entry><id>http://arxiv.org/abs/{arxiv_id}v1</id>'
+                f'<title>{escape(paper["title"])}</title>'
+                f'<summary>{escape(paper["abstract"])}</summary></entry>'
+            )
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">'
+            + ''.join(entries) + '</feed>').encode('utf-8')
+
+    def abs_page(self, arxiv_id: str) -> bytes | None:
+        paper = self.manifest.get(arxiv_id)
+        if paper is None:
+            return None
+        return (f'<html><head><title>[{arxiv_id}] {escape(paper["title"])}</title></head><body>'
+            f'<blockquote class="abstract">{escape(paper["abstract"])}</blockquote></body></html>').encode('utf-8')
+
+    # Scholar style result list, the matching paper (if any) between two unrelated results
+    def scholar_page(self, query: str) -> bytes:
+        wanted = normalize_title(query)
+        results = []
+        for arxiv_id, paper in self.manifest.items():
+            if normalize_title(paper["title"]) == wanted:
+                results.append((paper["title"], f'https://arxiv.org/pdf/{arxiv_id}'))
+        results = [('An unrelated survey', 'https://example.org/survey.pdf')] + results + [('Another unrelated paper', 'https://example.org/other.pdf')]
+        items = ''.join(
+            f'<div class="gs_r"><div class="gs_ggsd"><a href="{escape(link)}">[PDF]</a></div>'
+            f'<h3 class="gs_rt"><a href="{escape(link)}">{escape(title)}</a></h3></div>'
+            for title, link in results
+        )
+        return f'<html><body><div id="gs_res_ccl">{items}</div></body></html>'.encode('utf-8')
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                stub.requests += 1
+                if stub.latency > 0:
+                    time.sleep(stub.latency)
+                url = urlparse(self.path)
+                if url.path.startswith('/e-print/'):
+                    arxiv_id = url.path[len('/e-print/'):]
+                    file_name = os.path.join(stub.folder, 'source', arxiv_id.replace('.', ''))
+                    if not os.path.exists(file_name):
+                        return self.send(404, b'Not found', 'text/plain')
+                    with open(file_name, 'rb') as f:
+                        return self.send(200, f.read(), 'application/x-eprint-tar')
+                if url.path.startswith('/abs/'):
+                    page = stub.abs_page(url.path[len('/abs/'):])
+                    if page is None:
+                        return self.send(404, b'Not found', 'text/html')
+                    return self.send(200, page, 'text/html')
+                if url.path == '/scholar':
+                    query = parse_qs(url.query).get('q', [''])[0]
+                    return self.send(200, stub.scholar_page(query), 'text/html')
+                if url.path == '/api/query':
+                    ids = parse_qs(url.query).get('id_list', [''])[0].split(',')
+                    return self.send(200, stub.atom_feed([arxiv_id for arxiv_id in ids if arxiv_id != '']), 'application/atom+xml')
+                self.send(404, b'Not found', 'text/plain')
+
+        return Handler
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve a generated corpus like arxiv.org')
+    parser.add_argument('folder')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every response')
+    args = parser.parse_args()
+    server = StubArxivServer(args.folder, args.port, args.latency)
+    print(f'Serving {len(server.manifest)} papers on {server.url}')
+    server.server.serve_forever()
@@ -0,0 +1,105 @@
+import re
+import codecs
+from typing import IO, Iterator, Set, Tuple
+
+CHUNK_SIZE = 64 * 1024
+# Entry headers can be split across chunks, keep enough of the tail to match them
+HEADER_TAIL = 64
+# Give up on a key that has not ended after this many characters
+MAX_KEY_LENGTH = 1024
+
+ENTRY_START = re.compile(r'@\s*([a-zA-Z]+)\s*([{(])')
+KEY_END_BRACE = re.compile(r'[,}]')
+KEY_END_PAREN = re.compile(r'[,)]')
+BODY_BRACE = re.compile(r'[{}]')
+BODY_PAREN = re.compile(r'[{})]')
+
+SEARCH = 0
+KEY = 1
+BODY = 2
+
+# Scans a .bib stream chunk by chunk and yields (entry type, key, raw text) for
+# every @string/@preamble block and every entry whose key is in wanted_keys.
+# Entries that are not wanted are skipped by brace counting only, so memory use
+# is bounded by the size of the wanted entries rather than the size of the file.
+def iter_bib_entries(stream: IO[bytes], wanted_keys: Set[str], chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, str | None, str]]:
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    buf = ''
+    pos = 0
+    mode = SEARCH
+    entry_type = None
+    entry_start = 0
+    key = None
+    keep = False
+    close_char = '}'
+    depth = 0
+    eof = False
+
+    while not eof:
+        data = stream.read(chunk_size)
+        eof = len(data) == 0
+        # Drop everything that has been scanned and does not need to be kept
+        base = entry_start if mode == KEY or (mode == BODY and keep) else pos
+        buf = buf[base:] + decoder.decode(data, final=eof)
+        pos -= base
+        entry_start -= base
+
+        while True:
+            if mode == SEARCH:
+                m = ENTRY_START.search(buf, pos)
+                if m is None:
+                    pos = max(pos, len(buf) - HEADER_TAIL)
+                    break
+                entry_type = m.group(1).lower()
+                close_char = '}' if m.group(2) == '{' else ')'
+                entry_start = m.start()
+                pos = m.end()
+                depth = 0
+                key = None
+                if entry_type == 'comment':
+                    keep = False
+                    mode = BODY
+                elif entry_type in ('string', 'preamble'):
+                    keep = True
+                    mode = BODY
+                else:
+                    mode = KEY
+
+            if mode == KEY:
+                pattern = KEY_END_BRACE if close_char == '}' else KEY_END_PAREN
+                m = pattern.search(buf, pos)
+                if m is None:
+                    if len(buf) - pos > MAX_KEY_LENGTH:
+                        mode = SEARCH
+                        continue
+                    break
+                key = buf[pos:m.start()].strip()
+                keep = key in wanted_keys
+                pos = m.end()
+                if m.group() != ',':
+                    # Entry without any fields
+                    if keep:
+                        yield entry_type, key, buf[entry_start:pos]
+                    mode = SEARCH
+                    continue
+                mode = BODY
+
+            if mode == BODY:
+                pattern = BODY_BRACE if close_char == '}' else BODY_PAREN
+                end = None
+                for m in pattern.finditer(buf, pos):
+                    char = m.group()
+                    if char == '{':
+                        depth += 1
+                    elif depth > 0 and char == '}':
+                        depth -= 1
+                    elif char == close_char:
+                        end = m.end()
+                        break
+                if end is None:
+                    pos = len(buf)
+                    break
+                if keep:
+                    yield entry_type, key, buf[entry_start:end]
+                pos = end
+                mode = SEARCH
@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from paper import Paper
+from project import Project
+from graph import get_graph
+from storage import get_storage
+from arxiv import get_metadata_batch
+
+MAX_ENTRIES = int(os.environ.get('ARXIV_CACHE_ENTRIES', 2048))
+MAX_MB = int(os.environ.get('ARXIV_CACHE_MB', 256))
+
+# Bounded LRU keyed by (kind, id). Every entry keeps the storage version it was
+# built from and is treated as a miss once the stored version moves on.
+class LRUCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_MB * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or version is None or entry[0] != version:
+                self.misses += 1
+                if entry is not None:
+                    self._remove(key)
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, value, size: int):
+        if version is None or size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (version, value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+class ObjectCache:
+    def __init__(self, lru: LRUCache | None = None):
+        self.lru = lru if lru is not None else LRUCache()
+
+    def get_papers(self, arxiv_ids: List[str]) -> List[Paper]:
+        storage = get_storage()
+        versions = storage.paper_versions(arxiv_ids)
+        papers: Dict[str, Paper] = {}
+        missing = []
+        for arxiv_id in arxiv_ids:
+            paper = self.lru.get(('paper', arxiv_id), versions.get(arxiv_id))
+            if paper is not None:
+                # New citing papers do not change this paper's version, refresh from the graph
+                paper.cited_by = get_graph().cited_by(arxiv_id)
+                papers[arxiv_id] = paper
+            elif arxiv_id not in missing:
+                missing.append(arxiv_id)
+
+        if len(missing) > 0:
+            get_metadata_batch(missing)
+            for arxiv_id in missing:
+                paper = Paper(arxiv_id)
+                papers[arxiv_id] = paper
+            # Building a paper may have written it, so read the versions again
+            new_versions = storage.paper_versions(missing)
+            for arxiv_id in missing:
+                paper = papers[arxiv_id]
+                # Serializing here also warms the paper's cached reference list
+                self.lru.put(('paper', arxiv_id), new_versions.get(arxiv_id), paper, len(paper.to_json()))
+        return [papers[arxiv_id] for arxiv_id in arxiv_ids]
+
+    def get_paper(self, arxiv_id: str) -> Paper:
+        return self.get_papers([arxiv_id])[0]
+
+    # Project views only build papers whose references are stored. The others were
+    # queued for ingestion when they were added and may be downloading right now,
+    # they are shown as pending from their stored record.
+    def get_project_papers(self, arxiv_ids: List[str]) -> List[Paper]:
+        storage = get_storage()
+        stored = storage.stored_reference_lists(arxiv_ids)
+        ready = [arxiv_id for arxiv_id in arxiv_ids if arxiv_id in stored]
+        papers = dict(zip(ready, self.get_papers(ready)))
+        pending = [arxiv_id for arxiv_id in dict.fromkeys(arxiv_ids) if arxiv_id not in stored]
+        records = storage.get_papers(pending)
+        for arxiv_id in pending:
+            papers[arxiv_id] = Paper.pending(arxiv_id, records.get(arxiv_id))
+        return [papers[arxiv_id] for arxiv_id in arxiv_ids]
+
+    def get_project(self, name: str) -> Project:
+        version = get_storage().project_version(name)
+        project = self.lru.get(('project', name), version)
+        if project is None:
+            project = Project(name, self.get_project_papers)
+            self.lru.put(('project', name), version, project, 64 * (len(project.members) + 1))
+        return project
+
+    def invalidate_paper(self, arxiv_id: str):
+        self.lru.invalidate(('paper', arxiv_id))
+
+    def invalidate_project(self, name: str):
+        self.lru.invalidate(('project', name))
+
+    def stats(self) -> dict:
+        return self.lru.stats()
@@ -3,10 +3,12 @@ import qs from 'qs'
 
 const host = window.location.host.split(':')[0]
 
-export async function getApi(path: string, data: any = null) {
+// 304 is an answer to If-None-Match, the caller keeps the body it validated
+export async function getApi(path: string, data: any = null, headers: any = { }) {
+    const config = { headers, validateStatus: (status: number) => status == 200 || status == 304 }
     return data == null 
-        ? await axios.get(`http://${host}:4000/api/${path}`)
-        : await axios.get(`http://${host}:4000/api/${path}?${qs.stringify(data)}`)
+        ? await axios.get(`http://${host}:4000/api/${path}`, config)
+        : await axios.get(`http://${host}:4000/api/${path}?${qs.stringify(data)}`, config)
 }
 
 export async function postApi(path: string, data: any = { }) {
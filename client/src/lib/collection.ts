@@ -16,6 +16,8 @@ function runAction<DT, C extends string, K extends keyof ListActions<DT, C>>(com
 
 export class Collection<DT, C extends string> {
   private api_midpoint: string
+  // Last ETag and items per query, unchanged lists come back as an empty 304
+  private validated: Map<string, { etag: string, items: DT[] }> = new Map()
   public runAction: <K extends keyof ListActions<DT, C>>(type: K, payload: ListActions<DT, C>[K]['payload']) => Action<K, C, ListActions<DT, C>[K]['payload']>
 
   constructor(component: C, api_midpoint: string, dispatch: any) {
@@ -23,8 +25,8 @@ export class Collection<DT, C extends string> {
     this.runAction = <K extends keyof ListActions<DT, C>>(type: K, payload: ListActions<DT, C>[K]['payload']) => runAction<DT, C, K>(component, dispatch, type, payload)
   }
 
-  private async apiGet(endpoint: string, data: any = { }): Promise<any> {
-    return (await getApi(`${this.api_midpoint}/${endpoint}`, data))
+  private async apiGet(endpoint: string, data: any = { }, headers: any = { }): Promise<any> {
+    return (await getApi(`${this.api_midpoint}/${endpoint}`, data, headers))
   }
 
   private async apiPost(endpoint: string, data: DT) {
@@ -34,7 +36,17 @@ export class Collection<DT, C extends string> {
   public async get(params: any = { }) {
     this.runAction(LOADING, true)
     try {
-      const res = await this.apiGet('list', params)
+      const key = JSON.stringify(params)
+      const cached = this.validated.get(key)
+      const res = await this.apiGet('list', params, cached != null ? { 'If-None-Match': cached.etag } : { })
+      if (res.status == 304 && cached != null) {
+        this.runAction(UPDATE, cached.items)
+        return
+      }
+      const etag = res.headers['etag']
+      if (etag != null) {
+        this.validated.set(key, { etag, items: res.data })
+      }
       this.runAction(UPDATE, res.data)
     } finally {
       this.runAction(LOADING, false)
@@ -16,6 +16,8 @@ function runAction<DT, C extends string, K extends keyof ModelActions<DT, C>>(co
 
 export class Model<DT, C extends string> {
   private api_midpoint: string
+  // Last ETag and body per id, sent back so unchanged models come back as an empty 304
+  private validated: Map<string, { etag: string, model: DT }> = new Map()
   public runAction: <K extends keyof ModelActions<DT, C>>(type: K, payload: ModelActions<DT, C>[K]['payload']) => Action<K, C, ModelActions<DT, C>[K]['payload']>
 
   constructor(component: C, api_midpoint: string, dispatch: any) {
@@ -23,8 +25,8 @@ export class Model<DT, C extends string> {
     this.runAction = <K extends keyof ModelActions<DT, C>>(type: K, payload: ModelActions<DT, C>[K]['payload']) => runAction<DT, C, K>(component, dispatch, type, payload)
   }
 
-  public async apiGet(endpoint: string, data: any = { }): Promise<any> {
-    return (await getApi(`${this.api_midpoint}/${endpoint}`, data))
+  public async apiGet(endpoint: string, data: any = { }, headers: any = { }): Promise<any> {
+    return (await getApi(`${this.api_midpoint}/${endpoint}`, data, headers))
   }
 
   public async apiPost(endpoint: string, data: any) {
@@ -35,7 +37,20 @@ export class Model<DT, C extends string> {
     this.runAction(LOADING, true)
     let model = null
     try {
-      model = (await this.apiGet('get', { id })).data as DT
+      const key = JSON.stringify(id)
+      const cached = this.validated.get(key)
+      const res = await this.apiGet('get', { id }, cached != null ? { 'If-None-Match': cached.etag } : { })
+      if (res.status == 304 && cached != null) {
+        model = cached.model
+      } else {
+        model = res.data as DT
+        const etag = res.headers['etag']
+        if (etag != null) {
+          this.validated.set(key, { etag, model })
+        } else {
+          this.validated.delete(key)
+        }
+      }
       this.runAction(UPDATE, model)
     } finally {
       this.runAction(LOADING, false)
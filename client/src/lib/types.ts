@@ -2,6 +2,8 @@ import { ListState, ModelState } from "./abs_types"
 
 export type Reference = {
   id: string
+  // Shared by every paper citing the same work
+  ref_id: number | string | null
   title: string
   arxiv_id: string
   date: string
@@ -11,7 +13,8 @@ export type Reference = {
   clean_id: string
   url: string
   author: string
-  data: any
+  // Raw bib entry, only sent when requested with data=true
+  data?: any
 }
 
 export type Paper = {
@@ -24,15 +27,26 @@ export type Paper = {
   project_name?: string
   references_error: string | undefined
   references: Reference[]
+  // Set in project views while the paper is queued for ingestion
+  ingesting: boolean
 }
 
 export type Project = {
   name: string
+  paper_count: number
+  offset: number
+  limit: number | null
   papers: Paper[]
 }
 
+export type ProjectSummary = {
+  name: string
+  paper_count: number
+  updated: number
+}
+
 export type AppState = {
-  projectList: ListState<Project>
+  projectList: ListState<ProjectSummary>
   projectModel: ModelState<Project>
   paperModel: ModelState<Paper>
 }
\ No newline at end of file
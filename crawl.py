@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import heapq
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Set
+
+from paper import Paper
+from graph import save_graph
+from lib import get_date_by_id, normalize_arxiv_id
+from arxiv import get_metadata_batch
+
+CHECKPOINT_FILE = 'crawl.checkpoint'
+CHECKPOINT_INTERVAL = 30
+REPORT_INTERVAL = 10
+PRIORITIES = ('bfs', 'citations', 'date', 'fifo')
+
+# Breadth first crawl from seed papers along the arxiv_ids of their references.
+# The frontier is a heap ordered by the chosen priority, by default the depth so
+# every level is done before the next one starts. Priorities are updated
+# lazily: a paper that gains citations is pushed again and stale heap entries
+# are skipped when popped.
+class Crawler:
+    def __init__(
+        self,
+        seeds: List[str],
+        max_depth: int = 1,
+        workers: int = 4,
+        priority: str = 'bfs',
+        max_papers: int | None = None,
+        checkpoint_file: str = CHECKPOINT_FILE
+    ):
+        if priority not in PRIORITIES:
+            raise Exception(f'Unknown crawl priority {priority}, expected one of {", ".join(PRIORITIES)}')
+        self.seeds = [normalize_arxiv_id(seed) for seed in seeds]
+        self.max_depth = max_depth
+        self.workers = workers
+        self.priority = priority
+        self.max_papers = max_papers
+        self.checkpoint_file = checkpoint_file
+
+        self.frontier = []
+        self.counter = itertools.count()
+        # arxiv id -> depth for everything that has been queued
+        self.depths: Dict[str, int] = {}
+        # arxiv id -> number of crawled papers citing it
+        self.citations: Dict[str, int] = {}
+        self.done: Set[str] = set()
+        self.failed: Dict[str, str] = {}
+        self.in_flight: Set[str] = set()
+        self.started = time.time()
+        self.done_at_start = 0
+
+        for seed in self.seeds:
+            self.enqueue(seed, 0)
+
+    def _priority(self, arxiv_id: str) -> float:
+        if self.priority == 'bfs':
+            return self.depths.get(arxiv_id, 0)
+        if self.priority == 'citations':
+            return -self.citations.get(arxiv_id, 0)
+        if self.priority == 'date':
+            date = get_date_by_id(arxiv_id)
+            return -int(date.replace('-', '')) if date is not None else 0
+        return 0
+
+    def enqueue(self, arxiv_id: str, depth: int):
+        # Failed papers are retried by the next resume, not within the same run
+        if arxiv_id in self.done or arxiv_id in self.in_flight or arxiv_id in self.failed:
+            return
+        if arxiv_id in self.depths and self.depths[arxiv_id] <= depth and self.priority != 'citations':
+            return
+        self.depths[arxiv_id] = min(depth, self.depths.get(arxiv_id, depth))
+        heapq.heappush(self.frontier, (self._priority(arxiv_id), next(self.counter), arxiv_id))
+
+    def pop(self) -> str | None:
+        while len(self.frontier) > 0:
+            priority, _, arxiv_id = heapq.heappop(self.frontier)
+            if arxiv_id in self.done or arxiv_id in self.in_flight:
+                continue
+            if priority != self._priority(arxiv_id):
+                # Superseded by a newer entry with a higher priority
+                continue
+            return arxiv_id
+        return None
+
+    def pending(self) -> int:
+        return len({ arxiv_id for _, _, arxiv_id in self.frontier if arxiv_id not in self.done and arxiv_id not in self.in_flight })
+
+    def save_checkpoint(self):
+        obj = {
+            "seeds": self.seeds,
+            "max_depth": self.max_depth,
+            "priority": self.priority,
+            "depths": self.depths,
+            "citations": self.citations,
+            "done": sorted(self.done),
+            "failed": self.failed,
+            # In flight papers are put back in the frontier so a resumed crawl retries them
+            "frontier": sorted({ arxiv_id for _, _, arxiv_id in self.frontier if arxiv_id not in self.done } | self.in_flight)
+        }
+        partial_file_name = self.checkpoint_file + '.part'
+        with open(partial_file_name, 'w') as f:
+            json.dump(obj, f)
+        os.replace(partial_file_name, self.checkpoint_file)
+
+    @staticmethod
+    def resume(checkpoint_file: str = CHECKPOINT_FILE, **kwargs) -> 'Crawler':
+        with open(checkpoint_file, 'r') as f:
+            obj = json.load(f)
+        crawler = Crawler([], obj["max_depth"], priority=obj["priority"], checkpoint_file=checkpoint_file, **kwargs)
+        crawler.seeds = obj["seeds"]
+        crawler.citations = obj["citations"]
+        # Failed papers go back in the frontier, older checkpoints also listed them as done
+        crawler.done = set(obj["done"]) - set(obj["failed"])
+        crawler.done_at_start = len(crawler.done)
+        depths = obj["depths"]
+        for arxiv_id in list(obj["frontier"]) + list(obj["failed"]):
+            crawler.enqueue(arxiv_id, depths.get(arxiv_id, 0))
+        crawler.depths.update(depths)
+        return crawler
+
+    def ingest(self, arxiv_id: str) -> List[str]:
+        paper = Paper(arxiv_id)
+        if paper.reference_error is not None:
+            raise Exception(paper.reference_error)
+        return [ref.arxiv_id for ref in paper.references if ref.arxiv_id is not None]
+
+    def report(self):
+        elapsed = time.time() - self.started
+        crawled = len(self.done) - self.done_at_start
+        rate = crawled / elapsed if elapsed > 0 else 0
+        print(f'[crawl] done {len(self.done)} failed {len(self.failed)} in flight {len(self.in_flight)} frontier {self.pending()} ({rate:.2f} papers/s)')
+
+    def next_batch(self, size: int) -> List[str]:
+        batch = []
+        while len(batch) < size:
+            if self.max_papers is not None and len(self.done) + len(self.in_flight) + len(batch) >= self.max_papers:
+                break
+            arxiv_id = self.pop()
+            if arxiv_id is None:
+                break
+            batch.append(arxiv_id)
+        return batch
+
+    def run(self):
+        last_checkpoint = time.time()
+        last_report = time.time()
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    batch = self.next_batch(self.workers - len(futures))
+                    if len(batch) > 0:
+                        # One metadata request for the whole batch instead of one per worker
+                        get_metadata_batch(batch)
+                    for arxiv_id in batch:
+                        self.in_flight.add(arxiv_id)
+                        futures[executor.submit(self.ingest, arxiv_id)] = arxiv_id
+                    if len(futures) == 0:
+                        break
+
+                    finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        arxiv_id = futures.pop(future)
+                        self.in_flight.discard(arxiv_id)
+                        try:
+                            cited_ids = future.result()
+                        except Exception as e:
+                            self.failed[arxiv_id] = str(e)
+                            continue
+                        self.done.add(arxiv_id)
+                        depth = self.depths.get(arxiv_id, 0) + 1
+                        if depth > self.max_depth:
+                            continue
+                        for cited_id in cited_ids:
+                            self.citations[cited_id] = self.citations.get(cited_id, 0) + 1
+                            self.enqueue(cited_id, depth)
+
+                    if time.time() - last_report > REPORT_INTERVAL:
+                        self.report()
+                        last_report = time.time()
+                    if time.time() - last_checkpoint > CHECKPOINT_INTERVAL:
+                        self.save_checkpoint()
+                        last_checkpoint = time.time()
+        finally:
+            self.save_checkpoint()
+            save_graph()
+            self.report()
@@ -0,0 +1,120 @@
+import sys
+import json
+import zlib
+from typing import Iterable, Iterator
+
+from lib import get_date_by_id
+from storage import Storage, iter_batches
+
+EXPORT_TYPES = ['papers', 'references', 'all']
+# Input bytes compressed before the gzip stream is flushed to the client
+FLUSH_BYTES = 64 * 1024
+
+# Months compare as strings, start and end may be YYYY, YYYY-MM or YYYY-MM-DD
+def in_date_range(arxiv_id: str, start: str | None, end: str | None) -> bool:
+    if start is None and end is None:
+        return True
+    date = get_date_by_id(arxiv_id)
+    if date is None:
+        return False
+    if start is not None and date[:len(start)] < start:
+        return False
+    if end is not None and date[:len(end)] > end:
+        return False
+    return True
+
+# Yields one json line per paper and per reference, papers are read from storage
+# a batch at a time so memory stays flat however large the export is. Papers are
+# filtered by the date of their id, has_arxiv_id keeps only references that
+# point to an arxiv paper.
+def iter_export(
+    storage: Storage,
+    paper_ids: Iterable[str] | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    has_arxiv_id: bool = False,
+    export_type: str = 'all',
+    include_data: bool = False,
+    batch_size: int = 200
+) -> Iterator[str]:
+    if paper_ids is None:
+        paper_ids = storage.list_paper_ids()
+    paper_ids = [arxiv_id for arxiv_id in paper_ids if in_date_range(arxiv_id, start, end)]
+    for batch in iter_batches(paper_ids, batch_size):
+        papers = storage.get_papers(batch)
+        for arxiv_id in batch:
+            paper = papers.get(arxiv_id)
+            if paper is None:
+                continue
+            if export_type != 'references':
+                yield json.dumps({
+                    "type": "paper",
+                    "arxiv_id": arxiv_id,
+                    "date": get_date_by_id(arxiv_id),
+                    "title": paper.get("title"),
+                    "abstract": paper.get("abstract"),
+                    "references_error": paper.get("references_error")
+                }) + '\n'
+            if export_type == 'papers':
+                continue
+            for i, reference in enumerate(storage.get_references(arxiv_id) or []):
+                ref_arxiv_id = reference.get("arxiv_id")
+                if has_arxiv_id and ref_arxiv_id is None:
+                    continue
+                obj = {
+                    "type": "reference",
+                    "paper_id": arxiv_id,
+                    "index": i,
+                    "id": reference.get("ID"),
+                    "ref_id": reference.get("ref_id"),
+                    "arxiv_id": ref_arxiv_id,
+                    "title": reference.get("title"),
+                    "author": reference.get("author"),
+                    "date": get_date_by_id(ref_arxiv_id) if ref_arxiv_id is not None else None
+                }
+                if include_data:
+                    obj["data"] = reference
+                yield json.dumps(obj) + '\n'
+
+# Compresses a stream of lines as it goes, the gzip header goes out with the
+# first chunk and the stream is flushed every FLUSH_BYTES so the client sees progress
+def gzip_lines(lines: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk = compressor.compress(data)
+        pending += len(data)
+        if pending >= FLUSH_BYTES:
+            chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if len(chunk) > 0:
+            yield chunk
+    yield compressor.flush()
+
+def export_to_file(file_name: str | None, lines: Iterable[str], compress: bool) -> int:
+    count = 0
+
+    def counted() -> Iterator[str]:
+        nonlocal count
+        for line in lines:
+            count += 1
+            yield line
+
+    if file_name is None:
+        if compress:
+            for chunk in gzip_lines(counted()):
+                sys.stdout.buffer.write(chunk)
+        else:
+            for line in counted():
+                sys.stdout.write(line)
+        sys.stdout.flush()
+        return count
+    with open(file_name, 'wb') as f:
+        if compress:
+            for chunk in gzip_lines(counted()):
+                f.write(chunk)
+        else:
+            for line in counted():
+                f.write(line.encode('utf-8'))
+    return count
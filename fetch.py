@@ -0,0 +1,173 @@
+import os
+import time
+import uuid
+import random
+import threading
+from collections import OrderedDict
+from typing import IO, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+# Validators kept for conditional requests, the least recently used go first
+MAX_VALIDATORS = 1024
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class FetchResult:
+    def __init__(self, url: str, status_code: int, content: bytes, headers: Dict[str, str], not_modified: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.not_modified = not_modified
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+class FetchClient:
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 4,
+        retries: int = 4,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        timeout: float = 30.0,
+        pool_size: int = 8,
+        user_agent: str = 'arxiv_crawler'
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        # url -> (etag, last modified) from the last successful conditional request
+        self.validators: OrderedDict[str, Tuple[str | None, str | None]] = OrderedDict()
+        self.validators_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = user_agent
+
+    def _sleep_backoff(self, attempt: int, retry_after: str | None):
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            # Full jitter so parallel workers do not retry in lock step
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        time.sleep(delay)
+
+    def _conditional_headers(self, url: str) -> Dict[str, str]:
+        headers = {}
+        with self.validators_lock:
+            etag, last_modified = self.validators.get(url, (None, None))
+            if url in self.validators:
+                self.validators.move_to_end(url)
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _save_validators(self, url: str, response: requests.Response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+        with self.validators_lock:
+            self.validators[url] = (etag, last_modified)
+            self.validators.move_to_end(url)
+            while len(self.validators) > MAX_VALIDATORS:
+                self.validators.popitem(last=False)
+
+    def _read_body(self, response: requests.Response, stream_to: str | IO[bytes] | None) -> bytes:
+        if stream_to is None:
+            return response.content
+        if isinstance(stream_to, str):
+            # Write to a partial file first so an interrupted download never looks
+            # cached, named per download so two of the same file do not mix
+            partial_file_name = f'{stream_to}.{uuid.uuid4().hex}.part'
+            try:
+                with open(partial_file_name, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(partial_file_name, stream_to)
+            finally:
+                if os.path.exists(partial_file_name):
+                    os.remove(partial_file_name)
+        else:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                stream_to.write(chunk)
+        return b''
+
+    def get(self, url: str, params: dict = None, conditional: bool = False, stream_to: str | IO[bytes] | None = None) -> FetchResult:
+        headers = self._conditional_headers(url) if conditional else {}
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout, stream=stream_to is not None)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+                self._sleep_backoff(attempt, None)
+                attempt += 1
+                continue
+
+            with response:
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.retries:
+                    retry_after = response.headers.get('Retry-After')
+                    response.close()
+                    self._sleep_backoff(attempt, retry_after)
+                    attempt += 1
+                    continue
+                if response.status_code == 304:
+                    return FetchResult(url, 304, b'', dict(response.headers), not_modified=True)
+                if response.status_code != 200:
+                    return FetchResult(url, response.status_code, response.content, dict(response.headers))
+                if conditional:
+                    self._save_validators(url, response)
+                content = self._read_body(response, stream_to)
+                return FetchResult(url, response.status_code, content, dict(response.headers))
+
+client: FetchClient | None = None
+client_lock = threading.Lock()
+
+def get_client() -> FetchClient:
+    global client
+    with client_lock:
+        if client is None:
+            client = FetchClient()
+        return client
+
+def configure(**kwargs) -> FetchClient:
+    global client
+    with client_lock:
+        client = FetchClient(**kwargs)
+        return client
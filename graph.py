@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import atexit
+import threading
+from array import array
+from typing import Dict, Iterable, List, Set
+
+from storage import get_storage
+
+SNAPSHOT_FILE = os.environ.get('ARXIV_GRAPH', 'graph.snapshot')
+# Minimum number of seconds between snapshot writes after incremental updates
+SNAPSHOT_INTERVAL = 30
+# Catch up also rereads lists stored this many seconds before the newest one it
+# has seen, another process may commit a list stamped a little earlier
+CATCH_UP_OVERLAP = 60
+
+# Citation graph over arxiv ids. Papers are mapped to dense integer ids and the
+# edges are kept as 'I' arrays in both directions, so "cited by" is as cheap as
+# "references of" and the whole graph is a few bytes per edge.
+class CitationGraph:
+    def __init__(self):
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.out_edges: List[array] = []
+        self.in_edges: List[array] = []
+        # Papers whose reference list has been added to the graph
+        self.ingested: Set[str] = set()
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.saved_at = 0.0
+        # Newest stored reference list read by catch_up
+        self.updated = 0.0
+
+    def _node(self, arxiv_id: str) -> int:
+        node = self.index.get(arxiv_id)
+        if node is None:
+            node = len(self.ids)
+            self.ids.append(arxiv_id)
+            self.index[arxiv_id] = node
+            self.out_edges.append(array('I'))
+            self.in_edges.append(array('I'))
+        return node
+
+    def set_references(self, paper_id: str, cited_ids: Iterable[str]):
+        with self.lock:
+            node = self._node(paper_id)
+            for target in self.out_edges[node]:
+                incoming = self.in_edges[target]
+                del incoming[incoming.index(node)]
+            targets = array('I')
+            seen = set()
+            for cited_id in cited_ids:
+                if cited_id is None or cited_id == paper_id or cited_id in seen:
+                    continue
+                seen.add(cited_id)
+                target = self._node(cited_id)
+                targets.append(target)
+                self.in_edges[target].append(node)
+            self.out_edges[node] = targets
+            self.ingested.add(paper_id)
+            self.dirty = True
+
+    def references_of(self, arxiv_id: str) -> List[str]:
+        with self.lock:
+            node = self.index.get(arxiv_id)
+            if node is None:
+                return []
+            return [self.ids[target] for target in self.out_edges[node]]
+
+    def cited_by(self, arxiv_id: str) -> List[str]:
+        with self.lock:
+            node = self.index.get(arxiv_id)
+            if node is None:
+                return []
+            return [self.ids[source] for source in self.in_edges[node]]
+
+    # Breadth first walk returning { arxiv_id: hops } for every paper within k hops
+    def neighborhood(self, arxiv_id: str, k: int, direction: str = 'both', limit: int = 10000) -> Dict[str, int]:
+        with self.lock:
+            start = self.index.get(arxiv_id)
+            if start is None:
+                return {}
+            distances = { start: 0 }
+            level = [start]
+            for hops in range(1, k + 1):
+                next_level = []
+                for node in level:
+                    neighbours = []
+                    if direction in ('out', 'both'):
+                        neighbours.append(self.out_edges[node])
+                    if direction in ('in', 'both'):
+                        neighbours.append(self.in_edges[node])
+                    for edges in neighbours:
+                        for neighbour in edges:
+                            if neighbour in distances:
+                                continue
+                            distances[neighbour] = hops
+                            next_level.append(neighbour)
+                            if len(distances) >= limit:
+                                return { self.ids[n]: d for n, d in distances.items() }
+                level = next_level
+            return { self.ids[n]: d for n, d in distances.items() }
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "papers": len(self.ids),
+                "ingested": len(self.ingested),
+                "edges": sum(len(edges) for edges in self.out_edges)
+            }
+
+    # Snapshot layout: one json header line followed by the forward edges as
+    # CSR offsets and targets. Reverse edges are rebuilt on load.
+    def save(self, file_name: str = SNAPSHOT_FILE):
+        with self.lock:
+            offsets = array('Q', [0])
+            targets = array('I')
+            for edges in self.out_edges:
+                targets.extend(edges)
+                offsets.append(len(targets))
+            header = {
+                "ids": self.ids,
+                "ingested": sorted(self.ingested),
+                "updated": self.updated,
+                "offsets": len(offsets),
+                "targets": len(targets)
+            }
+            partial_file_name = file_name + '.part'
+            with open(partial_file_name, 'wb') as f:
+                f.write(json.dumps(header).encode() + b'\n')
+                offsets.tofile(f)
+                targets.tofile(f)
+            os.replace(partial_file_name, file_name)
+            self.dirty = False
+            self.saved_at = time.time()
+
+    def save_if_due(self, file_name: str = SNAPSHOT_FILE):
+        if self.dirty and time.time() - self.saved_at > SNAPSHOT_INTERVAL:
+            self.save(file_name)
+
+    def save_if_dirty(self, file_name: str = SNAPSHOT_FILE):
+        if self.dirty:
+            self.save(file_name)
+
+    @staticmethod
+    def load(file_name: str = SNAPSHOT_FILE) -> 'CitationGraph':
+        graph = CitationGraph()
+        with open(file_name, 'rb') as f:
+            header = json.loads(f.readline())
+            offsets = array('Q')
+            offsets.fromfile(f, header["offsets"])
+            targets = array('I')
+            targets.fromfile(f, header["targets"])
+        graph.ids = header["ids"]
+        graph.index = { arxiv_id: node for node, arxiv_id in enumerate(graph.ids) }
+        graph.ingested = set(header["ingested"])
+        graph.updated = header.get("updated", 0.0)
+        graph.out_edges = [targets[offsets[node]:offsets[node + 1]] for node in range(len(graph.ids))]
+        graph.in_edges = [array('I') for _ in graph.ids]
+        for node, edges in enumerate(graph.out_edges):
+            for target in edges:
+                graph.in_edges[target].append(node)
+        graph.saved_at = time.time()
+        return graph
+
+    # Adds every reference list stored since the newest one the graph has read,
+    # including lists other processes changed after the snapshot was written
+    def catch_up(self):
+        storage = get_storage()
+        for paper_id, updated in storage.list_reference_updates(self.updated - CATCH_UP_OVERLAP):
+            references = storage.get_references(paper_id)
+            if references is not None:
+                self.set_references(paper_id, [ref.get("arxiv_id") for ref in references])
+            self.updated = max(self.updated, updated)
+
+graph: CitationGraph | None = None
+graph_lock = threading.Lock()
+
+def get_graph() -> CitationGraph:
+    global graph
+    with graph_lock:
+        if graph is None:
+            if os.path.exists(SNAPSHOT_FILE):
+                graph = CitationGraph.load(SNAPSHOT_FILE)
+            else:
+                graph = CitationGraph()
+            graph.catch_up()
+            graph.save_if_due()
+            # Updates since the last periodic save are written when the process exits
+            atexit.register(save_graph)
+        return graph
+
+def save_graph():
+    with graph_lock:
+        current = graph
+    if current is not None:
+        current.save_if_dirty()
+
+def rebuild_graph(file_name: str = SNAPSHOT_FILE) -> CitationGraph:
+    global graph
+    new_graph = CitationGraph()
+    new_graph.catch_up()
+    new_graph.save(file_name)
+    with graph_lock:
+        graph = new_graph
+    return new_graph
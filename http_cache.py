@@ -0,0 +1,84 @@
+import os
+import re
+import gzip
+import hashlib
+from typing import Callable
+
+from flask import Response, request
+
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as they are, compressing them saves less than the headers cost
+COMPRESS_MIN_BYTES = 1024
+BODY_CACHE_MB = int(os.environ.get('ARXIV_BODY_CACHE_MB', 64))
+ENCODING_SUFFIX = re.compile(r'-(?:gzip|br)"$')
+
+# Encoded response bodies keyed by (etag, encoding), a warm response is neither
+# serialized nor compressed again
+body_cache = LRUCache(max_bytes=BODY_CACHE_MB * 1024 * 1024)
+
+# Strong validator built from the versions of everything the body is made of
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest() + '"'
+
+# If-None-Match may list several tags, the compressed variants of a body carry a
+# suffix on the same tag
+def etag_matches(header: str | None, etag: str) -> bool:
+    if header is None:
+        return False
+    if header.strip() == '*':
+        return True
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if ENCODING_SUFFIX.sub('"', tag) == etag:
+            return True
+    return False
+
+def choose_encoding() -> str | None:
+    if brotli is not None and request.accept_encodings['br'] > 0:
+        return 'br'
+    if request.accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+# Answers a matching If-None-Match with an empty 304 before build is called,
+# otherwise sends the json returned by build, compressed when the client allows it.
+# Without an etag the body is built, compressed and sent every time.
+def json_response(build: Callable[[], str], etag: str | None = None) -> Response:
+    headers = { 'Vary': 'Accept-Encoding' }
+    encoding = choose_encoding()
+    if etag is not None:
+        headers['Cache-Control'] = 'no-cache'
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            headers['ETag'] = etag
+            return Response(status=304, headers=headers)
+
+    entry = body_cache.get((etag, encoding), etag) if etag is not None else None
+    if entry is None:
+        body = build().encode('utf-8')
+        used = None
+        if encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+            body = compress(body, encoding)
+            used = encoding
+        entry = (body, used)
+        if etag is not None:
+            body_cache.put((etag, encoding), etag, entry, len(body))
+
+    body, used = entry
+    if used is not None:
+        headers['Content-Encoding'] = used
+    if etag is not None:
+        headers['ETag'] = etag if used is None else etag[:-1] + '-' + used + '"'
+    return Response(body, mimetype='application/json', headers=headers)
@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from arxiv import set_log_listener
+
+WORKERS = int(os.environ.get('ARXIV_INGEST_WORKERS', 4))
+MAX_QUEUED = 1000
+# Finished jobs kept around so their status can still be read
+MAX_FINISHED = 1000
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class Job:
+    def __init__(self, arxiv_id: str, kind: str, run: Callable[['Job'], object]):
+        self.id = uuid.uuid4().hex
+        self.arxiv_id = arxiv_id
+        self.kind = kind
+        self.run = run
+        self.status = QUEUED
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.log: List[str] = []
+        # Called with the job once it has finished, merged duplicates add their own
+        self.on_done: List[Callable[['Job'], None]] = []
+        self.changed = threading.Condition()
+
+    def is_active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def add_log(self, line: str):
+        with self.changed:
+            self.log.append(line)
+            self.changed.notify_all()
+
+    def set_status(self, status: str):
+        with self.changed:
+            self.status = status
+            self.changed.notify_all()
+
+    # Yields log lines as they are written until the job has finished
+    def follow(self, timeout: float = 15) -> Iterator[str | None]:
+        sent = 0
+        while True:
+            with self.changed:
+                if sent == len(self.log) and self.is_active():
+                    self.changed.wait(timeout)
+                lines = self.log[sent:]
+                active = self.is_active()
+            for line in lines:
+                yield line
+            sent += len(lines)
+            if not active:
+                return
+            if len(lines) == 0:
+                # Nothing happened within the timeout, let the caller send a keep alive
+                yield None
+
+    def to_obj(self):
+        return {
+            "id": self.id,
+            "arxiv_id": self.arxiv_id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "log": self.log
+        }
+
+# Bounded pool of ingestion workers. Submitting an arxiv id that already has a
+# queued or running job of the same kind returns that job instead of starting a
+# second one. Jobs of different kinds for one paper run one after the other.
+class JobQueue:
+    def __init__(self, workers: int = WORKERS, max_queued: int = MAX_QUEUED):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        self.max_queued = max_queued
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.active: Dict[Tuple[str, str], Job] = {}
+        # Held while a job for the paper runs, dropped once the paper has no active jobs
+        self.paper_locks: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, arxiv_id: str, kind: str, run: Callable[[Job], object], on_done: Callable[[Job], None] | None = None) -> Job:
+        with self.lock:
+            job = self.active.get((arxiv_id, kind))
+            if job is None:
+                if len(self.active) >= self.max_queued:
+                    raise Exception('Too many ingestion jobs queued, try again later')
+                job = Job(arxiv_id, kind, run)
+                self.active[(arxiv_id, kind)] = job
+                self.paper_locks.setdefault(arxiv_id, threading.Lock())
+                self.jobs[job.id] = job
+                self._trim()
+                self.executor.submit(self._run, job)
+            if on_done is not None:
+                job.on_done.append(on_done)
+            return job
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.is_active()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: Job):
+        with self.lock:
+            paper_lock = self.paper_locks[job.arxiv_id]
+        with paper_lock:
+            job.started = time.time()
+            job.set_status(RUNNING)
+            set_log_listener(job.add_log)
+            try:
+                job.result = job.run(job)
+                status = DONE
+            except Exception as e:
+                job.error = str(e)
+                status = FAILED
+            finally:
+                set_log_listener(None)
+
+        with self.lock:
+            # Hooks added after this point would never run, so stop merging first
+            del self.active[(job.arxiv_id, job.kind)]
+            if not any(arxiv_id == job.arxiv_id for arxiv_id, _ in self.active):
+                del self.paper_locks[job.arxiv_id]
+        for hook in job.on_done:
+            try:
+                hook(job)
+            except Exception as e:
+                job.add_log(f'Error finishing job: {e}')
+        job.finished = time.time()
+        job.set_status(status)
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[dict]:
+        with self.lock:
+            return [job.to_obj() for job in self.jobs.values()]
@@ -0,0 +1,94 @@
+import re
+import posixpath
+from typing import Dict, List, Set, Tuple
+
+# Comments are matched first so citations and inputs inside them are skipped,
+# which lets every file be scanned with a single pass of one pattern.
+TOKEN = re.compile(
+    rb'(?P<comment>(?<!\\)%[^\n]*)'
+    rb'|\\(?P<cite>[a-zA-Z]*[cC]ite[a-zA-Z]*)\*?'
+    rb'(?P<cite_args>(?:\s*(?:\[[^\]]*\]|\([^)]*\)))*\s*\{[^}]*\}(?:(?:\s*\[[^\]]*\])*\s*\{[^}]*\})*)'
+    rb'|\\(?:input|include|subfile)\s*\{(?P<input>[^}]*)\}'
+    rb'|\\input\s+(?P<bare_input>[^\s{}\\%]+)'
+)
+CITE_ARG = re.compile(rb'\{([^}]*)\}')
+DOCUMENT_CLASS = re.compile(rb'^[^%\n]*\\documentclass', re.M)
+BEGIN_DOCUMENT = re.compile(rb'^[^%\n]*\\begin\s*\{document\}', re.M)
+# Commands that contain "cite" but do not take citation keys
+NON_CITE_COMMANDS = (b'citestyle', b'citeindextrue', b'citeindexfalse')
+
+def normalize_path(name: str) -> str:
+    return posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+
+def scan_latex_file(data: bytes) -> Tuple[Set[str], List[str]]:
+    citations = set()
+    inputs = []
+    for match in TOKEN.finditer(memoryview(data)):
+        if match.group('comment') is not None:
+            continue
+        command = match.group('cite')
+        if command is not None:
+            if command in NON_CITE_COMMANDS:
+                continue
+            args = CITE_ARG.findall(match.group('cite_args'))
+            # Only the multicite forms (\cites, \parencites, ...) take several key groups
+            if not command.endswith(b'cites'):
+                args = args[:1]
+            for arg in args:
+                for key in arg.decode('utf-8', errors='ignore').split(','):
+                    key = key.strip()
+                    if key != '' and key != '*':
+                        citations.add(key)
+            continue
+        name = match.group('input') or match.group('bare_input')
+        if name is not None:
+            inputs.append(name.decode('utf-8', errors='ignore').strip())
+    return citations, inputs
+
+def find_main_files(files: Dict[str, bytes]) -> List[str]:
+    candidates = [name for name, data in files.items() if DOCUMENT_CLASS.search(data) is not None]
+    with_body = [name for name in candidates if BEGIN_DOCUMENT.search(files[name]) is not None]
+    if len(with_body) > 0:
+        return with_body
+    return candidates
+
+# LaTeX resolves \input relative to the main document, the including file's
+# directory is tried as well for sources built with the import package
+def resolve_input(files: Dict[str, bytes], root: str, including_file: str, name: str) -> str | None:
+    for candidate in (name, name + '.tex'):
+        for path in (posixpath.join(root, candidate), posixpath.join(posixpath.dirname(including_file), candidate), candidate):
+            path = normalize_path(path)
+            if path in files:
+                return path
+    return None
+
+# Scans the .tex files reachable from the main document(s) through \input and
+# \include and returns the cited keys along with the files that were scanned.
+# Files are scanned one include level at a time.
+def extract_citations(files: Dict[str, bytes]) -> Tuple[Set[str], List[str]]:
+    files = {normalize_path(name): data for name, data in files.items()}
+    main_files = find_main_files(files)
+    if len(main_files) == 0:
+        # No main document to start from, fall back to scanning everything
+        main_files = list(files.keys())
+
+    citations = set()
+    scanned = []
+    seen = set(main_files)
+    roots = {name: posixpath.dirname(name) for name in main_files}
+    level = main_files
+    while len(level) > 0:
+        next_level = []
+        for name in level:
+            file_citations, inputs = scan_latex_file(files[name])
+            scanned.append(name)
+            citations |= file_citations
+            for input_name in inputs:
+                path = resolve_input(files, roots[name], name, input_name)
+                if path is None or path in seen:
+                    continue
+                seen.add(path)
+                roots[path] = roots[name]
+                next_level.append(path)
+        level = next_level
+    return citations, scanned
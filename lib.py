@@ -1,5 +1,12 @@
 import re
 import datetime
+import unicodedata
+
+from bbl import clean_latex
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+# New style ids (2101.00001) and old style archive ids (hep-th/9901001), with an optional version
+ARXIV_ID_FORMAT = re.compile(r'^(?:\d{4}\.\d{4,5}|[a-z][a-z\-]*(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?$')
 
 def make_selection(max: int) -> int:
     selection = input('#: ')
@@ -24,4 +31,19 @@ def get_date_by_id(arxiv_id: str):
     except Exception as e:
         print(e)
         return None
-    return date
\ No newline at end of file
+    return date
+
+# Ids are also passed around without the dot (file names, urls), put it back in
+def normalize_arxiv_id(arxiv_id: str) -> str:
+    arxiv_id = arxiv_id.strip()
+    if '.' in arxiv_id or '/' in arxiv_id or len(arxiv_id) < 5:
+        return arxiv_id
+    return arxiv_id[:4] + '.' + arxiv_id[4:]
+
+def is_arxiv_id(arxiv_id: str) -> bool:
+    return ARXIV_ID_FORMAT.match(arxiv_id) is not None
+
+# Lower case ascii words only, so titles compare equal across bib styles and accents
+def normalize_title(title: str) -> str:
+    title = unicodedata.normalize('NFKD', clean_latex(title)).encode('ascii', 'ignore').decode('ascii').lower()
+    return NON_ALPHANUMERIC.sub(' ', title).strip()
@@ -1,21 +1,27 @@
-import os
-from arxiv import get_references
+import argparse
+
+from arxiv import Logger, get_references
+from metrics import profile
 from project import Project
+from graph import rebuild_graph
+from search import get_search_index
+from export import EXPORT_TYPES, export_to_file, iter_export
+from resolver import RESOLVER_FILE, get_resolver, load_dump, resolve_stored_references
+from fetch import configure
+from crawl import CHECKPOINT_FILE, PRIORITIES, Crawler
+from backfill import Backfill, get_cached_sources
+from storage import JsonStorage, SqliteStorage, get_storage, migrate_json_to_sqlite
 
 from lib import make_selection
 
-if not os.path.exists('projects'):
-    os.mkdir('projects')
-
 # TODO Look up cited by on google scholar
-    # Create a graph of papers 
 
 def main_menu():
     while True:
         idx = 0
-        projects = os.listdir('projects')
+        projects = get_storage().list_projects()
         for project in projects:
-            idx += 1 
+            idx += 1
             print(f'{idx}: {project}')
 
         print(f'{idx + 1}: New Project')
@@ -27,16 +33,151 @@ def main_menu():
             name = input("Project name: ")
         else:
             name = projects[num - 1]
-        
+
         project = Project(name)
         if num == len(projects) + 1:
             project.save()
-    
 
+def migrate(args):
+    counts = migrate_json_to_sqlite(JsonStorage(args.source), SqliteStorage(args.db))
+    print(f'Migrated {counts["papers"]} papers, {counts["references"]} reference lists and {counts["projects"]} projects into {args.db}')
+
+def ingest(args):
+    logger = Logger()
+    if args.profile is not None:
+        with profile(args.profile):
+            references, _ = get_references(args.arxiv_id, args.force, logger)
+    else:
+        references, _ = get_references(args.arxiv_id, args.force, logger)
+    if type(references) == type(''):
+        print(references)
+    for stage, duration in logger.timings.items():
+        print(f'  {stage:<10} {duration * 1000:8.2f}ms  {logger.bytes.get(stage, 0):>12} bytes  {logger.entries.get(stage, 0):>6} entries')
+
+def graph(args):
+    citation_graph = rebuild_graph(args.file)
+    stats = citation_graph.stats()
+    print(f'Saved graph with {stats["papers"]} papers and {stats["edges"]} citations to {args.file}')
+
+def index(args):
+    counts = get_search_index().rebuild(get_storage())
+    print(f'Indexed {counts["papers"]} papers and {counts["references"]} references')
+
+def export(args):
+    storage = get_storage()
+    paper_ids = None
+    if args.project is not None:
+        project = storage.get_project(args.project)
+        if project is None:
+            print(f'Project "{args.project}" not found')
+            return
+        paper_ids = project["papers"]
+    lines = iter_export(storage, paper_ids, args.start, args.end, args.has_arxiv_id, args.type, args.data)
+    compress = args.gzip or (args.output is not None and args.output.endswith('.gz'))
+    count = export_to_file(args.output, lines, compress)
+    if args.output is not None:
+        print(f'Exported {count} lines to {args.output}')
+
+def crawl(args):
+    configure(rate=args.rate)
+    if args.resume:
+        crawler = Crawler.resume(args.checkpoint, workers=args.workers, max_papers=args.max_papers)
+    else:
+        if len(args.seeds) == 0:
+            print('No seed papers given, pass arxiv ids or --resume')
+            return
+        crawler = Crawler(args.seeds, args.depth, args.workers, args.priority, args.max_papers, args.checkpoint)
+    crawler.run()
+
+def backfill(args):
+    sources = get_cached_sources(args.source)
+    if len(args.ids) > 0:
+        sources = { arxiv_id: file_name for arxiv_id, file_name in sources.items() if arxiv_id in args.ids }
+    job = Backfill(args.workers, args.batch_size, args.force)
+    job.run(sources)
+    job.report(len(sources))
+
+def resolve(args):
+    resolver = get_resolver()
+    for file_name in args.dump:
+        count = load_dump(resolver, file_name)
+        print(f'Loaded {count} titles from {file_name}')
+    resolver.save(args.file)
+    print(f'Saved title index with {resolver.stats()["titles"]} titles to {args.file}')
+    fallback = None
+    if args.scholar:
+        # Imported here so the other commands work without selenium and a browser
+        from scholar import ScholarService
+        service = ScholarService(args.scholar_pool)
+        fallback = service.resolve
+    counts = resolve_stored_references(resolver, args.threshold, fallback=fallback)
+    if args.scholar:
+        service.close()
+        print(f'Scholar: {service.stats()["page_loads"]} page loads in {service.stats()["launches"]} browsers')
+    print(f'Resolved {counts["resolved"]} references in {counts["papers"]} papers')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='arXiv crawler')
+    commands = parser.add_subparsers(dest='command')
+
+    migrate_parser = commands.add_parser('migrate', help='Copy the json papers/, references/ and projects/ folders into sqlite')
+    migrate_parser.add_argument('--source', default='.', help='Folder holding the json layout')
+    migrate_parser.add_argument('--db', default='arxiv.db', help='sqlite database to write')
+    migrate_parser.set_defaults(func=migrate)
+
+    ingest_parser = commands.add_parser('ingest', help='Download and parse the references of a single paper')
+    ingest_parser.add_argument('arxiv_id')
+    ingest_parser.add_argument('--force', action='store_true', help='Parse .bib files over the size limit')
+    ingest_parser.add_argument('--profile', default=None, metavar='FILE', help='Run the ingestion under cProfile and write the stats to FILE')
+    ingest_parser.set_defaults(func=ingest)
+
+    graph_parser = commands.add_parser('graph', help='Rebuild the citation graph snapshot from the stored references')
+    graph_parser.add_argument('--file', default='graph.snapshot', help='Snapshot file to write')
+    graph_parser.set_defaults(func=graph)
+
+    index_parser = commands.add_parser('index', help='Rebuild the full-text search index from the stored papers and references')
+    index_parser.set_defaults(func=index)
 
+    export_parser = commands.add_parser('export', help='Write stored papers and references as json lines')
+    export_parser.add_argument('--output', default=None, help='File to write, stdout if left out, gzipped if it ends in .gz')
+    export_parser.add_argument('--project', default=None, help='Only export the papers of this project')
+    export_parser.add_argument('--start', default=None, help='Earliest paper date, YYYY or YYYY-MM')
+    export_parser.add_argument('--end', default=None, help='Latest paper date, YYYY or YYYY-MM')
+    export_parser.add_argument('--has-arxiv-id', action='store_true', help='Only export references with an arxiv id')
+    export_parser.add_argument('--type', choices=EXPORT_TYPES, default='all', help='Kind of lines to export')
+    export_parser.add_argument('--data', action='store_true', help='Include the raw bib entry of every reference')
+    export_parser.add_argument('--gzip', action='store_true', help='Compress the output')
+    export_parser.set_defaults(func=export)
 
-    
+    crawl_parser = commands.add_parser('crawl', help='Crawl the references of seed papers breadth first')
+    crawl_parser.add_argument('seeds', nargs='*', help='arxiv ids to start from')
+    crawl_parser.add_argument('--depth', type=int, default=1, help='How many reference hops to follow from the seeds')
+    crawl_parser.add_argument('--workers', type=int, default=4, help='Papers ingested at the same time')
+    crawl_parser.add_argument('--priority', choices=PRIORITIES, default='bfs', help='Order of the frontier, bfs finishes each depth before the next')
+    crawl_parser.add_argument('--max-papers', type=int, default=None, help='Stop after this many papers')
+    crawl_parser.add_argument('--rate', type=float, default=1.0, help='Requests per second sent to arxiv.org')
+    crawl_parser.add_argument('--checkpoint', default=CHECKPOINT_FILE, help='File the frontier is saved to')
+    crawl_parser.add_argument('--resume', action='store_true', help='Continue the crawl saved in the checkpoint')
+    crawl_parser.set_defaults(func=crawl)
 
+    resolve_parser = commands.add_parser('resolve', help='Build the title index and fill in arxiv ids of stored references by title')
+    resolve_parser.add_argument('--dump', action='append', default=[], help='json lines metadata dump with id and title to add, may be gzipped')
+    resolve_parser.add_argument('--threshold', type=float, default=0.8, help='Title similarity needed to accept a match')
+    resolve_parser.add_argument('--file', default=RESOLVER_FILE, help='Title index snapshot to write')
+    resolve_parser.add_argument('--scholar', action='store_true', help='Look up titles the index can not resolve on Google Scholar')
+    resolve_parser.add_argument('--scholar-pool', type=int, default=2, help='Browsers used for Scholar lookups')
+    resolve_parser.set_defaults(func=resolve)
 
+    backfill_parser = commands.add_parser('backfill', help='Re-parse the references of every archive cached under source/')
+    backfill_parser.add_argument('ids', nargs='*', help='Only re-parse these arxiv ids')
+    backfill_parser.add_argument('--source', default='source', help='Folder holding the cached archives')
+    backfill_parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the number of cores')
+    backfill_parser.add_argument('--batch-size', type=int, default=200, help='Results written per transaction')
+    backfill_parser.add_argument('--force', action='store_true', help='Parse .bib files over the size limit')
+    backfill_parser.set_defaults(func=backfill)
 
-get_references('2402.00898')
\ No newline at end of file
+    args = parser.parse_args()
+    if args.command is None:
+        main_menu()
+    else:
+        args.func(args)
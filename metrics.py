@@ -0,0 +1,102 @@
+import io
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+# Upper bounds in seconds, the last bucket is +Inf
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+# Process wide aggregates of the per-stage timings, byte and entry counts that
+# every Logger records while a paper is ingested
+class Metrics:
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+        self.bytes: Dict[str, int] = {}
+        self.entries: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    def add_bytes(self, stage: str, count: int):
+        with self.lock:
+            self.bytes[stage] = self.bytes.get(stage, 0) + count
+
+    def add_entries(self, stage: str, count: int):
+        with self.lock:
+            self.entries[stage] = self.entries.get(stage, 0) + count
+
+    # Prometheus text exposition format
+    def render(self, extra: Dict[str, float] | None = None) -> str:
+        lines: List[str] = []
+        with self.lock:
+            lines.append('# HELP arxiv_stage_seconds Time spent in each ingestion stage')
+            lines.append('# TYPE arxiv_stage_seconds histogram')
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'arxiv_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'arxiv_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'arxiv_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'arxiv_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append('# HELP arxiv_stage_bytes_total Bytes processed by each ingestion stage')
+            lines.append('# TYPE arxiv_stage_bytes_total counter')
+            for stage, count in sorted(self.bytes.items()):
+                lines.append(f'arxiv_stage_bytes_total{{stage="{stage}"}} {count}')
+            lines.append('# HELP arxiv_stage_entries_total Entries (citations, references) produced by each ingestion stage')
+            lines.append('# TYPE arxiv_stage_entries_total counter')
+            for stage, count in sorted(self.entries.items()):
+                lines.append(f'arxiv_stage_entries_total{{stage="{stage}"}} {count}')
+        if extra is not None:
+            for name, value in sorted(extra.items()):
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(stage, time.perf_counter() - start)
+
+# Opt-in cProfile run of a block, the stats are dumped to file_name and the
+# top entries by cumulative time are printed
+@contextmanager
+def profile(file_name: str, top: int = 25):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_name)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(top)
+        print(output.getvalue())
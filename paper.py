@@ -1,23 +1,29 @@
-import os
 import json
 from typing import List
 
 from lib import get_date_by_id
-from reference import Reference
-from arxiv import get_metadata, get_references
+from reference import Reference, load_references
+from graph import get_graph
+from storage import get_storage
+from search import get_search_index
+from arxiv import Logger, get_metadata, get_references
 
 # TODO 
 #    Implement look up in archiv search to double check if paper is available
-#    Support other bibliography files such as '.bbl'
-#    Support ability to force parsing large .bib files
 class Paper:
     arxiv_id: str
     title: str
     abstract: str
     log: str
+    timings: dict
     references: List[Reference]
+    # Citation keys of this paper's bib entries, parallel to references
+    citation_keys: List[str | None]
     reference_error: str | None
     cited_by: List[object]
+    serialized_references: str | None
+    # Placeholder for a paper whose references are not stored yet, see Paper.pending
+    ingesting: bool
 
     def __init__(self, arxiv_id: str = None):
         self.arxiv_id = arxiv_id
@@ -26,70 +32,118 @@ class Paper:
         self.reference_error = None
         self.date = None
         self.log = ''
+        self.timings = {}
         self.references = []
+        self.citation_keys = []
         self.cited_by = []
+        self.serialized_references = None
+        self.ingesting = False
 
         if self.arxiv_id is not None:
             self.date = get_date_by_id(arxiv_id)
             self.load()
 
-    def load(self):
-        clean_id = self.arxiv_id.replace('.', '')
-        file_name = f'papers/{clean_id}.json'
-        if os.path.exists(file_name):
-            with open(file_name, 'r') as f:
-                data = json.load(f)
-                self.title = data["title"]
-                self.abstract = data["abstract"]
-                self.log = data["log"] if 'log' in data else ''
+    def load(self, force: bool = False):
+        storage = get_storage()
+        logger = Logger()
+        data = storage.get_paper(self.arxiv_id)
+        if data is not None:
+            self.title = data["title"]
+            self.abstract = data["abstract"]
+            self.log = data["log"] if 'log' in data else ''
+            self.timings = data["timings"] if 'timings' in data else {}
         else:
-            metadata = get_metadata(self.arxiv_id)
+            with logger.stage('metadata'):
+                metadata = get_metadata(self.arxiv_id)
             self.title = metadata["title"]
             self.abstract = metadata["abstract"]
 
-        if os.path.exists(f'references/{clean_id}.json'):
-            with open(f'references/{clean_id}.json', 'r') as f:
-                for item in json.load(f):
-                    self.references.append(Reference(item))
+        loaded = load_references(storage, self.arxiv_id)
+        if loaded is not None:
+            self.citation_keys, self.references = loaded
         else:
-            references, log = get_references(self.arxiv_id)
+            references, log = get_references(self.arxiv_id, force, logger)
             if type(references) == type(''):
                 self.reference_error = references
-                self.references = []
-            for ref_data in references:
-                self.references.append(Reference(ref_data))
+            else:
+                # Read back through storage so the references share interned records
+                loaded = load_references(storage, self.arxiv_id, refresh=True)
+                if loaded is not None:
+                    self.citation_keys, self.references = loaded
+                else:
+                    self.citation_keys = [ref_data.get("ID") for ref_data in references]
+                    self.references = [Reference(ref_data) for ref_data in references]
             self.log = log
-            with open(file_name, 'w') as f:
-                o = self.to_obj()
-                # Do not need to save reference data in paper file, it's saved in the references file
-                o['references'] = []
-                json.dump(o, f, indent=4)
+            self.timings = logger.stage_report()
+            # Do not need to save reference data in paper record, it's saved with the references
+            storage.save_paper(self.arxiv_id, self.to_obj(include_references=False))
+        self.cited_by = get_graph().cited_by(self.arxiv_id)
     
-    def reload(self) -> bool:
-        clean_id = self.arxiv_id.replace('.', '')
-        paper_file_name = f'papers/{clean_id}.json'
-        if not os.path.exists(paper_file_name):
+    # Stands in for a paper that is queued for ingestion without downloading
+    # anything, filled from the stored record when there is one
+    @staticmethod
+    def pending(arxiv_id: str, data: dict | None = None) -> 'Paper':
+        paper = Paper()
+        paper.arxiv_id = arxiv_id
+        paper.date = get_date_by_id(arxiv_id)
+        paper.ingesting = True
+        if data is not None:
+            paper.title = data.get("title")
+            paper.abstract = data.get("abstract")
+            paper.reference_error = data.get("references_error")
+        paper.cited_by = get_graph().cited_by(arxiv_id)
+        return paper
+
+    def reload(self, force: bool = False) -> bool:
+        storage = get_storage()
+        if storage.get_paper(self.arxiv_id) is None:
             return False
-        os.remove(paper_file_name)
-        ref_file_name = f'references/{clean_id}.json'
-        if not os.path.exists(ref_file_name):
+        if storage.get_references(self.arxiv_id) is None:
             return False
-        os.remove(ref_file_name)
+        storage.delete_paper(self.arxiv_id)
+        get_search_index().remove_paper(self.arxiv_id)
         self.date = get_date_by_id(self.arxiv_id)
         self.title = None
         self.abstract = None
         self.reference_error = None
         self.date = None
         self.log = ''
+        self.timings = {}
         self.references = []
+        self.citation_keys = []
         self.cited_by = []
-        self.load()
+        self.serialized_references = None
+        self.load(force)
         return True
 
-    def to_obj(self):
+    def references_json(self, include_data: bool = False) -> str:
+        if include_data:
+            # Raw entries are not kept in memory, read them back from storage
+            raw = get_storage().get_references(self.arxiv_id) or []
+            # Matched on ref_id in citation order, entries whose record is missing
+            # are not in self.references and one work may be cited more than once
+            by_ref_id: dict = {}
+            for data in raw:
+                by_ref_id.setdefault(data.get("ref_id"), []).append(data)
+            objs = []
+            for cite_key, ref in zip(self.citation_keys, self.references):
+                entries = by_ref_id.get(ref.ref_id)
+                objs.append(ref.to_obj(cite_key, entries.pop(0) if entries else None))
+            return json.dumps(objs)
+        if self.serialized_references is None:
+            self.serialized_references = json.dumps([ref.to_obj(cite_key) for cite_key, ref in zip(self.citation_keys, self.references)])
+        return self.serialized_references
+
+    # Same as to_obj, with the reference list serialized once per paper and spliced in
+    def to_json(self, include_data: bool = False) -> str:
+        head = json.dumps(self.to_obj(include_references=False))
+        return head[:-1] + ', "references": ' + self.references_json(include_data) + '}'
+
+    def to_obj(self, include_references: bool = True):
         refs = []
-        for ref in self.references:
-            refs.append(ref.to_obj())
+        if include_references:
+            for cite_key, ref in zip(self.citation_keys, self.references):
+                refs.append(ref.to_obj(cite_key))
         return {
             "arxiv_id": self.arxiv_id,
             "clean_id": self.arxiv_id.replace('.', ''),
@@ -98,6 +152,8 @@ class Paper:
             "abstract": self.abstract,
             "references": refs,
             "log": self.log,
+            "timings": self.timings,
             "references_error": self.reference_error,
-            "cited_by": self.cited_by
+            "cited_by": self.cited_by,
+            "ingesting": self.ingesting
         }
\ No newline at end of file
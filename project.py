@@ -1,70 +1,174 @@
-import os
-import json
-from typing import List
+from itertools import islice
+from typing import Callable, Dict, List, Tuple
 
 from paper import Paper
+from lib import is_arxiv_id, normalize_arxiv_id
+from storage import get_storage
+from arxiv import get_metadata_batch, strip_version
 
+# Papers are only materialized when they are asked for, so listing projects or
+# showing one page of a project does not build every Paper and Reference.
+# paper_loader lets the server hand out papers from its object cache instead.
+# Membership is an ordered set read on first use. Adding and removing a paper
+# appends one change to the stored project instead of rewriting it, so neither
+# has to read the membership first.
 class Project:
-    def __init__(self, name: str):
+    def __init__(self, name: str, paper_loader: Callable[[List[str]], List[Paper]] | None = None):
         self.name = name
-        self.papers: List[Paper] = []
+        self.loaded_members: Dict[str, None] | None = None
+        self.loaded_papers: Dict[str, Paper] = {}
+        self.paper_loader = paper_loader
         self.data = { }
 
-        file_name = f'projects/{name}.json'
-        if os.path.exists(file_name):
-            with open(file_name, 'r') as f:
-                data = json.load(f)
-                self.load_papers(data["papers"])
+    @property
+    def members(self) -> Dict[str, None]:
+        if self.loaded_members is None:
+            data = get_storage().get_project(self.name)
+            self.loaded_members = dict.fromkeys(data["papers"]) if data is not None else {}
+        return self.loaded_members
 
-    def load_papers(self, papers: List[str]):
-        for arxiv_id in papers:
-            self.papers.append(Paper(arxiv_id))
+    @property
+    def paper_ids(self) -> List[str]:
+        return list(self.members)
+
+    @property
+    def papers(self) -> List[Paper]:
+        return self.load_papers(self.paper_ids)
+
+    def has_paper(self, paper_id: str) -> bool:
+        return paper_id in self.members
+
+    def page_ids(self, offset: int = 0, limit: int | None = None) -> List[str]:
+        end = None if limit is None else offset + limit
+        return list(islice(self.members, offset, end))
+
+    def get_papers(self, offset: int = 0, limit: int | None = None) -> List[Paper]:
+        return self.load_papers(self.page_ids(offset, limit))
+
+    def load_papers(self, papers: List[str]) -> List[Paper]:
+        if self.paper_loader is not None:
+            return self.paper_loader(papers)
+        missing = [arxiv_id for arxiv_id in papers if arxiv_id not in self.loaded_papers]
+        if len(missing) > 0:
+            # Fetch metadata for every uncached paper in a few bulk requests up front
+            get_metadata_batch(missing)
+            for arxiv_id in missing:
+                self.loaded_papers[arxiv_id] = Paper(arxiv_id)
+        return [self.loaded_papers[arxiv_id] for arxiv_id in papers]
 
     def save(self):
-        if not os.path.exists('projects'):
-            os.mkdir('projects')
-        with open(f'projects/{self.name}.json', 'w') as f:
-            obj = self.to_obj()
-            papers = []
-            for paper in obj["papers"]:
-                papers.append(paper['arxiv_id'])
-            obj["papers"] = papers
-            json.dump(obj, f, indent=4)
+        get_storage().save_project({
+            "name": self.name,
+            "papers": self.paper_ids
+        })
 
+    # False if the paper already is in the project, checked before the paper is loaded
     def add_paper(self, paper_id: str) -> bool:
-        paper = Paper(paper_id)
-        containsPaper = False
-        for p in self.papers:
-            if p.arxiv_id == paper_id:
-                containsPaper = True
-                break
-        if containsPaper:
+        if self.has_paper(paper_id):
             return False
-        
-        self.papers.append(paper)
-        return True
-    
-    def remove_paper(self, paper_id: str):
-        paper = None
-        for p in self.papers:
-            if p.arxiv_id == paper_id:
-                paper = p
-                break
-        self.papers.remove(paper)
-
-    def to_obj(self):
+        paper = Paper(paper_id)
+        added = get_storage().add_project_papers(self.name, [paper_id])
+        self.members[paper_id] = None
+        self.loaded_papers[paper_id] = paper
+        return len(added) > 0
+
+    # Normalizes the ids, sorts out invalid ones and repeats within the request and
+    # checks the rest against the membership (they have to be members when
+    # member is set), all before anything is fetched. Returns (one result per
+    # given id in order, normalized ids left to act on).
+    def _sort_ids(self, paper_ids: List[str], member: bool) -> Tuple[List[dict], List[str]]:
+        results = []
+        pending = []
+        seen = set()
+        for paper_id in paper_ids:
+            result = { "id": paper_id, "arxiv_id": None, "status": None }
+            results.append(result)
+            if not isinstance(paper_id, str) or not is_arxiv_id(normalize_arxiv_id(paper_id)):
+                result["status"] = 'invalid'
+                continue
+            arxiv_id = strip_version(normalize_arxiv_id(paper_id))
+            result["arxiv_id"] = arxiv_id
+            if arxiv_id in seen:
+                result["status"] = 'duplicate'
+            elif self.has_paper(arxiv_id) != member:
+                result["status"] = 'missing' if member else 'exists'
+            else:
+                pending.append(arxiv_id)
+            seen.add(arxiv_id)
+        return results, pending
+
+    # Registers every new paper with one append and hands the ones without a
+    # stored reference list to ingest, which queues them and returns a job id for
+    # the result. A paper record alone may be metadata or a failed ingest, so it
+    # does not count. Papers already stored are not loaded at all.
+    def add_papers(self, paper_ids: List[str], ingest: Callable[[str], str] | None = None) -> List[dict]:
+        results, pending = self._sort_ids(paper_ids, False)
+        added = set(get_storage().add_project_papers(self.name, pending))
+        for arxiv_id in pending:
+            self.members[arxiv_id] = None
+        stored = get_storage().stored_reference_lists(list(added))
+        for result in results:
+            if result["status"] is not None:
+                continue
+            arxiv_id = result["arxiv_id"]
+            if arxiv_id not in added:
+                # Another request added it in the meantime
+                result["status"] = 'exists'
+                continue
+            result["status"] = 'added'
+            if ingest is not None and arxiv_id not in stored:
+                try:
+                    result["job_id"] = ingest(arxiv_id)
+                except Exception as e:
+                    result["error"] = str(e)
+        return results
+
+    def remove_papers(self, paper_ids: List[str]) -> List[dict]:
+        results, pending = self._sort_ids(paper_ids, True)
+        removed = set(get_storage().remove_project_papers(self.name, pending))
+        for arxiv_id in pending:
+            self.members.pop(arxiv_id, None)
+            self.loaded_papers.pop(arxiv_id, None)
+        for result in results:
+            if result["status"] is None:
+                result["status"] = 'removed' if result["arxiv_id"] in removed else 'missing'
+        return results
+
+    # False if the paper is not in the project
+    def remove_paper(self, paper_id: str) -> bool:
+        removed = get_storage().remove_project_papers(self.name, [paper_id])
+        if self.loaded_members is not None:
+            self.loaded_members.pop(paper_id, None)
+        self.loaded_papers.pop(paper_id, None)
+        return len(removed) > 0
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "paper_count": len(self.members)
+        }
+
+    # fields limits each paper object to the listed keys, arxiv_id is always kept
+    def to_obj(self, offset: int = 0, limit: int | None = None, fields: List[str] | None = None):
         papers = []
-        for p in self.papers:
-            papers.append(p.to_obj())
+        for p in self.get_papers(offset, limit):
+            obj = p.to_obj(fields is None or 'references' in fields)
+            if fields is not None:
+                obj = { key: value for key, value in obj.items() if key in fields or key == 'arxiv_id' }
+            papers.append(obj)
         return {
             "name": self.name,
+            "paper_count": len(self.members),
+            "offset": offset,
+            "limit": limit,
             "papers": papers
         }
 
 def get_projects() -> List[Project]:
     projects = []
-    if not os.path.exists('projects'):
-        return []
-    for p in os.listdir('projects'):
-        projects.append(Project(p.replace('.json', '')))
+    for name in get_storage().list_projects():
+        projects.append(Project(name))
     return projects
+
+def get_project_summaries() -> List[dict]:
+    return get_storage().list_project_summaries()
@@ -1,34 +1,70 @@
+import threading
+import weakref
+from typing import List, Tuple
+
 from lib import get_date_by_id
 
+# Only the fields sent to the client are kept, the raw bib entry stays in
+# storage and is read back when a caller asks for it. The citation key belongs
+# to the citing paper, so one Reference can be shared by every paper citing it.
 class Reference:
-    def __init__(self, data: object):
-        self.id = None
-        self.title = None
-        self.arxiv_id = None
-        self.url = None
-        self.author = None
-        self.date = None
-        self.data = data
+    __slots__ = ('ref_id', 'title', 'arxiv_id', 'url', 'author', 'date', '__weakref__')
 
-        if 'ID' in data:
-            self.id = data["ID"]
-        if 'arxiv_id' in data:
-            self.arxiv_id = data["arxiv_id"]
-            self.date = get_date_by_id(self.arxiv_id)
-        if 'url' in data:
-            self.url = data["url"]
-        if 'author' in data:
-            self.author = data["author"]
-        if 'title' in data:
-            self.title = data["title"]
+    def __init__(self, data: object, ref_id: object = None):
+        self.ref_id = ref_id
+        self.title = data.get("title")
+        self.arxiv_id = data.get("arxiv_id")
+        self.url = data.get("url")
+        self.author = data.get("author")
+        self.date = get_date_by_id(self.arxiv_id) if self.arxiv_id is not None else None
 
-    def to_obj(self):
-        return {
-            "id": self.id,
+    def to_obj(self, cite_key: str | None = None, data: object | None = None):
+        obj = {
+            "id": cite_key,
+            "ref_id": self.ref_id,
             "title": self.title,
             "arxiv_id": self.arxiv_id,
             "date": self.date,
             "url": self.url,
-            "author": self.author,
-            "data": self.data
-        }
\ No newline at end of file
+            "author": self.author
+        }
+        if data is not None:
+            obj["data"] = data
+        return obj
+
+# One Reference per stored record while any loaded paper still holds it
+interned: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+interned_lock = threading.Lock()
+
+# Returns (citation keys, references) for a stored reference list, only records
+# not already held by another loaded paper are read from storage. After the list
+# was just saved refresh reads every record, the save may have updated them.
+def load_references(storage, arxiv_id: str, refresh: bool = False) -> Tuple[List[str | None], List[Reference]] | None:
+    reference_list = storage.get_reference_list(arxiv_id)
+    if reference_list is None:
+        return None
+    found = {}
+    missing = []
+    with interned_lock:
+        for ref_id, _ in reference_list:
+            reference = interned.get(ref_id) if not refresh else None
+            if reference is None:
+                missing.append(ref_id)
+            else:
+                found[ref_id] = reference
+    if len(missing) > 0:
+        records = storage.get_reference_records(list(dict.fromkeys(missing)))
+        with interned_lock:
+            for ref_id, record in records.items():
+                reference = interned.get(ref_id) if not refresh else None
+                if reference is None:
+                    reference = Reference(record, ref_id)
+                    interned[ref_id] = reference
+                found[ref_id] = reference
+    cite_keys = []
+    references = []
+    for ref_id, cite_key in reference_list:
+        if ref_id in found:
+            cite_keys.append(cite_key)
+            references.append(found[ref_id])
+    return cite_keys, references
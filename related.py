@@ -0,0 +1,302 @@
+import threading
+from array import array
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from storage import Storage, get_storage, reference_key, reference_record
+
+METHODS = ['coupling', 'cocitation', 'both']
+MAX_K = 100
+# Entries added since the last build are kept in a small delta matrix until
+# there are this many, or this fraction of the built ones
+MIN_MERGE = 20000
+MERGE_FRACTION = 0.1
+
+# Cited works are told apart by arxiv id, doi or normalized title. Title keys
+# carry the year, drop it so the same title matches across bib entries.
+def identity(key: str) -> str | None:
+    if key.startswith('title:'):
+        return key[:key.rindex(':')]
+    if key.startswith('raw:'):
+        return None
+    return key
+
+# Positions of the k highest scores, best first
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    positions = np.arange(len(scores))
+    if len(scores) > k:
+        positions = np.argpartition(-scores, k - 1)[:k]
+    return positions[np.argsort(-scores[positions], kind='stable')]
+
+# Sparse paper x cited work incidence matrix. Bibliographic coupling of a paper
+# is its row times the transposed matrix (papers sharing references), co-citation
+# is the rows of every paper citing it summed up (works cited next to it). Both
+# are cosine normalized by the row and column degrees.
+#
+# Entries are appended as papers arrive. Everything up to the last build lives in
+# the CSR base matrices, newer entries in a delta matrix that is rebuilt when it
+# changes and folded into the base once it grows past MIN_MERGE or MERGE_FRACTION.
+# A paper whose references change gets a new row and its old row is marked dead.
+class RelatedPapers:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.row_papers: List[str] = []
+        self.paper_rows: Dict[str, int] = {}
+        self.col_keys: List[str] = []
+        self.col_index: Dict[str, int] = {}
+        self.entry_rows = array('I')
+        self.entry_cols = array('I')
+        self.row_start = array('Q')
+        self.row_end = array('Q')
+        self.row_degree = array('I')
+        self.col_degree = array('I')
+        self.live = bytearray()
+        # Entries in the base matrices, and the matrices for base and delta
+        self.built = 0
+        self.base: Tuple[sparse.csr_matrix, sparse.csr_matrix] | None = None
+        self.delta: Tuple[sparse.csr_matrix, sparse.csr_matrix] | None = None
+        self.delta_entries = 0
+
+    def _col(self, key: str) -> int:
+        col = self.col_index.get(key)
+        if col is None:
+            col = len(self.col_keys)
+            self.col_keys.append(key)
+            self.col_index[key] = col
+            self.col_degree.append(0)
+        return col
+
+    # keys are storage reference keys, see storage.reference_key
+    def set_references(self, paper_id: str, keys: List[str]):
+        with self.lock:
+            old_row = self.paper_rows.get(paper_id)
+            if old_row is not None:
+                self.live[old_row] = 0
+                for col in self.entry_cols[self.row_start[old_row]:self.row_end[old_row]]:
+                    self.col_degree[col] -= 1
+            cols = []
+            seen = set()
+            for key in keys:
+                work = identity(key)
+                if work is None or work == 'arxiv:' + paper_id or work in seen:
+                    continue
+                seen.add(work)
+                cols.append(self._col(work))
+            row = len(self.row_papers)
+            self.row_papers.append(paper_id)
+            self.paper_rows[paper_id] = row
+            self.row_start.append(len(self.entry_cols))
+            self.entry_rows.extend([row] * len(cols))
+            self.entry_cols.extend(cols)
+            self.row_end.append(len(self.entry_cols))
+            self.row_degree.append(len(cols))
+            self.live.append(1)
+            for col in cols:
+                self.col_degree[col] += 1
+
+    def add_references(self, paper_id: str, references: List[dict]):
+        self.set_references(paper_id, [reference_key(reference_record(reference)) for reference in references])
+
+    def _matrix(self, start: int, end: int, live: np.ndarray) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+        rows = np.frombuffer(self.entry_rows, dtype=np.uint32)[start:end]
+        cols = np.frombuffer(self.entry_cols, dtype=np.uint32)[start:end]
+        keep = live[rows]
+        rows, cols = rows[keep], cols[keep]
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(self.row_papers), len(self.col_keys))
+        )
+        return matrix, matrix.T.tocsr()
+
+    # Drops the rows of papers whose references were replaced. Only called when
+    # the base is rebuilt, as it renumbers the rows under every matrix.
+    def _compact(self):
+        live = self._live_mask()
+        if live.all():
+            return
+        new_rows = np.cumsum(live, dtype=np.int64) - 1
+        rows = np.frombuffer(self.entry_rows, dtype=np.uint32)
+        keep = live[rows]
+        degree = np.frombuffer(self.row_degree, dtype=np.uint32)[live]
+        row_end = np.cumsum(degree, dtype=np.uint64)
+        self.entry_rows = array('I', new_rows[rows[keep]].astype(np.uint32).tobytes())
+        self.entry_cols = array('I', np.frombuffer(self.entry_cols, dtype=np.uint32)[keep].tobytes())
+        self.row_start = array('Q', (row_end - degree).tobytes())
+        self.row_end = array('Q', row_end.tobytes())
+        self.row_degree = array('I', degree.tobytes())
+        self.row_papers = [paper_id for paper_id, alive in zip(self.row_papers, live) if alive]
+        self.paper_rows = { paper_id: row for row, paper_id in enumerate(self.row_papers) }
+        self.live = bytearray(b'\x01') * len(self.row_papers)
+
+    # Base and delta (A, A transposed) pairs, shaped for every row and column so far
+    def _matrices(self) -> List[Tuple[sparse.csr_matrix, sparse.csr_matrix]]:
+        total = len(self.entry_cols)
+        if self.base is None or total - self.built > max(MIN_MERGE, MERGE_FRACTION * self.built):
+            self._compact()
+            total = len(self.entry_cols)
+            self.base = self._matrix(0, total, self._live_mask())
+            self.built = total
+            self.delta = None
+        live = self._live_mask()
+        shape = (len(self.row_papers), len(self.col_keys))
+        if self.base[0].shape != shape:
+            self.base[0].resize(shape)
+            self.base[1].resize((shape[1], shape[0]))
+        if self.built == total:
+            return [self.base]
+        if self.delta is None or self.delta_entries != total or self.delta[0].shape != shape:
+            self.delta = self._matrix(self.built, total, live)
+            self.delta_entries = total
+        return [self.base, self.delta]
+
+    def _live_mask(self) -> np.ndarray:
+        return np.frombuffer(bytes(self.live), dtype=np.uint8).astype(bool)
+
+    # Sums the rows of the base and delta matrices, one row per query
+    @staticmethod
+    def _rows(matrices: List[sparse.csr_matrix], rows: np.ndarray) -> sparse.csr_matrix:
+        total = matrices[0][rows]
+        for matrix in matrices[1:]:
+            total = total + matrix[rows]
+        return total.tocsr()
+
+    @staticmethod
+    def _product(left: sparse.csr_matrix, matrices: List[sparse.csr_matrix]) -> sparse.csr_matrix:
+        total = left @ matrices[0]
+        for matrix in matrices[1:]:
+            total = total + left @ matrix
+        return total.tocsr()
+
+    # Ranks row i of a batched product, skipping exclude and entries masked out
+    @staticmethod
+    def _rank(product: sparse.csr_matrix, i: int, degree: np.ndarray, query_degree: float, exclude: int, mask: np.ndarray | None, k: int) -> List[Tuple[int, float, int]]:
+        start, end = product.indptr[i], product.indptr[i + 1]
+        indices = product.indices[start:end]
+        counts = product.data[start:end]
+        keep = (indices != exclude) & (counts > 0)
+        if mask is not None:
+            keep &= mask[indices]
+        indices, counts = indices[keep], counts[keep]
+        scores = counts / np.sqrt(query_degree * degree[indices])
+        best = top_k(scores, k)
+        return [(int(indices[j]), float(scores[j]), int(counts[j])) for j in best]
+
+    # { arxiv id: [(paper, score, shared references)] }, for papers with stored
+    # references. All queries go through one batched sparse product.
+    def coupling(self, arxiv_ids: List[str], k: int = 10) -> Dict[str, List[Tuple[str, float, int]]]:
+        with self.lock:
+            if not any(arxiv_id in self.paper_rows for arxiv_id in arxiv_ids):
+                return {}
+            # Building the matrices may renumber the rows, look them up afterwards
+            matrices = self._matrices()
+            queries = [(arxiv_id, self.paper_rows[arxiv_id]) for arxiv_id in arxiv_ids if arxiv_id in self.paper_rows]
+            rows = np.array([row for _, row in queries])
+            query_rows = self._rows([matrix for matrix, _ in matrices], rows)
+            shared = self._product(query_rows, [transposed for _, transposed in matrices])
+            live = self._live_mask()
+            degree = np.frombuffer(self.row_degree, dtype=np.uint32).astype(np.float32)
+            results = {}
+            for i, (arxiv_id, row) in enumerate(queries):
+                ranked = self._rank(shared, i, degree, degree[row], row, live, k)
+                results[arxiv_id] = [(self.row_papers[index], score, count) for index, score, count in ranked]
+            return results
+
+    # { arxiv id: [(cited work key, score, papers citing both)] } for papers that
+    # are cited by stored papers
+    def cocitation(self, arxiv_ids: List[str], k: int = 10) -> Dict[str, List[Tuple[str, float, int]]]:
+        with self.lock:
+            queries = [(arxiv_id, self.col_index['arxiv:' + arxiv_id]) for arxiv_id in arxiv_ids if 'arxiv:' + arxiv_id in self.col_index]
+            if len(queries) == 0:
+                return {}
+            matrices = self._matrices()
+            cols = np.array([col for _, col in queries])
+            citing = self._rows([transposed for _, transposed in matrices], cols)
+            # Rows that died after the base was built are still in it
+            live = self._live_mask()
+            citing.data *= live[citing.indices]
+            citing.eliminate_zeros()
+            together = self._product(citing, [matrix for matrix, _ in matrices])
+            degree = np.frombuffer(self.col_degree, dtype=np.uint32).astype(np.float32)
+            results = {}
+            for i, (arxiv_id, col) in enumerate(queries):
+                ranked = self._rank(together, i, degree, degree[col], col, None, k)
+                results[arxiv_id] = [(self.col_keys[index], score, count) for index, score, count in ranked]
+            return results
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "papers": sum(self.live),
+                "works": len(self.col_keys),
+                "entries": len(self.entry_cols),
+                "built": self.built
+            }
+
+    # Coupling and co-citation scores added up per paper, co-cited works
+    # without an arxiv id only show up with method cocitation
+    def related(self, arxiv_id: str, k: int = 10, method: str = 'both') -> List[dict]:
+        combined: Dict[str, dict] = {}
+        if method in ('coupling', 'both'):
+            for paper_id, score, count in self.coupling([arxiv_id], k).get(arxiv_id, []):
+                combined[paper_id] = { "arxiv_id": paper_id, "key": 'arxiv:' + paper_id, "score": score, "shared_references": count, "cocited": 0 }
+        if method in ('cocitation', 'both'):
+            for key, score, count in self.cocitation([arxiv_id], k).get(arxiv_id, []):
+                paper_id = key[len('arxiv:'):] if key.startswith('arxiv:') else None
+                if paper_id is None and method == 'both':
+                    continue
+                entry = combined.setdefault(paper_id or key, { "arxiv_id": paper_id, "key": key, "score": 0.0, "shared_references": 0, "cocited": 0 })
+                entry["score"] += score
+                entry["cocited"] = count
+        return sorted(combined.values(), key=lambda entry: -entry["score"])[:k]
+
+    @staticmethod
+    def build(storage: Storage) -> 'RelatedPapers':
+        engine = RelatedPapers()
+        for paper_id, keys in storage.iter_reference_keys():
+            engine.set_references(paper_id, keys)
+        with engine.lock:
+            engine._matrices()
+        return engine
+
+engine: RelatedPapers | None = None
+engine_lock = threading.Lock()
+# Only one thread builds the engine, reference lists stored while it reads
+# storage are kept here and added once it is done
+build_lock = threading.Lock()
+pending: List[Tuple[str, List[dict]]] | None = None
+
+# Built from storage on first use, later reference lists are added as they are
+# stored. The build runs outside engine_lock so storing references never waits for it.
+def get_related() -> RelatedPapers:
+    global engine, pending
+    with engine_lock:
+        if engine is not None:
+            return engine
+    with build_lock:
+        with engine_lock:
+            if engine is not None:
+                return engine
+            pending = []
+        try:
+            built = RelatedPapers.build(get_storage())
+        except Exception:
+            with engine_lock:
+                pending = None
+            raise
+        with engine_lock:
+            for paper_id, references in pending:
+                built.add_references(paper_id, references)
+            pending = None
+            engine = built
+        return built
+
+# Keeps the engine current without building it just for an update
+def notify_references(paper_id: str, references: List[dict]):
+    with engine_lock:
+        current = engine
+        if current is None and pending is not None:
+            pending.append((paper_id, references))
+    if current is not None:
+        current.add_references(paper_id, references)
@@ -0,0 +1,308 @@
+import os
+import gzip
+import json
+import time
+import atexit
+import threading
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+
+import numpy as np
+
+from lib import normalize_title
+from graph import SNAPSHOT_INTERVAL, get_graph
+from search import get_search_index
+from storage import get_storage, iter_batches
+from related import notify_references
+
+RESOLVER_FILE = os.environ.get('ARXIV_RESOLVER', 'titles.snapshot')
+# Jaccard similarity of the title trigrams needed to accept a match
+THRESHOLD = 0.8
+# 16 bands of 4 rows: titles with a similarity of 0.8 share a band with a
+# probability of more than 0.99, at 0.3 it drops under 0.15
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+# Titles hashed together, bounds the (NUM_PERM x trigrams) matrix to a few tens of MB
+HASH_BATCH_SIZE = 1000
+# Titles added since the last sort are scanned linearly until there are this many
+MAX_UNSORTED = 50000
+
+random_state = np.random.RandomState(1)
+# Multiply-add hash functions over 64 bit words, a has to be odd
+PERM_A = random_state.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+PERM_B = random_state.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+ROW_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5], dtype=np.uint64)
+
+# Normalized titles are plain ascii, so each trigram packs into one 24 bit int
+def trigrams(normalized: str) -> Set[int]:
+    data = f' {normalized} '.encode('ascii')
+    return { (data[i] << 16) | (data[i + 1] << 8) | data[i + 2] for i in range(len(data) - 2) }
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# MinHash signatures of many normalized titles at once, folded into one hash
+# per band. Trigrams are cut straight out of the joined title bytes, repeated
+# trigrams do not change a minimum so they are not removed.
+def band_hashes(titles: List[str]) -> np.ndarray:
+    result = np.zeros((len(titles), BANDS), dtype=np.uint64)
+    for start in range(0, len(titles), HASH_BATCH_SIZE):
+        batch = [f' {title} '.encode('ascii') for title in titles[start:start + HASH_BATCH_SIZE]]
+        data = np.frombuffer(b''.join(batch), dtype=np.uint8).astype(np.uint64)
+        ends = np.cumsum([len(title) for title in batch])
+        # Trigram i starts at byte i, the last two of every title would run into the next one
+        valid = np.ones(len(data) - 2, dtype=bool)
+        valid[ends[:-1] - 2] = False
+        valid[ends[:-1] - 1] = False
+        values = ((data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:])[valid]
+        lengths = np.array([len(title) - 2 for title in batch])
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        # Spread the 24 bit trigrams over 64 bits first, a linear hash of small
+        # ints would keep their order and every function would pick the same minimum
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        hashed = (PERM_A[:, None] * values[None, :] + PERM_B[:, None]) >> np.uint64(32)
+        signatures = np.minimum.reduceat(hashed, offsets, axis=1).T
+        rows = signatures.reshape(len(batch), BANDS, ROWS)
+        # uint64 arithmetic wraps around, which is fine for a hash
+        result[start:start + len(batch)] = (rows * ROW_MIX).sum(axis=2, dtype=np.uint64)
+    return result
+
+# Title to arxiv id index. Every title gets a MinHash signature over its
+# character trigrams, split into bands for locality sensitive hashing. Titles
+# sharing a band with the query are candidates and are checked with the exact
+# trigram similarity.
+class TitleResolver:
+    def __init__(self):
+        self.ids: List[str] = []
+        self.titles: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.bands = np.zeros((0, BANDS), dtype=np.uint64)
+        # Per band the hashes of the first sorted_count titles in sorted order
+        self.sorted_keys: List[np.ndarray] = []
+        self.sorted_docs: List[np.ndarray] = []
+        self.sorted_count = 0
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.saved_at = 0.0
+
+    def add_titles(self, titles: Dict[str, str]):
+        ids = []
+        normalized = []
+        for arxiv_id, title in titles.items():
+            if arxiv_id in self.index or title is None:
+                continue
+            title = normalize_title(title)
+            if len(title) < 3:
+                continue
+            ids.append(arxiv_id)
+            normalized.append(title)
+        if len(ids) == 0:
+            return
+        hashes = band_hashes(normalized)
+        with self.lock:
+            for arxiv_id, title in zip(ids, normalized):
+                self.index[arxiv_id] = len(self.ids)
+                self.ids.append(arxiv_id)
+                self.titles.append(title)
+            self.bands = np.concatenate((self.bands, hashes))
+            self.dirty = True
+            if len(self.ids) - self.sorted_count > MAX_UNSORTED:
+                self._sort()
+
+    def _sort(self):
+        self.sorted_keys = []
+        self.sorted_docs = []
+        for band in range(BANDS):
+            order = np.argsort(self.bands[:, band], kind='stable').astype(np.int64)
+            self.sorted_docs.append(order)
+            self.sorted_keys.append(self.bands[order, band])
+        self.sorted_count = len(self.ids)
+
+    def _candidates(self, query: np.ndarray) -> Set[int]:
+        candidates = set()
+        for band in range(BANDS):
+            if self.sorted_count > 0:
+                keys = self.sorted_keys[band]
+                left = np.searchsorted(keys, query[band], 'left')
+                right = np.searchsorted(keys, query[band], 'right')
+                candidates.update(self.sorted_docs[band][left:right].tolist())
+            tail = np.nonzero(self.bands[self.sorted_count:, band] == query[band])[0]
+            candidates.update((tail + self.sorted_count).tolist())
+        return candidates
+
+    # Returns (arxiv_id, similarity) of the best match at or above the threshold for each title
+    def resolve(self, titles: List[str | None], threshold: float = THRESHOLD) -> List[Tuple[str, float] | None]:
+        normalized = [normalize_title(title) if title is not None else '' for title in titles]
+        shingle_sets = [trigrams(title) if len(title) >= 3 else set() for title in normalized]
+        queries = [i for i, shingles in enumerate(shingle_sets) if len(shingles) > 0]
+        results: List[Tuple[str, float] | None] = [None] * len(titles)
+        if len(queries) == 0:
+            return results
+        hashes = band_hashes([normalized[i] for i in queries])
+        with self.lock:
+            for i, query in zip(queries, hashes):
+                best = None
+                for doc in self._candidates(query):
+                    score = jaccard(shingle_sets[i], trigrams(self.titles[doc]))
+                    if score >= threshold and (best is None or score > best[1]):
+                        best = (self.ids[doc], score)
+                results[i] = best
+        return results
+
+    # Fills in the arxiv_id of references that have none, returns how many were resolved
+    def resolve_references(self, references: List[dict], paper_id: str | None = None, threshold: float = THRESHOLD) -> int:
+        missing = [reference for reference in references if reference.get("arxiv_id") is None and reference.get("title")]
+        if len(missing) == 0:
+            return 0
+        resolved = 0
+        for reference, match in zip(missing, self.resolve([reference["title"] for reference in missing], threshold)):
+            if match is None or match[0] == paper_id:
+                continue
+            reference["arxiv_id"] = match[0]
+            reference["arxiv_id_score"] = round(match[1], 3)
+            resolved += 1
+        return resolved
+
+    # Snapshot layout: one json header line followed by the band hashes
+    def save(self, file_name: str = RESOLVER_FILE):
+        with self.lock:
+            header = { "ids": self.ids, "titles": self.titles }
+            partial_file_name = file_name + '.part'
+            with open(partial_file_name, 'wb') as f:
+                f.write(json.dumps(header).encode() + b'\n')
+                self.bands.tofile(f)
+            os.replace(partial_file_name, file_name)
+            self.dirty = False
+            self.saved_at = time.time()
+
+    def save_if_due(self, file_name: str = RESOLVER_FILE):
+        if self.dirty and time.time() - self.saved_at > SNAPSHOT_INTERVAL:
+            self.save(file_name)
+
+    def save_if_dirty(self, file_name: str = RESOLVER_FILE):
+        if self.dirty:
+            self.save(file_name)
+
+    @staticmethod
+    def load(file_name: str = RESOLVER_FILE) -> 'TitleResolver':
+        resolver = TitleResolver()
+        with open(file_name, 'rb') as f:
+            header = json.loads(f.readline())
+            bands = np.fromfile(f, dtype=np.uint64)
+        resolver.ids = header["ids"]
+        resolver.titles = header["titles"]
+        resolver.index = { arxiv_id: doc for doc, arxiv_id in enumerate(resolver.ids) }
+        resolver.bands = bands.reshape(len(resolver.ids), BANDS)
+        resolver._sort()
+        resolver.saved_at = time.time()
+        return resolver
+
+    # Adds every stored paper that the index has not seen yet
+    def catch_up(self, batch_size: int = 1000):
+        storage = get_storage()
+        paper_ids = [arxiv_id for arxiv_id in storage.list_paper_ids() if arxiv_id not in self.index]
+        for batch in iter_batches(paper_ids, batch_size):
+            papers = storage.get_papers(batch)
+            self.add_titles({ arxiv_id: paper.get("title") for arxiv_id, paper in papers.items() })
+
+    def stats(self) -> dict:
+        with self.lock:
+            return { "titles": len(self.ids), "unsorted": len(self.ids) - self.sorted_count }
+
+# Streams (arxiv id, title) pairs from a metadata dump: json lines with "id" and
+# "title", like the arXiv metadata snapshot, optionally gzipped
+def iter_dump(file_name: str) -> Iterator[Tuple[str, str]]:
+    opener = gzip.open if file_name.endswith('.gz') else open
+    with opener(file_name, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            entry = json.loads(line)
+            if entry.get("id") and entry.get("title"):
+                yield entry["id"], entry["title"]
+
+def load_dump(resolver: TitleResolver, file_name: str, batch_size: int = 10000) -> int:
+    count = 0
+    batch = {}
+    for arxiv_id, title in iter_dump(file_name):
+        batch[arxiv_id] = title
+        if len(batch) >= batch_size:
+            resolver.add_titles(batch)
+            count += len(batch)
+            batch = {}
+    resolver.add_titles(batch)
+    return count + len(batch)
+
+# Runs the resolver over every stored reference list, for references ingested
+# before the index knew their titles. Titles the index can not resolve are
+# passed to fallback in one batch, e.g. ScholarService.resolve.
+def resolve_stored_references(
+    resolver: TitleResolver,
+    threshold: float = THRESHOLD,
+    batch_size: int = 500,
+    fallback: Callable[[List[str]], Dict[str, str | None]] | None = None
+) -> Dict[str, int]:
+    storage = get_storage()
+    graph = get_graph()
+    counts = { "papers": 0, "resolved": 0 }
+    for batch in iter_batches(storage.list_reference_ids(), batch_size):
+        changed = {}
+        unresolved = []
+        for paper_id in batch:
+            references = storage.get_references(paper_id) or []
+            resolved = resolver.resolve_references(references, paper_id, threshold)
+            if resolved > 0:
+                changed[paper_id] = references
+                counts["resolved"] += resolved
+            for reference in references:
+                if reference.get("arxiv_id") is None and reference.get("title"):
+                    unresolved.append((paper_id, references, reference))
+        if fallback is not None and len(unresolved) > 0:
+            found = fallback([reference["title"] for _, _, reference in unresolved])
+            for paper_id, references, reference in unresolved:
+                arxiv_id = found.get(reference["title"])
+                if arxiv_id is None or arxiv_id == paper_id:
+                    continue
+                reference["arxiv_id"] = arxiv_id
+                changed[paper_id] = references
+                counts["resolved"] += 1
+        storage.save_references_batch(changed)
+        get_search_index().index_references(changed)
+        for paper_id, references in changed.items():
+            graph.set_references(paper_id, [reference.get("arxiv_id") for reference in references])
+            notify_references(paper_id, references)
+        counts["papers"] += len(changed)
+    graph.save()
+    return counts
+
+resolver: TitleResolver | None = None
+resolver_lock = threading.Lock()
+
+def get_resolver() -> TitleResolver:
+    global resolver
+    with resolver_lock:
+        if resolver is None:
+            if os.path.exists(RESOLVER_FILE):
+                resolver = TitleResolver.load(RESOLVER_FILE)
+            else:
+                resolver = TitleResolver()
+            resolver.catch_up()
+            resolver.save_if_due()
+            # Titles added since the last periodic save are written when the process exits
+            atexit.register(save_resolver)
+        return resolver
+
+def save_resolver():
+    with resolver_lock:
+        current = resolver
+    if current is not None:
+        current.save_if_dirty()
+
+def set_resolver(new_resolver: TitleResolver):
+    global resolver
+    with resolver_lock:
+        resolver = new_resolver
@@ -1,57 +1,231 @@
+import os
 import re
+import time
+import queue
+import atexit
 import random
+import sqlite3
+import threading
 from time import sleep
+from concurrent.futures import Future
+from typing import Dict, List
 from urllib.parse import quote
 
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-SEARCH_URL = "https://scholar.google.com/scholar?hl=en&as_sdt=0%2C44&q="
+from lib import normalize_title
+
+# Overridable so lookups can be pointed at a local stand-in page
+SEARCH_URL = os.environ.get('SCHOLAR_URL', "https://scholar.google.com/scholar?hl=en&as_sdt=0%2C44&q=")
+CACHE_FILE = os.environ.get('SCHOLAR_CACHE', 'scholar.db')
+POOL_SIZE = 2
+# Seconds a cached answer is trusted, misses are retried sooner
+CACHE_TTL = 30 * 24 * 60 * 60
+NEGATIVE_TTL = 7 * 24 * 60 * 60
+# Leading characters of the normalized titles that have to agree
+MATCH_LENGTH = 50
 
 RESULT_CLASS = "gs_r"
 TITLE_CLASS = "gs_rt"
 LINK_CLASS = "gs_ggsd"
 
-def sleep_rand():
+def sleep_rand(base: float = 5):
     extra_sec = random.randint(1, 5)
     extra_mil = random.randint(1, 999)
-    sleep_time = float(str(5 + extra_sec) + '.' + str(extra_mil))
+    sleep_time = base + extra_sec + extra_mil / 1000
     print(f'Sleeping {sleep_time:.2f}s')
     sleep(sleep_time)
 
-def get_arxiv_from_g_scholar(title: str):
-    sub = title[:100]
-
+def create_driver() -> webdriver.Chrome:
     options = Options()
-    options.headless = True
+    options.add_argument("--headless=new")
     options.add_argument("--window-size=1920,1200")
+    return webdriver.Chrome(options=options)
 
-    driver = webdriver.Chrome(options=options)
-    driver.get(SEARCH_URL + quote(title))
-    # sleep_rand()
+# Loads one result page in an existing driver and returns the arxiv id of the
+# result whose title matches, or None if no result does
+def find_arxiv_id(driver: webdriver.Chrome, title: str, search_url: str = SEARCH_URL) -> str | None:
+    sub = normalize_title(title)[:MATCH_LENGTH]
+    driver.get(search_url + quote(title))
     try:
         # Wait for the results to load
         WebDriverWait(driver, 10).until(
             EC.presence_of_element_located((By.CLASS_NAME, RESULT_CLASS))
         )
-        # Find the profile link
-        for el in driver.find_elements(By.CLASS_NAME, RESULT_CLASS):
+    except TimeoutException:
+        return None
+    for el in driver.find_elements(By.CLASS_NAME, RESULT_CLASS):
+        try:
+            result_title = el.find_element(By.CLASS_NAME, TITLE_CLASS).find_element(By.TAG_NAME, "a").text
+            if normalize_title(result_title)[:MATCH_LENGTH] != sub:
+                continue
+            link = el.find_element(By.CLASS_NAME, LINK_CLASS).find_element(By.TAG_NAME, "a").get_attribute("href")
+            match = re.findall(r'\d{4}\.\d{4,5}', link)
+            if len(match) == 0:
+                continue
+            return match[0]
+        except WebDriverException:
+            continue
+    return None
+
+# Lookups keyed by normalized title. Misses are cached too, with a NULL arxiv id.
+class ScholarCache:
+    def __init__(self, file_name: str = CACHE_FILE, ttl: float = CACHE_TTL, negative_ttl: float = NEGATIVE_TTL):
+        self.file_name = file_name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.local = threading.local()
+        with self._conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS lookups (title TEXT PRIMARY KEY, arxiv_id TEXT, fetched REAL NOT NULL)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_name, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    # Returns { title: arxiv id or None } for the titles with a fresh entry
+    def get_many(self, titles: List[str]) -> Dict[str, str | None]:
+        keys = { normalize_title(title): title for title in titles }
+        found = {}
+        now = time.time()
+        conn = self._conn()
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):
+            batch = key_list[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            for key, arxiv_id, fetched in conn.execute(f'SELECT title, arxiv_id, fetched FROM lookups WHERE title IN ({placeholders})', batch):
+                ttl = self.ttl if arxiv_id is not None else self.negative_ttl
+                if now - fetched <= ttl:
+                    found[keys[key]] = arxiv_id
+        return found
+
+    def put(self, title: str, arxiv_id: str | None):
+        with self._conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO lookups (title, arxiv_id, fetched) VALUES (?, ?, ?)', (normalize_title(title), arxiv_id, time.time()))
+
+    def purge(self) -> int:
+        now = time.time()
+        with self._conn() as conn:
+            cursor = conn.execute(
+                'DELETE FROM lookups WHERE (arxiv_id IS NOT NULL AND fetched < ?) OR (arxiv_id IS NULL AND fetched < ?)',
+                (now - self.ttl, now - self.negative_ttl)
+            )
+            return cursor.rowcount
+
+# A few long lived browsers working through a queue of titles. Every driver
+# waits the politeness delay between its page loads and is only relaunched
+# after it crashed, so n lookups cost n page loads and pool_size launches.
+class ScholarService:
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        cache: ScholarCache | None = None,
+        search_url: str = SEARCH_URL,
+        polite: bool = True,
+        driver_factory = create_driver
+    ):
+        self.cache = cache if cache is not None else ScholarCache()
+        self.search_url = search_url
+        self.polite = polite
+        self.driver_factory = driver_factory
+        self.tasks: queue.Queue = queue.Queue()
+        self.launches = 0
+        self.page_loads = 0
+        self.lock = threading.Lock()
+        self.workers = [threading.Thread(target=self._work, name=f'scholar-{i}', daemon=True) for i in range(pool_size)]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self):
+        driver = None
+        loaded = False
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            title, future = task
             try:
-                title = el.find_element(By.CLASS_NAME, TITLE_CLASS).find_element(By.TAG_NAME, "a").text[:50]
-                if title != sub:
-                    continue
-                link = el.find_element(By.CLASS_NAME, LINK_CLASS).find_element(By.TAG_NAME, "a").get_attribute("href")
-                match = re.findall(r'\d{4}.\d{5}', link)
-                if len(match) == 0:
-                    continue
-
-                return match[0]
-            except:
+                if driver is None:
+                    driver = self.driver_factory()
+                    loaded = False
+                    with self.lock:
+                        self.launches += 1
+                if loaded and self.polite:
+                    sleep_rand()
+                loaded = True
+                with self.lock:
+                    self.page_loads += 1
+                arxiv_id = find_arxiv_id(driver, title, self.search_url)
+                self.cache.put(title, arxiv_id)
+                future.set_result(arxiv_id)
+            except WebDriverException as e:
+                # The browser is in an unknown state, start a fresh one for the next title
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except WebDriverException:
+                        pass
+                driver = None
+                future.set_exception(e)
+            except Exception as e:
+                future.set_exception(e)
+        if driver is not None:
+            driver.quit()
+
+    def submit(self, title: str) -> Future:
+        future = Future()
+        self.tasks.put((title, future))
+        return future
+
+    # Returns { title: arxiv id or None }, titles whose lookup failed are left out
+    def resolve(self, titles: List[str]) -> Dict[str, str | None]:
+        unique = list(dict.fromkeys(title for title in titles if title))
+        results = self.cache.get_many(unique)
+        futures = {}
+        seen = set(normalize_title(title) for title in results)
+        for title in unique:
+            key = normalize_title(title)
+            if key in seen:
                 continue
+            seen.add(key)
+            futures[title] = self.submit(title)
+        for title, future in futures.items():
+            try:
+                results[title] = future.result()
+            except Exception as e:
+                print(f'Scholar lookup failed for "{title}": {e}')
+        # Titles that normalize to the same key share one lookup
+        by_key = { normalize_title(title): arxiv_id for title, arxiv_id in results.items() }
+        return { title: by_key[normalize_title(title)] for title in unique if normalize_title(title) in by_key }
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return { "launches": self.launches, "page_loads": self.page_loads, "queued": self.tasks.qsize() }
+
+service: ScholarService | None = None
+service_lock = threading.Lock()
+
+def get_scholar_service() -> ScholarService:
+    global service
+    with service_lock:
+        if service is None:
+            service = ScholarService()
+            atexit.register(service.close)
+        return service
 
-    except Exception:
-        sleep(1)
-        return None
\ No newline at end of file
+def get_arxiv_from_g_scholar(title: str) -> str | None:
+    return get_scholar_service().resolve([title]).get(title)
@@ -0,0 +1,179 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List
+
+from bbl import clean_latex
+from storage import Storage, iter_batches
+
+SEARCH_DB = os.environ.get('ARXIV_SEARCH_DB', 'search.db')
+MAX_LIMIT = 100
+TERM = re.compile(r'\w+', re.U)
+
+# Rows live in plain tables keyed for incremental updates, the fts5 tables are
+# external content indexes over them kept in sync by triggers. fts5 stores
+# positional postings and ranks with bm25, the prefix option adds prefix indexes
+# so queries typed into the search box stay fast.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS paper_rows (
+    rowid INTEGER PRIMARY KEY,
+    arxiv_id TEXT NOT NULL UNIQUE,
+    title TEXT,
+    abstract TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS paper_text USING fts5(
+    title, abstract,
+    content='paper_rows', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+);
+CREATE TRIGGER IF NOT EXISTS paper_rows_insert AFTER INSERT ON paper_rows BEGIN
+    INSERT INTO paper_text (rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+END;
+CREATE TRIGGER IF NOT EXISTS paper_rows_delete AFTER DELETE ON paper_rows BEGIN
+    INSERT INTO paper_text (paper_text, rowid, title, abstract) VALUES ('delete', old.rowid, old.title, old.abstract);
+END;
+
+CREATE TABLE IF NOT EXISTS reference_rows (
+    rowid INTEGER PRIMARY KEY,
+    paper_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    arxiv_id TEXT,
+    title TEXT,
+    author TEXT
+);
+CREATE INDEX IF NOT EXISTS reference_rows_paper_id ON reference_rows (paper_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS reference_text USING fts5(
+    title, author,
+    content='reference_rows', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+);
+CREATE TRIGGER IF NOT EXISTS reference_rows_insert AFTER INSERT ON reference_rows BEGIN
+    INSERT INTO reference_text (rowid, title, author) VALUES (new.rowid, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS reference_rows_delete AFTER DELETE ON reference_rows BEGIN
+    INSERT INTO reference_text (reference_text, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author);
+END;
+'''
+
+# Every word of the query has to match, the last one also matches as a prefix
+# since it is usually still being typed
+def build_query(query: str, prefix: bool = True) -> str | None:
+    terms = TERM.findall(query.lower())
+    if len(terms) == 0:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if prefix:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def clean_field(value) -> str | None:
+    if value is None:
+        return None
+    return clean_latex(str(value))
+
+class SearchIndex:
+    def __init__(self, file_name: str = SEARCH_DB):
+        self.file_name = file_name
+        self.local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_name, timeout=30, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def index_papers(self, papers: Dict[str, dict]):
+        rows = [(arxiv_id, clean_field(paper.get("title")), clean_field(paper.get("abstract"))) for arxiv_id, paper in papers.items()]
+        with self._conn() as conn:
+            # A replace would not fire the delete trigger, so remove the old row first
+            conn.executemany('DELETE FROM paper_rows WHERE arxiv_id = ?', [(row[0],) for row in rows])
+            conn.executemany('INSERT INTO paper_rows (arxiv_id, title, abstract) VALUES (?, ?, ?)', rows)
+
+    def index_references(self, references: Dict[str, List[dict]]):
+        with self._conn() as conn:
+            for paper_id, refs in references.items():
+                conn.execute('DELETE FROM reference_rows WHERE paper_id = ?', (paper_id,))
+                conn.executemany(
+                    'INSERT INTO reference_rows (paper_id, idx, arxiv_id, title, author) VALUES (?, ?, ?, ?, ?)',
+                    [(paper_id, i, ref.get("arxiv_id"), clean_field(ref.get("title")), clean_field(ref.get("author"))) for i, ref in enumerate(refs)]
+                )
+
+    def remove_paper(self, arxiv_id: str):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM paper_rows WHERE arxiv_id = ?', (arxiv_id,))
+            conn.execute('DELETE FROM reference_rows WHERE paper_id = ?', (arxiv_id,))
+
+    def search_papers(self, query: str, limit: int = 20, offset: int = 0, prefix: bool = True) -> List[dict]:
+        match = build_query(query, prefix)
+        if match is None:
+            return []
+        # bm25 is lower for better matches, title hits weigh more than abstract hits
+        rows = self._conn().execute('''
+            SELECT paper_rows.arxiv_id, paper_rows.title, snippet(paper_text, 1, '<b>', '</b>', '...', 24), bm25(paper_text, 5.0, 1.0) AS score
+            FROM paper_text JOIN paper_rows ON paper_rows.rowid = paper_text.rowid
+            WHERE paper_text MATCH ?
+            ORDER BY score LIMIT ? OFFSET ?
+        ''', (match, min(limit, MAX_LIMIT), offset))
+        return [{ "arxiv_id": arxiv_id, "title": title, "snippet": snippet, "score": -score } for arxiv_id, title, snippet, score in rows]
+
+    def search_references(self, query: str, limit: int = 20, offset: int = 0, prefix: bool = True) -> List[dict]:
+        match = build_query(query, prefix)
+        if match is None:
+            return []
+        rows = self._conn().execute('''
+            SELECT reference_rows.paper_id, reference_rows.idx, reference_rows.arxiv_id, reference_rows.title, reference_rows.author, bm25(reference_text, 3.0, 1.0) AS score
+            FROM reference_text JOIN reference_rows ON reference_rows.rowid = reference_text.rowid
+            WHERE reference_text MATCH ?
+            ORDER BY score LIMIT ? OFFSET ?
+        ''', (match, min(limit, MAX_LIMIT), offset))
+        return [
+            { "paper_id": paper_id, "index": idx, "arxiv_id": arxiv_id, "title": title, "author": author, "score": -score }
+            for paper_id, idx, arxiv_id, title, author, score in rows
+        ]
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM paper_rows')
+            conn.execute('DELETE FROM reference_rows')
+            # Drops the whole index instead of writing a delete marker for every row
+            conn.execute("INSERT INTO paper_text (paper_text) VALUES ('delete-all')")
+            conn.execute("INSERT INTO reference_text (reference_text) VALUES ('delete-all')")
+
+    # Reindexes every stored paper and reference list, for existing stores and after schema changes
+    def rebuild(self, storage: Storage, batch_size: int = 500) -> Dict[str, int]:
+        self.clear()
+        counts = { "papers": 0, "references": 0 }
+        for batch in iter_batches(storage.list_paper_ids(), batch_size):
+            self.index_papers(storage.get_papers(batch))
+            counts["papers"] += len(batch)
+        for batch in iter_batches(storage.list_reference_ids(), batch_size):
+            references = { arxiv_id: storage.get_references(arxiv_id) or [] for arxiv_id in batch }
+            self.index_references(references)
+            counts["references"] += sum(len(refs) for refs in references.values())
+        with self._conn() as conn:
+            conn.execute("INSERT INTO paper_text (paper_text) VALUES ('optimize')")
+            conn.execute("INSERT INTO reference_text (reference_text) VALUES ('optimize')")
+        return counts
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        return {
+            "papers": conn.execute('SELECT COUNT(*) FROM paper_rows').fetchone()[0],
+            "references": conn.execute('SELECT COUNT(*) FROM reference_rows').fetchone()[0]
+        }
+
+search_index: SearchIndex | None = None
+search_index_lock = threading.Lock()
+
+def get_search_index() -> SearchIndex:
+    global search_index
+    with search_index_lock:
+        if search_index is None:
+            search_index = SearchIndex()
+        return search_index
@@ -1,23 +1,65 @@
-import os
+import json
+from typing import List
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS, cross_origin
 
 from paper import Paper
-from project import Project, get_projects
+from jobs import Job, JobQueue
+from graph import get_graph
+from lib import normalize_arxiv_id
+from cache import ObjectCache
+from metrics import metrics
+from http_cache import body_cache, json_response, make_etag
+from storage import get_storage
+from search import get_search_index
+from related import MAX_K, METHODS, get_related
+from export import EXPORT_TYPES, gzip_lines, iter_export
+from project import Project, get_project_summaries
 
 app = Flask(__name__)
 app.debug = False
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
+# The client reads the validators of the read endpoints to send them back
+app.config['CORS_EXPOSE_HEADERS'] = ['ETag']
+
+# Deserialized papers and projects shared by every request in this process
+object_cache = ObjectCache()
+# Papers are downloaded and parsed in the background, requests only enqueue them
+job_queue = JobQueue()
+
+def ingest_paper(arxiv_id: str) -> dict:
+    paper = Paper(arxiv_id)
+    return {
+        "title": paper.title,
+        "references": len(paper.references),
+        "references_error": paper.reference_error
+    }
+
+def add_to_project(project_name: str, paper_id: str):
+    def on_done(job: Job):
+        if job.error is not None:
+            return
+        project = Project(project_name)
+        project.add_paper(paper_id)
+        object_cache.invalidate_project(project_name)
+    return on_done
+
+# A project page changes with the project record and with every paper on the page
+def project_etag(project: Project, offset: int, limit: int | None, fields: List[str] | None) -> str | None:
+    version = get_storage().project_version(project.name)
+    page = project.page_ids(offset, limit)
+    versions = get_storage().paper_versions(page)
+    if version is None or len(versions) < len(set(page)):
+        return None
+    graph = get_graph()
+    return make_etag('project', project.name, version, offset, limit, fields, [(arxiv_id, versions[arxiv_id], graph.cited_by(arxiv_id)) for arxiv_id in page])
 
 @app.route('/api/project/list', methods=['GET', 'OPTIONS'])
 @cross_origin()
 def getProjects():
-    projects = []
-    for p in get_projects():
-        projects.append(p.to_obj())
-    return jsonify(projects), 200
+    return json_response(lambda: json.dumps(get_project_summaries()), make_etag('projects', get_storage().projects_version()))
 
 @app.route('/api/project/create', methods=["POST", "OPTIONS"])
 @cross_origin()
@@ -26,9 +68,8 @@ def create_project():
     if not 'name' in data:
         return jsonify({ "Error": "No name provided "}), 200
     name = data["name"]
-    if os.path.exists('projects'):
-        if f'{name}.json' in os.listdir('projects'):
-            return jsonify({ "Error": "Project name already taken"}), 200
+    if get_storage().has_project(name):
+        return jsonify({ "Error": "Project name already taken"}), 200
     project = Project(name)
     project.save()
     return jsonify({ "Error": None }), 200
@@ -40,10 +81,17 @@ def get_project_api():
         name = request.args.get('id')
         if name is None:
             return jsonify({ "Error": f"Project \"{name}\" not found"})
+        offset = int(request.args.get('offset', 0))
+        limit = request.args.get('limit')
+        limit = int(limit) if limit is not None else None
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields is not None else None
     except:
         return jsonify({ "Error": "Invalid ID "}), 200
-    project = Project(name)
-    return jsonify(project.to_obj()), 200
+    if not get_storage().has_project(name):
+        return jsonify({ "Error": f"Project \"{name}\" not found"}), 200
+    project = object_cache.get_project(name)
+    return json_response(lambda: json.dumps(project.to_obj(offset, limit, fields)), project_etag(project, offset, limit, fields))
 
 @app.route('/api/paper/create', methods=["POST", 'OPTIONS'])
 @cross_origin()
@@ -57,13 +105,44 @@ def add_paper_api():
     paper_id = body['arxiv_id']
     project_name = body['project_name']
     
-    if not f'{project_name}.json' in os.listdir('projects'):
+    if not get_storage().has_project(project_name):
         return jsonify({ "Error": "Could not find project name in project list"}), 200
     
     project = Project(project_name)
-    err = project.add_paper(paper_id)
-    project.save()
-    return jsonify({ "Error": err }), 200
+    if project.has_paper(paper_id):
+        return jsonify({ "Error": None, "job_id": None }), 200
+    try:
+        job = job_queue.submit(paper_id, 'create', lambda job: ingest_paper(paper_id), add_to_project(project_name, paper_id))
+    except Exception as e:
+        return jsonify({ "Error": str(e) }), 200
+    return jsonify({ "Error": None, "job_id": job.id }), 200
+
+# Adds and removes many papers in one request. Membership changes right away,
+# papers that are not stored yet are ingested in the background. Every given id
+# gets a result with its normalized arxiv id and a status: added, exists,
+# removed, missing, duplicate (repeated in the request) or invalid.
+@app.route('/api/project/papers', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def bulk_papers_api():
+    body = request.json
+    if not 'project_name' in body:
+        return jsonify({ "Error": "Could not find project name in request body"}), 200
+    project_name = body['project_name']
+    add_ids = body.get('add', [])
+    remove_ids = body.get('remove', [])
+    if not isinstance(add_ids, list) or not isinstance(remove_ids, list):
+        return jsonify({ "Error": "\"add\" and \"remove\" must be lists of arxiv ids"}), 200
+    if not get_storage().has_project(project_name):
+        return jsonify({ "Error": "Could not find project name in project list"}), 200
+
+    def ingest(arxiv_id: str) -> str:
+        return job_queue.submit(arxiv_id, 'create', lambda job: ingest_paper(arxiv_id)).id
+
+    project = Project(project_name)
+    removed = project.remove_papers(remove_ids)
+    added = project.add_papers(add_ids, ingest)
+    object_cache.invalidate_project(project_name)
+    return jsonify({ "Error": None, "added": added, "removed": removed }), 200
 
 @app.route('/api/paper/delete', methods=['POST', 'OPTIONS'])
 @cross_origin()
@@ -77,12 +156,14 @@ def delete_paper_api():
     paper_id = body['arxiv_id']
     project_name = body['project_name']
     
-    if not f'{project_name}.json' in os.listdir('projects'):
+    if not get_storage().has_project(project_name):
         return jsonify({ "Error": "Could not find project name in project list"}), 200
     
     project = Project(project_name)
-    project.remove_paper(paper_id)
-    project.save()
+    removed = project.remove_paper(paper_id)
+    object_cache.invalidate_project(project_name)
+    if not removed:
+        return jsonify({ "Error": f"Paper \"{paper_id}\" is not in project \"{project_name}\""}), 200
     return jsonify({ "Error": None }), 200
 
 
@@ -99,8 +180,24 @@ def get_paper_api():
         arxiv_id.index('.')
     except:
         arxiv_id = arxiv_id[:4] + '.' + arxiv_id[4:]
-    paper = Paper(arxiv_id)
-    return jsonify(paper.to_obj()), 200
+    include_data = request.args.get('data') == 'true'
+    version = get_storage().paper_versions([arxiv_id]).get(arxiv_id)
+    # Papers that are not stored yet are ingested by this request, send them without a validator
+    etag = make_etag('paper', arxiv_id, version, include_data, get_graph().cited_by(arxiv_id)) if version is not None else None
+    return json_response(lambda: object_cache.get_paper(arxiv_id).to_json(include_data), etag)
+
+# Every stored paper whose references include the interned record ref_id
+@app.route('/api/reference/cited-by', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def reference_cited_by_api():
+    ref_id = request.args.get('id')
+    if ref_id is None:
+        return jsonify({ "Error": "Must add reference id to request as \"id\""}), 200
+    try:
+        papers = get_storage().citing_papers(ref_id)
+    except NotImplementedError:
+        return jsonify({ "Error": "The storage engine does not intern references" }), 200
+    return jsonify({ "Error": None, "ref_id": ref_id, "papers": papers }), 200
 
 @app.route('/api/paper/get-url', methods=['POST', 'OPTIONS'])
 @cross_origin()
@@ -116,9 +213,190 @@ def reload_paper():
     body = request.json
     if not 'arxiv_id' in body:
         return jsonify({ "Error": "Could not find arxiv id in request body"}), 200
-    paper = Paper(body['arxiv_id'])
-    err = paper.reload()
-    return jsonify({ "Error": err }), 200
+    arxiv_id = body['arxiv_id']
+    # Large .bib files are only parsed when explicitly requested
+    force = 'force' in body and body['force'] == True
+
+    def reload(job: Job):
+        paper = Paper(arxiv_id)
+        reloaded = paper.reload(force)
+        object_cache.invalidate_paper(arxiv_id)
+        return { "reloaded": reloaded }
+
+    try:
+        job = job_queue.submit(arxiv_id, 'reload', reload)
+    except Exception as e:
+        return jsonify({ "Error": str(e) }), 200
+    return jsonify({ "Error": None, "job_id": job.id }), 200
+
+@app.route('/api/job/get', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def get_job_api():
+    job_id = request.args.get('id')
+    if job_id is None:
+        return jsonify({ "Error": "Must add job id to request as \"id\""}), 200
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({ "Error": f"Job \"{job_id}\" not found"}), 200
+    return jsonify(job.to_obj()), 200
+
+@app.route('/api/job/list', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def list_jobs_api():
+    return jsonify(job_queue.list()), 200
+
+# Server-sent events: one "data" event per log line, then a "done" event with the job
+@app.route('/api/job/stream', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def stream_job_api():
+    job_id = request.args.get('id')
+    job = job_queue.get(job_id) if job_id is not None else None
+    if job is None:
+        return jsonify({ "Error": f"Job \"{job_id}\" not found"}), 200
+
+    def events():
+        for line in job.follow():
+            if line is None:
+                yield ': keep-alive\n\n'
+                continue
+            yield f'data: {json.dumps(line)}\n\n'
+        yield f'event: done\ndata: {json.dumps(job.to_obj())}\n\n'
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={ 'Cache-Control': 'no-cache' })
+
+# JSON lines, one per paper and reference, streamed straight from storage.
+# Filters: project, start and end dates (YYYY-MM), has_arxiv_id=true for
+# references, type=papers|references|all, data=true for the raw bib entries,
+# gzip=true to compress on the fly
+@app.route('/api/export', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def export_api():
+    storage = get_storage()
+    paper_ids = None
+    project_name = request.args.get('project')
+    if project_name is not None:
+        project = storage.get_project(project_name)
+        if project is None:
+            return jsonify({ "Error": f"Project \"{project_name}\" not found"}), 200
+        paper_ids = project["papers"]
+    export_type = request.args.get('type', 'all')
+    if export_type not in EXPORT_TYPES:
+        return jsonify({ "Error": f"\"type\" must be one of {', '.join(EXPORT_TYPES)}"}), 200
+    lines = iter_export(
+        storage,
+        paper_ids,
+        request.args.get('start'),
+        request.args.get('end'),
+        request.args.get('has_arxiv_id') == 'true',
+        export_type,
+        request.args.get('data') == 'true'
+    )
+    file_name = f'{project_name or "corpus"}.jsonl'
+    if request.args.get('gzip') == 'true':
+        return Response(stream_with_context(gzip_lines(lines)), mimetype='application/gzip', headers={
+            'Content-Disposition': f'attachment; filename="{file_name}.gz"'
+        })
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename="{file_name}"'
+    })
+
+@app.route('/api/graph/cited-by', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def graph_cited_by():
+    arxiv_id = request.args.get('id')
+    if arxiv_id is None:
+        return jsonify({ "Error": "Must add paper id to request as \"id\""}), 200
+    arxiv_id = normalize_arxiv_id(arxiv_id)
+    return jsonify({ "arxiv_id": arxiv_id, "cited_by": get_graph().cited_by(arxiv_id) }), 200
+
+@app.route('/api/graph/references', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def graph_references():
+    arxiv_id = request.args.get('id')
+    if arxiv_id is None:
+        return jsonify({ "Error": "Must add paper id to request as \"id\""}), 200
+    arxiv_id = normalize_arxiv_id(arxiv_id)
+    return jsonify({ "arxiv_id": arxiv_id, "references": get_graph().references_of(arxiv_id) }), 200
+
+@app.route('/api/graph/neighborhood', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def graph_neighborhood():
+    arxiv_id = request.args.get('id')
+    if arxiv_id is None:
+        return jsonify({ "Error": "Must add paper id to request as \"id\""}), 200
+    try:
+        k = min(int(request.args.get('k', 1)), 5)
+        limit = int(request.args.get('limit', 10000))
+    except ValueError:
+        return jsonify({ "Error": "k and limit must be numbers"}), 200
+    direction = request.args.get('direction', 'both')
+    if direction not in ('in', 'out', 'both'):
+        return jsonify({ "Error": "direction must be one of in, out or both"}), 200
+    arxiv_id = normalize_arxiv_id(arxiv_id)
+    return jsonify({ "arxiv_id": arxiv_id, "papers": get_graph().neighborhood(arxiv_id, k, direction, limit) }), 200
+
+# Most related papers by shared references (coupling), by being cited together
+# (cocitation) or both, with cosine scores
+@app.route('/api/paper/related', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def paper_related():
+    arxiv_id = request.args.get('id')
+    if arxiv_id is None:
+        return jsonify({ "Error": "Must add paper id to request as \"id\""}), 200
+    try:
+        k = max(1, min(int(request.args.get('k', 10)), MAX_K))
+    except ValueError:
+        return jsonify({ "Error": "k must be a number"}), 200
+    method = request.args.get('method', 'both')
+    if method not in METHODS:
+        return jsonify({ "Error": f"method must be one of {', '.join(METHODS)}"}), 200
+    arxiv_id = normalize_arxiv_id(arxiv_id)
+    return jsonify({ "Error": None, "arxiv_id": arxiv_id, "method": method, "related": get_related().related(arxiv_id, k, method) }), 200
+
+@app.route('/api/search', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def search_api():
+    query = request.args.get('q')
+    if query is None:
+        return jsonify({ "Error": "Must add a search query to request as \"q\"" }), 200
+    kind = request.args.get('type', 'all')
+    if kind not in ('papers', 'references', 'all'):
+        return jsonify({ "Error": f"Unknown search type {kind}, expected papers, references or all" }), 200
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+    except:
+        return jsonify({ "Error": "Invalid limit or offset" }), 200
+    prefix = request.args.get('prefix', 'true') != 'false'
+    index = get_search_index()
+    result = { "Error": None, "papers": [], "references": [] }
+    if kind in ('papers', 'all'):
+        result["papers"] = index.search_papers(query, limit, offset, prefix)
+    if kind in ('references', 'all'):
+        result["references"] = index.search_references(query, limit, offset, prefix)
+    return jsonify(result), 200
+
+@app.route('/api/graph/stats', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def graph_stats():
+    return jsonify(get_graph().stats()), 200
+
+@app.route('/api/cache/stats', methods=['GET', 'OPTIONS'])
+@cross_origin()
+def cache_stats():
+    return jsonify({ **object_cache.stats(), "bodies": body_cache.stats() }), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    extra = {}
+    for key, value in object_cache.stats().items():
+        extra[f'arxiv_cache_{key}'] = value
+    for key, value in body_cache.stats().items():
+        extra[f'arxiv_body_cache_{key}'] = value
+    statuses = [job["status"] for job in job_queue.list()]
+    for status in ('queued', 'running', 'done', 'failed'):
+        extra[f'arxiv_jobs{{status="{status}"}}'] = statuses.count(status)
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4'), 200
 
 if __name__ == '__main__':
     app.run(port=4000, host='0.0.0.0')
\ No newline at end of file
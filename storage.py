@@ -0,0 +1,759 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import itertools
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform, the project log is only safe within one process
+    fcntl = None
+
+from lib import normalize_arxiv_id, normalize_title
+
+# Membership changes appended to a project's log before it is folded into the snapshot
+COMPACT_OPS = 1000
+DOI_PREFIX = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:)')
+# Fields that belong to the citing paper rather than to the cited work: the
+# citation key, the stored id, the position in the bibliography and the score of
+# a resolved arxiv id
+CITATION_FIELDS = ('ID', 'ref_id', 'index', 'arxiv_id_score')
+# Fields of a cited work shared by every paper citing it, the rest of a bib entry
+# (venue, notes, formatting) stays with the citing paper
+CANONICAL_FIELDS = ('title', 'author', 'year', 'arxiv_id', 'doi', 'url')
+
+# Identity of a cited work, so every paper citing it shares one record
+def reference_key(record: dict) -> str:
+    if record.get("arxiv_id"):
+        return 'arxiv:' + record["arxiv_id"]
+    if record.get("doi"):
+        return 'doi:' + DOI_PREFIX.sub('', str(record["doi"]).strip().lower())
+    title = normalize_title(str(record["title"])) if record.get("title") else ''
+    if len(title) > 0:
+        return f'title:{title}:{record.get("year", "")}'
+    return 'raw:' + hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+def reference_record(reference: dict) -> dict:
+    return { key: value for key, value in reference.items() if key not in CITATION_FIELDS }
+
+def canonical_record(reference: dict) -> dict:
+    return { key: reference[key] for key in CANONICAL_FIELDS if reference.get(key) is not None }
+
+# Storage engines keep three kinds of records:
+#   papers      the object saved by Paper.load (or the metadata from get_metadata)
+#   references  the list of reference dicts found for a paper. Engines may
+#               intern the cited works, each entry then has a ref_id shared by
+#               every paper citing the same work.
+#   projects    { "name": ..., "papers": [arxiv ids] }
+class Storage:
+    def get_paper(self, arxiv_id: str) -> dict | None:
+        raise NotImplementedError()
+
+    def get_papers(self, arxiv_ids: List[str]) -> Dict[str, dict]:
+        papers = {}
+        for arxiv_id in arxiv_ids:
+            paper = self.get_paper(arxiv_id)
+            if paper is not None:
+                papers[arxiv_id] = paper
+        return papers
+
+    def save_paper(self, arxiv_id: str, obj: dict):
+        raise NotImplementedError()
+
+    def save_papers(self, objs: Dict[str, dict]):
+        for arxiv_id, obj in objs.items():
+            self.save_paper(arxiv_id, obj)
+
+    def list_paper_ids(self) -> List[str]:
+        raise NotImplementedError()
+
+    def get_references(self, arxiv_id: str) -> List[dict] | None:
+        raise NotImplementedError()
+
+    def save_references(self, arxiv_id: str, references: List[dict]):
+        raise NotImplementedError()
+
+    def save_references_batch(self, references: Dict[str, List[dict]]):
+        for arxiv_id, refs in references.items():
+            self.save_references(arxiv_id, refs)
+
+    def list_reference_ids(self) -> List[str]:
+        raise NotImplementedError()
+
+    # [(arxiv_id, updated)] of the reference lists stored after since, as unix times
+    def list_reference_updates(self, since: float = 0.0) -> List[Tuple[str, float]]:
+        raise NotImplementedError()
+
+    # [(ref_id, citation key)] in citation order, None if the paper has no stored references
+    def get_reference_list(self, arxiv_id: str) -> List[Tuple[object, str | None]] | None:
+        raise NotImplementedError()
+
+    # The given arxiv ids that have a stored reference list
+    def stored_reference_lists(self, arxiv_ids: List[str]) -> Set[str]:
+        return { arxiv_id for arxiv_id in arxiv_ids if self.get_reference_list(arxiv_id) is not None }
+
+    # { ref_id: record } with the canonical fields of the cited work
+    def get_reference_records(self, ref_ids: List[object]) -> Dict[object, dict]:
+        raise NotImplementedError()
+
+    # arxiv ids of every paper whose references include ref_id
+    def citing_papers(self, ref_id: object) -> List[str]:
+        raise NotImplementedError()
+
+    # (paper_id, [reference_key of every reference]) for every stored reference list
+    def iter_reference_keys(self, batch_size: int = 500) -> Iterator[Tuple[str, List[str]]]:
+        for batch in iter_batches(self.list_reference_ids(), batch_size):
+            for arxiv_id in batch:
+                references = self.get_references(arxiv_id)
+                if references is not None:
+                    yield arxiv_id, [reference_key(reference_record(reference)) for reference in references]
+
+    def delete_paper(self, arxiv_id: str):
+        raise NotImplementedError()
+
+    def get_project(self, name: str) -> dict | None:
+        raise NotImplementedError()
+
+    def save_project(self, obj: dict):
+        raise NotImplementedError()
+
+    def list_projects(self) -> List[str]:
+        raise NotImplementedError()
+
+    # { "name", "paper_count", "updated" } for every project without loading any papers
+    def list_project_summaries(self) -> List[dict]:
+        raise NotImplementedError()
+
+    # Appends the papers that are not in the project yet, creating the project if
+    # needed, and returns the ids that were added. Safe against concurrent writers.
+    def add_project_papers(self, name: str, arxiv_ids: List[str]) -> List[str]:
+        raise NotImplementedError()
+
+    # Returns the ids that were in the project and are removed now
+    def remove_project_papers(self, name: str, arxiv_ids: List[str]) -> List[str]:
+        raise NotImplementedError()
+
+    def has_project(self, name: str) -> bool:
+        return name in self.list_projects()
+
+    # Versions change whenever the stored record changes, None if there is no record
+    def paper_versions(self, arxiv_ids: List[str]) -> Dict[str, object]:
+        raise NotImplementedError()
+
+    def project_version(self, name: str) -> object:
+        raise NotImplementedError()
+
+    # Changes whenever a project is created or its membership changes, without
+    # reading any membership
+    def projects_version(self) -> object:
+        raise NotImplementedError()
+
+# Membership of one project as an ordered set, with how far into the log it has read
+class ProjectState:
+    def __init__(self, snapshot_version: int | None, papers: List[str]):
+        self.snapshot_version = snapshot_version
+        self.members: Dict[str, None] = dict.fromkeys(papers)
+        self.offset = 0
+        self.ops = 0
+
+    def apply(self, op: dict) -> bool:
+        if op["op"] == 'add':
+            if op["id"] in self.members:
+                return False
+            self.members[op["id"]] = None
+            return True
+        if op["op"] == 'remove':
+            return self.members.pop(op["id"], False) is None
+        return False
+
+# Legacy layout: one json file per record under papers/, references/ and projects/.
+# A project is a snapshot (projects/{name}.json) plus an append-only log of
+# membership changes (projects/{name}.log). Adding or removing a paper appends
+# one line under an flock on projects/{name}.lock, the log is folded into the
+# snapshot once it holds COMPACT_OPS lines. Every process keeps the parsed
+# membership and only reads the part of the log written since its last look.
+class JsonStorage(Storage):
+    def __init__(self, root: str = '.'):
+        self.root = root
+        self.projects: Dict[str, ProjectState] = {}
+        self.projects_lock = threading.Lock()
+
+    def _path(self, folder: str, name: str) -> str:
+        return os.path.join(self.root, folder, f'{name}.json')
+
+    def _read(self, folder: str, name: str):
+        file_name = self._path(folder, name)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'r') as f:
+            return json.load(f)
+
+    def _write(self, folder: str, name: str, obj):
+        folder_path = os.path.join(self.root, folder)
+        if not os.path.exists(folder_path):
+            os.mkdir(folder_path)
+        with open(self._path(folder, name), 'w') as f:
+            json.dump(obj, f, indent=4)
+
+    def _list(self, folder: str) -> List[str]:
+        folder_path = os.path.join(self.root, folder)
+        if not os.path.exists(folder_path):
+            return []
+        return [f.replace('.json', '') for f in os.listdir(folder_path) if f.endswith('.json')]
+
+    def get_paper(self, arxiv_id: str) -> dict | None:
+        return self._read('papers', arxiv_id.replace('.', ''))
+
+    def save_paper(self, arxiv_id: str, obj: dict):
+        self._write('papers', arxiv_id.replace('.', ''), obj)
+
+    def list_paper_ids(self) -> List[str]:
+        return [normalize_arxiv_id(clean_id) for clean_id in self._list('papers')]
+
+    def get_references(self, arxiv_id: str) -> List[dict] | None:
+        return self._read('references', arxiv_id.replace('.', ''))
+
+    def save_references(self, arxiv_id: str, references: List[dict]):
+        self._write('references', arxiv_id.replace('.', ''), references)
+
+    def list_reference_ids(self) -> List[str]:
+        return [normalize_arxiv_id(clean_id) for clean_id in self._list('references')]
+
+    def list_reference_updates(self, since: float = 0.0) -> List[Tuple[str, float]]:
+        updates = []
+        for clean_id in self._list('references'):
+            mtime = self._mtime('references', clean_id)
+            if mtime is not None and mtime / 1e9 > since:
+                updates.append((normalize_arxiv_id(clean_id), mtime / 1e9))
+        return updates
+
+    # Reference files are not interned, a ref_id is the position in the citing paper's file
+    def get_reference_list(self, arxiv_id: str) -> List[Tuple[object, str | None]] | None:
+        references = self.get_references(arxiv_id)
+        if references is None:
+            return None
+        return [(f'{arxiv_id}/{i}', reference.get("ID")) for i, reference in enumerate(references)]
+
+    def get_reference_records(self, ref_ids: List[object]) -> Dict[object, dict]:
+        by_paper: Dict[str, List[Tuple[str, int]]] = {}
+        for ref_id in ref_ids:
+            paper_id, idx = ref_id.rsplit('/', 1)
+            by_paper.setdefault(paper_id, []).append((ref_id, int(idx)))
+        records = {}
+        for paper_id, items in by_paper.items():
+            references = self.get_references(paper_id) or []
+            for ref_id, idx in items:
+                if idx < len(references):
+                    records[ref_id] = canonical_record(references[idx])
+        return records
+
+    def delete_paper(self, arxiv_id: str):
+        for folder in ('papers', 'references'):
+            file_name = self._path(folder, arxiv_id.replace('.', ''))
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def _project_file(self, name: str, extension: str) -> str:
+        return os.path.join(self.root, 'projects', f'{name}.{extension}')
+
+    @contextmanager
+    def _project_lock(self, name: str, exclusive: bool):
+        folder_path = os.path.join(self.root, 'projects')
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path, exist_ok=True)
+        with open(self._project_file(name, 'lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Brings the cached membership up to date with the files, call with the lock held
+    def _project_state(self, name: str) -> ProjectState | None:
+        snapshot_version = self._mtime('projects', name)
+        if snapshot_version is None:
+            with self.projects_lock:
+                self.projects.pop(name, None)
+            return None
+        with self.projects_lock:
+            state = self.projects.get(name)
+            if state is None or state.snapshot_version != snapshot_version:
+                # First look, or another process compacted the log
+                state = ProjectState(snapshot_version, self._read('projects', name)["papers"])
+                self.projects[name] = state
+            try:
+                with open(self._project_file(name, 'log'), 'rb') as f:
+                    f.seek(state.offset)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            # A line without its newline is still being written or was cut off by a crash
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].splitlines():
+                state.ops += 1
+                try:
+                    state.apply(json.loads(line))
+                except ValueError:
+                    continue
+            state.offset += end
+            return state
+
+    def _append_ops(self, name: str, state: ProjectState, ops: List[dict]):
+        if len(ops) == 0:
+            return
+        data = ''.join(json.dumps(op) + '\n' for op in ops).encode('utf-8')
+        with open(self._project_file(name, 'log'), 'ab') as f:
+            f.write(data)
+        with self.projects_lock:
+            state.offset += len(data)
+            state.ops += len(ops)
+        if state.ops >= COMPACT_OPS:
+            self._compact(name, state)
+
+    # Folds the log into a new snapshot, call with the exclusive lock held
+    def _compact(self, name: str, state: ProjectState):
+        file_name = self._path('projects', name)
+        with open(file_name + '.part', 'w') as f:
+            json.dump({ "name": name, "papers": list(state.members) }, f, indent=4)
+        os.replace(file_name + '.part', file_name)
+        with open(self._project_file(name, 'log'), 'wb'):
+            pass
+        with self.projects_lock:
+            state.snapshot_version = self._mtime('projects', name)
+            state.offset = 0
+            state.ops = 0
+
+    def get_project(self, name: str) -> dict | None:
+        with self._project_lock(name, False):
+            state = self._project_state(name)
+            if state is None:
+                return None
+            return { "name": name, "papers": list(state.members) }
+
+    def save_project(self, obj: dict):
+        with self._project_lock(obj["name"], True):
+            state = self._project_state(obj["name"])
+            if state is None:
+                state = ProjectState(None, [])
+                with self.projects_lock:
+                    self.projects[obj["name"]] = state
+            state.members = dict.fromkeys(obj["papers"])
+            self._compact(obj["name"], state)
+
+    def add_project_papers(self, name: str, arxiv_ids: List[str]) -> List[str]:
+        with self._project_lock(name, True):
+            state = self._project_state(name)
+            if state is None:
+                self._write('projects', name, { "name": name, "papers": [] })
+                state = self._project_state(name)
+            added = [arxiv_id for arxiv_id in dict.fromkeys(arxiv_ids) if state.apply({ "op": 'add', "id": arxiv_id })]
+            self._append_ops(name, state, [{ "op": 'add', "id": arxiv_id } for arxiv_id in added])
+            return added
+
+    def remove_project_papers(self, name: str, arxiv_ids: List[str]) -> List[str]:
+        with self._project_lock(name, True):
+            state = self._project_state(name)
+            if state is None:
+                return []
+            removed = [arxiv_id for arxiv_id in dict.fromkeys(arxiv_ids) if state.apply({ "op": 'remove', "id": arxiv_id })]
+            self._append_ops(name, state, [{ "op": 'remove', "id": arxiv_id } for arxiv_id in removed])
+            return removed
+
+    def list_projects(self) -> List[str]:
+        return self._list('projects')
+
+    def list_project_summaries(self) -> List[dict]:
+        summaries = []
+        for name in sorted(self.list_projects()):
+            project = self.get_project(name)
+            if project is None:
+                continue
+            updated = [self._mtime('projects', name), self._mtime_file(self._project_file(name, 'log'))]
+            summaries.append({
+                "name": name,
+                "paper_count": len(project["papers"]),
+                "updated": max(mtime for mtime in updated if mtime is not None) / 1e9
+            })
+        return summaries
+
+    def has_project(self, name: str) -> bool:
+        return os.path.exists(self._path('projects', name))
+
+    def _mtime(self, folder: str, name: str) -> int | None:
+        return self._mtime_file(self._path(folder, name))
+
+    def _mtime_file(self, file_name: str) -> int | None:
+        try:
+            return os.stat(file_name).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def stored_reference_lists(self, arxiv_ids: List[str]) -> Set[str]:
+        return { arxiv_id for arxiv_id in arxiv_ids if self._mtime('references', arxiv_id.replace('.', '')) is not None }
+
+    def paper_versions(self, arxiv_ids: List[str]) -> Dict[str, object]:
+        versions = {}
+        for arxiv_id in arxiv_ids:
+            clean_id = arxiv_id.replace('.', '')
+            paper_mtime = self._mtime('papers', clean_id)
+            if paper_mtime is not None:
+                versions[arxiv_id] = (paper_mtime, self._mtime('references', clean_id))
+        return versions
+
+    def project_version(self, name: str) -> object:
+        snapshot_version = self._mtime('projects', name)
+        if snapshot_version is None:
+            return None
+        try:
+            log_size = os.path.getsize(self._project_file(name, 'log'))
+        except FileNotFoundError:
+            log_size = 0
+        # Appends within one mtime tick still grow the log
+        return (snapshot_version, self._mtime_file(self._project_file(name, 'log')), log_size)
+
+    def projects_version(self) -> object:
+        return [(name, self.project_version(name)) for name in sorted(self.list_projects())]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS papers (
+    arxiv_id TEXT PRIMARY KEY,
+    title TEXT,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reference_lists (
+    paper_id TEXT PRIMARY KEY,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reference_records (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    arxiv_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reference_records_arxiv_id ON reference_records (arxiv_id);
+-- One row per citation: the cited work it points to and the citing paper's
+-- own bib entry for it
+CREATE TABLE IF NOT EXISTS paper_refs (
+    paper_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    ref_id INTEGER NOT NULL,
+    cite_key TEXT,
+    citation TEXT NOT NULL,
+    PRIMARY KEY (paper_id, idx)
+);
+CREATE INDEX IF NOT EXISTS paper_refs_ref_id ON paper_refs (ref_id);
+CREATE TABLE IF NOT EXISTS projects (
+    name TEXT PRIMARY KEY,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS project_papers (
+    project TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    arxiv_id TEXT NOT NULL,
+    PRIMARY KEY (project, arxiv_id)
+);
+CREATE INDEX IF NOT EXISTS project_papers_position ON project_papers (project, position);
+CREATE INDEX IF NOT EXISTS project_papers_arxiv_id ON project_papers (arxiv_id);
+'''
+
+class SqliteStorage(Storage):
+    def __init__(self, file_name: str = 'arxiv.db'):
+        self.file_name = file_name
+        self.local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    # sqlite connections can not be shared between threads, keep one per thread
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.file_name, timeout=30, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get_paper(self, arxiv_id: str) -> dict | None:
+        row = self._conn().execute('SELECT data FROM papers WHERE arxiv_id = ?', (arxiv_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_papers(self, arxiv_ids: List[str]) -> Dict[str, dict]:
+        papers = {}
+        conn = self._conn()
+        # Stay well under the sqlite host parameter limit
+        for i in range(0, len(arxiv_ids), 500):
+            batch = arxiv_ids[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            for arxiv_id, data in conn.execute(f'SELECT arxiv_id, data FROM papers WHERE arxiv_id IN ({placeholders})', batch):
+                papers[arxiv_id] = json.loads(data)
+        return papers
+
+    def save_paper(self, arxiv_id: str, obj: dict):
+        self.save_papers({ arxiv_id: obj })
+
+    def save_papers(self, objs: Dict[str, dict]):
+        now = time.time()
+        rows = [(arxiv_id, obj.get("title"), json.dumps(obj), now) for arxiv_id, obj in objs.items()]
+        with self._conn() as conn:
+            conn.executemany('INSERT OR REPLACE INTO papers (arxiv_id, title, data, updated) VALUES (?, ?, ?, ?)', rows)
+
+    def list_paper_ids(self) -> List[str]:
+        return [row[0] for row in self._conn().execute('SELECT arxiv_id FROM papers')]
+
+    # Every citation keeps the bib entry it was saved with, the shared record only
+    # supplies the ref_id
+    def get_references(self, arxiv_id: str) -> List[dict] | None:
+        conn = self._conn()
+        if conn.execute('SELECT 1 FROM reference_lists WHERE paper_id = ?', (arxiv_id,)).fetchone() is None:
+            return None
+        references = []
+        for ref_id, citation in conn.execute('SELECT ref_id, citation FROM paper_refs WHERE paper_id = ? ORDER BY idx', (arxiv_id,)):
+            reference = json.loads(citation)
+            reference["ref_id"] = ref_id
+            references.append(reference)
+        return references
+
+    def get_reference_list(self, arxiv_id: str) -> List[Tuple[object, str | None]] | None:
+        conn = self._conn()
+        if conn.execute('SELECT 1 FROM reference_lists WHERE paper_id = ?', (arxiv_id,)).fetchone() is None:
+            return None
+        return conn.execute('SELECT ref_id, cite_key FROM paper_refs WHERE paper_id = ? ORDER BY idx', (arxiv_id,)).fetchall()
+
+    def get_reference_records(self, ref_ids: List[object]) -> Dict[object, dict]:
+        records = {}
+        conn = self._conn()
+        for batch in iter_batches(ref_ids, 500):
+            placeholders = ','.join('?' * len(batch))
+            for ref_id, data in conn.execute(f'SELECT id, data FROM reference_records WHERE id IN ({placeholders})', batch):
+                records[ref_id] = json.loads(data)
+        return records
+
+    def citing_papers(self, ref_id: object) -> List[str]:
+        rows = self._conn().execute('SELECT DISTINCT paper_id FROM paper_refs WHERE ref_id = ? ORDER BY paper_id', (ref_id,))
+        return [row[0] for row in rows]
+
+    # The keys were computed when the records were interned, one streamed join reads them all
+    def iter_reference_keys(self, batch_size: int = 500) -> Iterator[Tuple[str, List[str]]]:
+        rows = self._conn().execute('''
+            SELECT paper_refs.paper_id, reference_records.key
+            FROM paper_refs JOIN reference_records ON reference_records.id = paper_refs.ref_id
+            ORDER BY paper_refs.paper_id, paper_refs.idx
+        ''')
+        for paper_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            yield paper_id, [row[1] for row in group]
+
+    # Stores every cited work once and returns the record ids in order. The first
+    # paper to cite a work writes its record, later ones only fill in fields it
+    # lacks. A record that changes moves the version of every paper citing it.
+    def _intern(self, conn: sqlite3.Connection, references: List[dict], now: float) -> List[int]:
+        keys = [reference_key(reference_record(reference)) for reference in references]
+        records: Dict[str, dict] = {}
+        for key, reference in zip(keys, references):
+            record = records.setdefault(key, {})
+            for field, value in canonical_record(reference).items():
+                record.setdefault(field, value)
+        conn.executemany(
+            'INSERT OR IGNORE INTO reference_records (key, arxiv_id, data) VALUES (?, ?, ?)',
+            [(key, record.get("arxiv_id"), json.dumps(record)) for key, record in records.items()]
+        )
+        ids = {}
+        changed = []
+        for batch in iter_batches(list(records), 500):
+            placeholders = ','.join('?' * len(batch))
+            for ref_id, key, data in conn.execute(f'SELECT id, key, data FROM reference_records WHERE key IN ({placeholders})', batch):
+                ids[key] = ref_id
+                stored = json.loads(data)
+                merged = dict(stored)
+                for field, value in records[key].items():
+                    merged.setdefault(field, value)
+                if merged != stored:
+                    conn.execute('UPDATE reference_records SET data = ? WHERE id = ?', (json.dumps(merged), ref_id))
+                    changed.append(ref_id)
+        for batch in iter_batches(changed, 500):
+            placeholders = ','.join('?' * len(batch))
+            conn.execute(f'''
+                UPDATE reference_lists SET updated = ?
+                WHERE paper_id IN (SELECT paper_id FROM paper_refs WHERE ref_id IN ({placeholders}))
+            ''', [now] + batch)
+        return [ids[key] for key in keys]
+
+    def _save_reference_list(self, conn: sqlite3.Connection, arxiv_id: str, references: List[dict], now: float):
+        conn.execute('DELETE FROM paper_refs WHERE paper_id = ?', (arxiv_id,))
+        ref_ids = self._intern(conn, references, now)
+        conn.executemany(
+            'INSERT INTO paper_refs (paper_id, idx, ref_id, cite_key, citation) VALUES (?, ?, ?, ?, ?)',
+            [
+                (arxiv_id, i, ref_id, reference.get("ID"), json.dumps({ key: value for key, value in reference.items() if key != 'ref_id' }))
+                for i, (ref_id, reference) in enumerate(zip(ref_ids, references))
+            ]
+        )
+
+    def save_references(self, arxiv_id: str, references: List[dict]):
+        self.save_references_batch({ arxiv_id: references })
+
+    def save_references_batch(self, references: Dict[str, List[dict]]):
+        now = time.time()
+        with self._conn() as conn:
+            for arxiv_id, refs in references.items():
+                self._save_reference_list(conn, arxiv_id, refs, now)
+                conn.execute('INSERT OR REPLACE INTO reference_lists (paper_id, updated) VALUES (?, ?)', (arxiv_id, now))
+
+    def list_reference_ids(self) -> List[str]:
+        return [row[0] for row in self._conn().execute('SELECT paper_id FROM reference_lists')]
+
+    def list_reference_updates(self, since: float = 0.0) -> List[Tuple[str, float]]:
+        return self._conn().execute('SELECT paper_id, updated FROM reference_lists WHERE updated > ?', (since,)).fetchall()
+
+    def stored_reference_lists(self, arxiv_ids: List[str]) -> Set[str]:
+        stored = set()
+        conn = self._conn()
+        for batch in iter_batches(arxiv_ids, 500):
+            placeholders = ','.join('?' * len(batch))
+            stored.update(row[0] for row in conn.execute(f'SELECT paper_id FROM reference_lists WHERE paper_id IN ({placeholders})', batch))
+        return stored
+
+    def delete_paper(self, arxiv_id: str):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM papers WHERE arxiv_id = ?', (arxiv_id,))
+            # Reference records stay, other papers may cite the same works
+            conn.execute('DELETE FROM paper_refs WHERE paper_id = ?', (arxiv_id,))
+            conn.execute('DELETE FROM reference_lists WHERE paper_id = ?', (arxiv_id,))
+
+    def get_project(self, name: str) -> dict | None:
+        conn = self._conn()
+        if conn.execute('SELECT 1 FROM projects WHERE name = ?', (name,)).fetchone() is None:
+            return None
+        rows = conn.execute('SELECT arxiv_id FROM project_papers WHERE project = ? ORDER BY position', (name,))
+        return {
+            "name": name,
+            "papers": [row[0] for row in rows]
+        }
+
+    def save_project(self, obj: dict):
+        self.save_projects([obj])
+
+    def save_projects(self, objs: List[dict]):
+        now = time.time()
+        with self._conn() as conn:
+            for obj in objs:
+                conn.execute('INSERT OR REPLACE INTO projects (name, updated) VALUES (?, ?)', (obj["name"], now))
+                conn.execute('DELETE FROM project_papers WHERE project = ?', (obj["name"],))
+                conn.executemany(
+                    'INSERT OR IGNORE INTO project_papers (project, position, arxiv_id) VALUES (?, ?, ?)',
+                    [(obj["name"], i, arxiv_id) for i, arxiv_id in enumerate(obj["papers"])]
+                )
+
+    # One indexed statement per paper, the position is taken inside the insert so
+    # concurrent writers can not hand out the same one
+    def add_project_papers(self, name: str, arxiv_ids: List[str]) -> List[str]:
+        added = []
+        with self._conn() as conn:
+            conn.execute('INSERT OR IGNORE INTO projects (name, updated) VALUES (?, ?)', (name, time.time()))
+            for arxiv_id in dict.fromkeys(arxiv_ids):
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO project_papers (project, position, arxiv_id)
+                    SELECT ?, COALESCE(MAX(position), -1) + 1, ? FROM project_papers WHERE project = ?
+                ''', (name, arxiv_id, name))
+                if cursor.rowcount > 0:
+                    added.append(arxiv_id)
+            if len(added) > 0:
+                conn.execute('UPDATE projects SET updated = ? WHERE name = ?', (time.time(), name))
+        return added
+
+    def remove_project_papers(self, name: str, arxiv_ids: List[str]) -> List[str]:
+        removed = []
+        with self._conn() as conn:
+            for arxiv_id in dict.fromkeys(arxiv_ids):
+                cursor = conn.execute('DELETE FROM project_papers WHERE project = ? AND arxiv_id = ?', (name, arxiv_id))
+                if cursor.rowcount > 0:
+                    removed.append(arxiv_id)
+            if len(removed) > 0:
+                conn.execute('UPDATE projects SET updated = ? WHERE name = ?', (time.time(), name))
+        return removed
+
+    def list_projects(self) -> List[str]:
+        return [row[0] for row in self._conn().execute('SELECT name FROM projects ORDER BY name')]
+
+    def list_project_summaries(self) -> List[dict]:
+        rows = self._conn().execute('''
+            SELECT projects.name, COUNT(project_papers.arxiv_id), projects.updated
+            FROM projects LEFT JOIN project_papers ON project_papers.project = projects.name
+            GROUP BY projects.name
+            ORDER BY projects.name
+        ''')
+        return [{ "name": name, "paper_count": count, "updated": updated } for name, count, updated in rows]
+
+    def has_project(self, name: str) -> bool:
+        return self._conn().execute('SELECT 1 FROM projects WHERE name = ?', (name,)).fetchone() is not None
+
+    def paper_versions(self, arxiv_ids: List[str]) -> Dict[str, object]:
+        versions = {}
+        conn = self._conn()
+        for batch in iter_batches(arxiv_ids, 500):
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(f'''
+                SELECT papers.arxiv_id, papers.updated, reference_lists.updated
+                FROM papers LEFT JOIN reference_lists ON reference_lists.paper_id = papers.arxiv_id
+                WHERE papers.arxiv_id IN ({placeholders})
+            ''', batch)
+            for arxiv_id, paper_updated, references_updated in rows:
+                versions[arxiv_id] = (paper_updated, references_updated)
+        return versions
+
+    def project_version(self, name: str) -> object:
+        row = self._conn().execute('SELECT updated FROM projects WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    # Every membership change sets the project's updated time
+    def projects_version(self) -> object:
+        return tuple(self._conn().execute('SELECT COUNT(*), MAX(updated) FROM projects').fetchone())
+
+def iter_batches(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# One-shot copy of the legacy json layout into an sqlite database
+def migrate_json_to_sqlite(source: JsonStorage, target: SqliteStorage, batch_size: int = 500) -> Dict[str, int]:
+    counts = { "papers": 0, "references": 0, "projects": 0 }
+    for batch in iter_batches(source.list_paper_ids(), batch_size):
+        target.save_papers(source.get_papers(batch))
+        counts["papers"] += len(batch)
+    for batch in iter_batches(source.list_reference_ids(), batch_size):
+        target.save_references_batch({ arxiv_id: source.get_references(arxiv_id) for arxiv_id in batch })
+        counts["references"] += len(batch)
+    projects = []
+    for name in source.list_projects():
+        projects.append(source.get_project(name))
+    target.save_projects(projects)
+    counts["projects"] = len(projects)
+    return counts
+
+storage: Storage | None = None
+storage_lock = threading.Lock()
+
+# The engine is picked with ARXIV_STORAGE (sqlite or json), sqlite is the default
+def get_storage() -> Storage:
+    global storage
+    with storage_lock:
+        if storage is None:
+            if os.environ.get('ARXIV_STORAGE', 'sqlite') == 'json':
+                storage = JsonStorage()
+            else:
+                storage = SqliteStorage(os.environ.get('ARXIV_DB', 'arxiv.db'))
+        return storage
+
+def set_storage(engine: Storage):
+    global storage
+    with storage_lock:
+        storage = engine